@@ -0,0 +1,51 @@
+"""
+Allergener som bitmask för Matplanerare
+En produkts allergentaggar blir ett heltal med en bit per tagg, och en allergiprofil
+blir en mask med alla taggar den utesluter. Ett enda `produktmask & allergimask`
+avgör om produkten ska filtreras bort - för en hel NumPy-array av kandidater på en gång.
+
+TAGGAR (se ALLERGEN-TAGGAR i scraper.py):
+    gluten, lactose, nuts, eggs, fish, soy, meat, animal
+
+KOSTVAL SOM UTESLUTER FLERA TAGGAR:
+- vegetarian: meat, fish
+- vegan: animal, meat, fish
+
+OBS: Bitarnas ordning sparas i databasen (products.allergen_mask) - lägg bara till
+nya taggar sist i ALLERGEN_TAGS.
+"""
+
+ALLERGEN_TAGS = ('gluten', 'lactose', 'nuts', 'eggs', 'fish', 'soy', 'meat', 'animal')
+ALLERGEN_BITS = {tag: 1 << bit for bit, tag in enumerate(ALLERGEN_TAGS)}
+
+# Allergi/kostval -> taggar som utesluts
+EXCLUDED_TAGS = {tag: (tag,) for tag in ALLERGEN_TAGS}
+EXCLUDED_TAGS['vegetarian'] = ('meat', 'fish')
+EXCLUDED_TAGS['vegan'] = ('animal', 'meat', 'fish')
+
+
+def allergen_mask(tags):
+    """Bitmask för en produkts allergentaggar (okända taggar saknar bit och ignoreras)"""
+    mask = 0
+    for tag in tags or ():
+        mask |= ALLERGEN_BITS.get(tag.strip().lower(), 0)
+    return mask
+
+
+def allergy_mask(allergies):
+    """Bitmask med alla taggar som en lista allergier/kostval utesluter"""
+    mask = 0
+    for allergy in allergies or ():
+        for tag in EXCLUDED_TAGS.get(allergy.lower(), ()):
+            mask |= ALLERGEN_BITS[tag]
+    return mask
+
+
+def unknown_allergies(allergies):
+    """Allergier utan egen bit - de jämförs direkt mot produktens taggar"""
+    return [allergy.lower() for allergy in allergies or () if allergy.lower() not in EXCLUDED_TAGS]
+
+
+def mask_to_tags(mask):
+    """Taggarna i en bitmask (i ALLERGEN_TAGS-ordning)"""
+    return [tag for tag in ALLERGEN_TAGS if mask & ALLERGEN_BITS[tag]]
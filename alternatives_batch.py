@@ -0,0 +1,126 @@
+"""
+Alternativ för en hel inköpslista i ett svep för Matplanerare
+Används av /api/shopping-lists/<id>/alternatives: samma resultat som find_alternatives
+och find_combined_alternatives för varje vara, men det som varorna har gemensamt
+räknas en gång per lista i stället för en gång per vara.
+
+DELAT MELLAN VARORNA:
+- Allergifiltret: planens allergimask (allergens.allergy_mask) mot hela katalogen, en gång
+- Kandidatpooler per (pool, kategorier) - varor i samma kategori och näringsprofil
+  delar katalograderna (se MatsparScraper._candidate_rows)
+- Resultat per produkt och målvikt - samma vara två gånger räknas en gång
+- Ersättningscachen (MatsparScraper.substitution_cache) som alla listor och workers delar
+
+Varorna räknas i listans ordning och lämnas ut en i taget (run är en generator),
+så att svaret kan strömmas medan resten av listan räknas.
+"""
+
+import time
+
+import numpy as np
+
+from allergens import allergy_mask, unknown_allergies
+from substitution_graph import product_fingerprint
+
+SINGLE_LIMIT = 8
+COMBINED_LIMIT = 5
+# Antal enskilda alternativ som find_combined_alternatives kombinerar
+COMBINATION_CANDIDATES = 20
+
+
+class AlternativesBatch:
+    """Enskilda och kombinerade alternativ för flera varor med samma allergier och budget"""
+
+    def __init__(self, scraper, allergies=None, budget=None, limit=SINGLE_LIMIT, combined_limit=COMBINED_LIMIT):
+        """
+        Args:
+            scraper: MatsparScraper vars katalog och rankingfunktioner används
+            allergies: Allergier att undvika (planens)
+            budget: Max pris per ersättning (listans budget)
+            limit: Max antal enskilda alternativ per vara
+            combined_limit: Max antal kombinationer per vara
+        """
+        self.scraper = scraper
+        self.allergies = list(allergies or [])
+        self.budget = budget
+        self.limit = limit
+        self.combined_limit = combined_limit
+        self.catalog = None
+        self.stats = {'items': 0, 'duplicates': 0, 'pools': 0, 'seconds': 0.0}
+        self._reset()
+
+    def _reset(self):
+        """Börja om med scraperns aktuella katalog (delade rader gäller bara en katalog)"""
+        self.catalog = self.scraper.catalog
+        self._allowed = None
+        self._pools = {}
+        self._results = {}
+
+    @property
+    def allowed(self):
+        """Allergifiltret för hela katalogen: True för rader som får föreslås"""
+        if self._allowed is None:
+            allowed = (self.catalog.features.allergens & allergy_mask(self.allergies)) == 0
+            for allergy in unknown_allergies(self.allergies):
+                allowed &= np.array([allergy not in p.get('allergens', []) for p in self.catalog], dtype=bool)
+            self._allowed = allowed
+        return self._allowed
+
+    def candidate_rows(self, category, profile, pool):
+        """Som MatsparScraper._candidate_rows, men varje pool byggs en gång per batch"""
+        if pool == 'same':
+            key = (pool, (category or '').lower())
+        else:
+            related = self.scraper._get_related_categories(category, profile)
+            key = (pool, tuple((cat or '').lower() for cat in related))
+        rows = self._pools.get(key)
+        if rows is None:
+            rows = self._pools[key] = self.scraper._candidate_rows(category, profile, pool)
+            self.stats['pools'] += 1
+        return rows
+
+    def alternatives(self, product, limit):
+        """find_alternatives (ej samma kategori) med batchens allergier, budget och pooler"""
+        scraper = self.scraper
+        cached = scraper.substitutions.lookup(product, self.allergies, self.budget, False, limit)
+        if cached is not None:
+            return cached
+        return scraper._cached_alternatives(product, self.allergies, self.budget, False, limit, batch=self)
+
+    def combinations(self, product, target_grams):
+        """find_combined_alternatives med batchens allergier, budget och pooler"""
+        return self.scraper._cached_combinations(
+            product, target_grams, self.allergies, self.budget, self.combined_limit,
+            lambda: self.alternatives(product, COMBINATION_CANDIDATES)
+        )
+
+    def run(self, items):
+        """
+        Args:
+            items: Följd av (nyckel, produkt-dict, målvikt i gram) - produkt None ger tomma svar
+
+        Yields:
+            (nyckel, enskilda alternativ, kombinerade alternativ) för en vara i taget
+        """
+        for key, product, target_grams in items:
+            if product is None:
+                yield key, [], []
+                continue
+            started = time.monotonic()
+            if self.scraper.catalog is not self.catalog:
+                self._reset()
+
+            result_key = (product_fingerprint(product), target_grams)
+            result = self._results.get(result_key)
+            if result is None:
+                single = self.alternatives(product, self.limit)
+                combined = []
+                if product.get('nutrition'):
+                    combined = self.combinations(product, target_grams)
+                result = self._results[result_key] = (single, combined)
+            else:
+                self.stats['duplicates'] += 1
+
+            self.stats['items'] += 1
+            self.stats['seconds'] = round(self.stats['seconds'] + time.monotonic() - started, 4)
+            yield key, result[0], result[1]
@@ -0,0 +1,163 @@
+"""
+Förberäknade alternativ för Matplanerare
+Ersättningsrutan öppnas ofta direkt efter att en lista har genererats. När listgenereringen
+har committats läggs listan i en kö, och en bakgrundstråd räknar fram enskilda och
+kombinerade alternativ för alla varor (AlternativesBatch) och sparar dem i en begränsad cache.
+Alternativ-endpointsen svarar från cachen när den är varm och räknar live annars.
+
+CACHEN:
+- SharedCache('alternatives'): LRU med högst MATSPAR_ALTERNATIVES_CACHE_SIZE poster
+  (standard 5000), delas mellan gunicorn-workers
+- Nyckel: varans ID och listversion - en hash av allt svaret beror på: produkten
+  (namn, kategori, näringsvärden, priser), målvikten, listans budget, planens allergier
+  och katalogens version. Byts produkten, ändras antalet eller planen blir det en miss
+- Träffar och missar räknas av SharedCache och visas i /api/metrics
+
+BAKGRUNDSTRÅDEN (låg prioritet):
+- En tråd och en lista i taget, med en paus mellan varorna (MATSPAR_ALTERNATIVES_PAUSE_MS,
+  standard 5 ms) så att requests inte får vänta på den
+- MATSPAR_ALTERNATIVES_PRECOMPUTE=thread|off (standard thread)
+"""
+
+import hashlib
+import os
+import queue
+import threading
+import time
+
+from alternatives_batch import AlternativesBatch
+from cache import SharedCache, make_key
+from substitution_graph import product_fingerprint
+
+DEFAULT_MODE = os.environ.get('MATSPAR_ALTERNATIVES_PRECOMPUTE', 'thread').lower()
+DEFAULT_CACHE_SIZE = int(os.environ.get('MATSPAR_ALTERNATIVES_CACHE_SIZE', 5000))
+DEFAULT_TTL = 6 * 3600
+DEFAULT_PAUSE = float(os.environ.get('MATSPAR_ALTERNATIVES_PAUSE_MS', 5)) / 1000
+
+
+def list_version(product, target_grams, allergies, budget, catalog_version):
+    """Version av allt som alternativen för en vara beror på"""
+    raw = make_key(
+        product_fingerprint(product),
+        sorted(product.get('prices', {}).items()),
+        target_grams,
+        sorted(allergy.lower() for allergy in allergies or ()),
+        budget,
+        catalog_version
+    )
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+class AlternativesPrecomputer:
+    """Bakgrundsberäkning av alternativ för nya listor, med cache per vara och version"""
+
+    def __init__(self, app, scraper, load_list, cache=None, pause=DEFAULT_PAUSE, mode=DEFAULT_MODE):
+        """
+        Args:
+            app: Flask-appen (databasen läses i en app-kontext i bakgrundstråden)
+            scraper: MatsparScraper som räknar alternativen
+            load_list: Funktion list_id -> (allergier, budget, [(vara-ID, produkt-dict, målvikt), ...])
+                       eller None om listan inte finns
+            cache: SharedCache att spara i (standard: namnrymden 'alternatives')
+            pause: Sekunder att vänta mellan varorna
+            mode: 'thread' (bakgrundstråd) eller 'off' (schedule gör ingenting)
+        """
+        self.app = app
+        self.scraper = scraper
+        self.load_list = load_list
+        self.cache = cache or SharedCache('alternatives', max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_TTL, stale_ttl=0)
+        self.pause = pause
+        self.mode = mode
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'scheduled': 0, 'lists': 0, 'items': 0, 'errors': 0, 'last_list_seconds': None}
+
+    def version(self, product, target_grams, allergies, budget):
+        return list_version(product, target_grams, allergies, budget, self.scraper.catalog.version)
+
+    @staticmethod
+    def _key(item_id, version):
+        return make_key('item', item_id, version)
+
+    # ============== UPPSLAG ==============
+
+    def get(self, item_id, version):
+        """Förberäknat svar {'single': [...], 'combined': [...]} eller None"""
+        value, state = self.cache.get(self._key(item_id, version))
+        return value if state == 'fresh' else None
+
+    # ============== BAKGRUNDSBERÄKNING ==============
+
+    def schedule(self, list_id):
+        """Lägg en lista i kön (anropas efter commit)"""
+        if self.mode == 'off':
+            return
+        with self._lock:
+            self._stats['scheduled'] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='alternatives-precompute', daemon=True)
+                self._thread.start()
+        self._queue.put(list_id)
+
+    def _run(self):
+        while True:
+            list_id = self._queue.get()
+            try:
+                self.precompute(list_id)
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                print(f"Förberäkning av alternativ misslyckades (lista {list_id}): {e}")
+            finally:
+                self._queue.task_done()
+
+    def precompute(self, list_id):
+        """
+        Räkna fram och spara alternativen för alla varor i en lista
+
+        Returns:
+            Antal varor som sparades
+        """
+        started = time.monotonic()
+        with self.app.app_context():
+            loaded = self.load_list(list_id)
+        if loaded is None:
+            return 0
+        allergies, budget, entries = loaded
+
+        products = {item_id: (product, target_grams) for item_id, product, target_grams in entries if product}
+        batch = AlternativesBatch(self.scraper, allergies, budget)
+        stored = 0
+        for item_id, single, combined in batch.run(entries):
+            if item_id not in products:
+                continue
+            product, target_grams = products[item_id]
+            self.cache.set(
+                self._key(item_id, self.version(product, target_grams, allergies, budget)),
+                {
+                    # Samma svar som endpointen: utan nuvarande produkt
+                    'single': [a for a in single if a.get('name') != product.get('name')],
+                    'combined': combined
+                }
+            )
+            stored += 1
+            time.sleep(self.pause)
+
+        with self._lock:
+            self._stats['lists'] += 1
+            self._stats['items'] += stored
+            self._stats['last_list_seconds'] = round(time.monotonic() - started, 3)
+        return stored
+
+    def wait(self):
+        """Vänta tills kön är tom (för mätningar och skript)"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mode'] = self.mode
+        stats['queued'] = self._queue.qsize()
+        stats['cache'] = self.cache.stats()
+        return stats
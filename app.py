@@ -7,14 +7,19 @@ En app för att planera mat baserat på näringsbehov och generera inköpslistor
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, make_response
-from database import db, init_db, Product, Price, Nutrition, NutritionPlan, ShoppingList, ShoppingItem, Recipe, UserSession, ALLERGENS, RDI_VALUES
+from flask import Flask, render_template, request, jsonify, redirect, url_for, make_response, Response, stream_with_context
+from sqlalchemy import event, insert
+from sqlalchemy.orm import selectinload
+from database import db, init_db, Product, NutritionPlan, ShoppingList, ShoppingItem, Recipe, UserSession, ALLERGENS, RDI_VALUES, upsert_products
 from scraper import MatsparScraper
+from alternatives_batch import AlternativesBatch, COMBINED_LIMIT, SINGLE_LIMIT
+from alternatives_cache import AlternativesPrecomputer
+from price_refresher import PriceRefresher
+from generation import GenerationCache, ListGenerator, StageTimings, nutrition_report
+from jobs import JobCancelled, JobQueue, QueueFull
 import os
-import math
 import csv
 import io
-import re
 import json
 import uuid
 
@@ -29,9 +34,23 @@ init_db(app)
 # Initiera scraper
 scraper = MatsparScraper()
 
+# Färdiga listor per indata (töms när prisuppdateraren skrivit nya priser)
+generation_cache = GenerationCache()
+
+# Bakgrundsuppdatering av priser (MATSPAR_PRICE_REFRESHER=thread). Request-vägen läser då
+# bara sökcache och lokal data - matspar.se anropas enbart av uppdateraren.
+price_refresher = None
+if os.environ.get('MATSPAR_PRICE_REFRESHER', 'off').lower() == 'thread':
+    scraper.online_search = False
+    price_refresher = PriceRefresher(app, scraper, invalidates=[generation_cache])
+    price_refresher.start()
+
 # Tillgängliga butiker
 STORES = ['ICA', 'Coop', 'Willys', 'Hemköp', 'Lidl', 'City Gross']
 
+# Stegtider för listgenereringen (visas i /api/metrics)
+generation_timings = StageTimings()
+
 
 def get_or_create_session():
     """Hämtar eller skapar ett unikt session-ID för användaren"""
@@ -256,45 +275,34 @@ def api_search():
     return jsonify(products)
 
 
+@app.route('/api/metrics')
+def api_metrics():
+    """Driftstatistik (cachar m.m.) för dimensionering och felsökning"""
+    return jsonify({
+        'search_cache': scraper.cache_stats(),
+        'rate_limiter': scraper.rate_limiter.stats(),
+        'circuit_breaker': scraper.breaker.stats(),
+        'timeouts': scraper.timeouts.stats(),
+        'sessions': scraper.sessions.stats(),
+        'price_refresher': price_refresher.stats() if price_refresher else None,
+        'http_fixtures': scraper.fixtures.stats() if scraper.fixtures else None,
+        'substitution_graph': scraper.substitutions.stats(),
+        'substitution_cache': scraper.substitution_cache_stats(),
+        'alternatives_precompute': alternatives_precomputer.stats(),
+        'generation': generation_timings.stats(),
+        'generation_cache': generation_cache.stats(),
+        'jobs': job_queue.stats()
+    })
+
+
 @app.route('/api/products', methods=['GET', 'POST'])
 def api_products():
     """API för sparade produkter"""
     if request.method == 'POST':
         data = request.json
         
-        # Skapa produkt
-        product = Product(
-            name=data.get('name'),
-            brand=data.get('brand'),
-            weight=data.get('weight'),
-            category=data.get('category'),
-            matspar_url=data.get('url')
-        )
-        db.session.add(product)
-        db.session.flush()  # Få produkt-ID
-        
-        # Lägg till priser
-        for store, price in data.get('prices', {}).items():
-            price_obj = Price(
-                product_id=product.id,
-                store=store,
-                price=price
-            )
-            db.session.add(price_obj)
-        
-        # Lägg till näringsvärden om de finns
-        if data.get('nutrition'):
-            nutr = data['nutrition']
-            nutrition = Nutrition(
-                product_id=product.id,
-                calories=nutr.get('calories'),
-                protein=nutr.get('protein'),
-                carbs=nutr.get('carbs'),
-                fat=nutr.get('fat'),
-                fiber=nutr.get('fiber'),
-                salt=nutr.get('salt')
-            )
-            db.session.add(nutrition)
+        # Samma produkt (namn, varumärke, vikt) återanvänds och uppdateras
+        product = upsert_products([data])[0]
         
         db.session.commit()
         return jsonify(product.to_dict()), 201
@@ -502,20 +510,8 @@ def api_add_shopping_item(list_id):
         product = Product.query.get(data['product_id'])
     
     if not product and data.get('product'):
-        # Skapa ny produkt från sökresultat
-        prod_data = data['product']
-        product = Product(
-            name=prod_data.get('name'),
-            weight=prod_data.get('weight'),
-            matspar_url=prod_data.get('url')
-        )
-        db.session.add(product)
-        db.session.flush()
-        
-        # Lägg till priser
-        for store, price in prod_data.get('prices', {}).items():
-            price_obj = Price(product_id=product.id, store=store, price=price)
-            db.session.add(price_obj)
+        # Produkt från sökresultat - återanvänds om den redan finns (naturlig nyckel)
+        product = upsert_products([data['product']])[0]
     
     if product:
         item = ShoppingItem(
@@ -607,17 +603,21 @@ def api_generate_list():
     
     SMART BERÄKNING:
     1. Beräknar totalt näringsbehov (dagar × personer × dagsbehov)
-    2. Väljer produkter baserat på deras näringsinnehåll per 100g
-    3. Beräknar exakt kvantitet baserat på produktens vikt
-    4. Stoppar när näringsbehoven är uppfyllda
+    2. Söker kandidater för varje produktkategori (flera per kategori)
+    3. Löser antal förpackningar per kandidat (list_solver): planens mål och lägen
+       (target ±20 %, min, max, ignore) till lägsta pris inom budget
     
     Stödjer:
     - Allergifiltrering (från näringsplan)
     - Budget (totalt)
     - Hushållsstorlek (skalar mängder)
-    - Budgetprioritering (billigare alternativ vid behov)
+    - Budgetprioritering (billigaste kombinationen som når målen)
     - Måltidsfilter (välja bort frukost etc.)
     - AI-receptgenerering (Gemini)
+    
+    Genereringen körs som jobb (jobs.py): svaret är 202 med jobbet, och listan finns i
+    /api/jobs/<id> (result, http_status 201) när status är 'done'. Finns en färdig lista
+    med samma indata (GenerationCache) kopieras den direkt och svaret är 201 med listan.
     """
     data = request.json
     plan_id = data.get('plan_id')
@@ -635,525 +635,168 @@ def api_generate_list():
     use_ai_recipes = data.get('use_ai_recipes', False)
     
     session_id = get_or_create_session()
+    # Finns inte planen svarar vi direkt i stället för via jobbet
     plan = NutritionPlan.query.filter_by(id=plan_id, session_id=session_id).first_or_404()
     
-    # Hämta allergier från plan
-    allergies = plan.get_allergies_list()
+    params = {
+        'plan_id': plan_id,
+        'session_id': session_id,
+        'days': days,
+        'store': store,
+        'budget': budget,
+        'household_size': household_size,
+        'prefer_cheaper': prefer_cheaper,
+        'include_breakfast': include_breakfast,
+        'include_lunch': include_lunch,
+        'include_dinner': include_dinner,
+        'include_snacks': include_snacks,
+        'use_ai_recipes': use_ai_recipes
+    }
+    
+    # Samma indata som en cachad lista: kopian tar millisekunder, så ingen kö behövs
+    generator = _list_generator(plan, params)
+    if not use_ai_recipes and generator.cached() is not None:
+        result, status = _generate_list(generator, session_id)
+        return jsonify(result), status
+    
+    return _submit_generation('list', session_id, params)
+
+
+def _list_generator(plan, params, progress=None):
+    """ListGenerator för parametrarna till /api/generate-list"""
+    return ListGenerator(
+        scraper, plan,
+        days=params['days'],
+        household_size=params['household_size'],
+        store=params['store'],
+        budget=params['budget'],
+        prefer_cheaper=params['prefer_cheaper'],
+        allergies=plan.get_allergies_list(),
+        include_breakfast=params['include_breakfast'],
+        include_lunch=params['include_lunch'],
+        include_dinner=params['include_dinner'],
+        include_snacks=params['include_snacks'],
+        recorder=generation_timings,
+        progress=progress,
+        cache=generation_cache
+    )
+
+
+def _run_list_job(params, progress):
+    """Jobb för /api/generate-list (körs i jobbkön, se jobs.py)"""
+    plan = NutritionPlan.query.filter_by(id=params['plan_id'], session_id=params['session_id']).first()
+    if plan is None:
+        return {'error': 'Näringsplanen hittades inte'}, 404
     
     # Om AI-recept är aktiverat, använd den nya metoden
-    if use_ai_recipes:
+    if params['use_ai_recipes']:
         return generate_with_ai_recipes(
             plan=plan,
-            days=days,
-            store=store,
-            household_size=household_size,
-            budget=budget,
-            include_breakfast=include_breakfast,
-            include_lunch=include_lunch,
-            include_dinner=include_dinner,
-            include_snacks=include_snacks,
-            allergies=allergies,
-            session_id=session_id
+            days=params['days'],
+            store=params['store'],
+            household_size=params['household_size'],
+            budget=params['budget'],
+            include_breakfast=params['include_breakfast'],
+            include_lunch=params['include_lunch'],
+            include_dinner=params['include_dinner'],
+            include_snacks=params['include_snacks'],
+            allergies=plan.get_allergies_list(),
+            session_id=params['session_id'],
+            progress=progress
         )
     
-    # ============== BERÄKNA TOTALT NÄRINGSBEHOV ==============
-    # Justera baserat på vilka måltider som inkluderas
-    meal_fraction = 0
-    if include_breakfast:
-        meal_fraction += 0.20
-    if include_lunch:
-        meal_fraction += 0.35
-    if include_dinner:
-        meal_fraction += 0.35
-    if include_snacks:
-        meal_fraction += 0.10
-    
-    # Normalisera så vi får rätt totala kalorier
-    if meal_fraction > 0:
-        adjustment = 1.0 / meal_fraction
-    else:
-        adjustment = 1.0
-    
-    # Totalt behov = dagligt behov × antal dagar × antal personer
-    total_calories_needed = plan.calories_target * days * household_size
-    total_protein_needed = plan.protein_target * days * household_size
-    total_carbs_needed = plan.carbs_target * days * household_size
-    total_fat_needed = plan.fat_target * days * household_size
-    total_fiber_needed = plan.fiber_target * days * household_size
-    
-    # Dagliga värden per person (för beräkningar)
-    daily_calories = plan.calories_target
-    daily_protein = plan.protein_target
-    
-    # Spåra uppfyllnad
-    current_calories = 0
-    current_protein = 0
-    current_carbs = 0
-    current_fat = 0
-    current_fiber = 0
-    
-    # ============== NY MÅLTIDSBASERAD STRATEGI ==============
-    # Vi beräknar utifrån antal måltider som behöver täckas
-    #
-    # Antal måltider som behöver mat (baserat på vad som valts):
-    num_breakfasts = days * household_size if include_breakfast else 0
-    num_lunches = days * household_size if include_lunch else 0
-    num_dinners = days * household_size if include_dinner else 0
-    num_snacks = days * household_size if include_snacks else 0
-    
-    # Kalorifördelning per måltid (baserat på plan):
-    # Frukost: 20% | Lunch: 35% | Middag: 35% | Mellanmål: 10%
-    breakfast_kcal_per_person = daily_calories * 0.20  # ~500 kcal för 2500
-    lunch_kcal_per_person = daily_calories * 0.35      # ~875 kcal för 2500
-    dinner_kcal_per_person = daily_calories * 0.35     # ~875 kcal för 2500
-    snack_kcal_per_person = daily_calories * 0.10      # ~250 kcal för 2500
-    
-    # ============== PRODUKTKATEGORIER - KÖPER TILLRÄCKLIGT FÖR ALLA MÅLTIDER ==============
-    # Varje produkt specificerar:
-    # - meals: antal måltider denna produkt ska täcka (baserat på num_breakfasts etc)
-    # - portion_grams: gram per portion
-    # - kcal_per_100g: ungefärliga kalorier (fallback om nutrition saknas)
-    
-    product_categories = []
-    
-    # ===== FRUKOST (endast om vald) =====
-    if include_breakfast:
-        product_categories.extend([
-            # Frukostar: gröt, bröd+pålägg, ägg, müsli etc
-            {'search': 'havregryn', 'priority': 1, 'type': 'breakfast', 'kcal_per_100g': 370,
-             'meals': int(num_breakfasts * 0.6), 'portion_grams': 70},  # Gröt ~60% av frukostar
-            
-            {'search': 'bröd', 'priority': 1, 'type': 'breakfast', 'kcal_per_100g': 250,
-             'meals': int(num_breakfasts * 1.0), 'portion_grams': 80},  # Bröd till alla frukostar + smörgås
-            
-            {'search': 'ägg', 'priority': 1, 'type': 'breakfast', 'kcal_per_100g': 155,
-             'meals': int(num_breakfasts * 0.6), 'portion_grams': 120},  # Ägg de flesta morgnar + matlagning
-            
-            {'search': 'mjölk', 'priority': 2, 'type': 'breakfast', 'kcal_per_100g': 45,
-             'meals': int(num_breakfasts * 1.5), 'portion_grams': 250},  # Till gröt, kaffe, etc
-            
-            {'search': 'yoghurt', 'priority': 2, 'type': 'breakfast', 'kcal_per_100g': 60,
-             'meals': int(num_breakfasts * 0.4), 'portion_grams': 200},
-            
-            {'search': 'smör', 'priority': 2, 'type': 'fat', 'kcal_per_100g': 720,
-             'meals': int(num_breakfasts * 1.5), 'portion_grams': 15},  # Smörgås
-            
-            {'search': 'ost', 'priority': 2, 'type': 'dairy', 'kcal_per_100g': 350,
-             'meals': int(num_breakfasts * 0.8), 'portion_grams': 30},  # Smörgåsost
-        ])
-    
-    # ===== LUNCH & MIDDAG - PROTEIN (endast om lunch eller middag vald) =====
-    if include_lunch or include_dinner:
-        num_main_meals = num_lunches + num_dinners
-        product_categories.extend([
-            # Huvudmåltider: num_lunches + num_dinners st
-            {'search': 'kycklingfilé', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 120,
-             'meals': int(num_main_meals * 0.3), 'portion_grams': 175},  # ~30% av måltider
-            
-            {'search': 'nötfärs', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 205,
-             'meals': int(num_main_meals * 0.25), 'portion_grams': 150},  # ~25% av måltider
-            
-            {'search': 'lax', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 205,
-             'meals': int(num_main_meals * 0.15), 'portion_grams': 150},  # Fisk ~15%
-            
-            {'search': 'fläskfilé', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 145,
-             'meals': int(num_main_meals * 0.1), 'portion_grams': 150},  # ~10%
-            
-            {'search': 'korv', 'priority': 2, 'type': 'protein', 'kcal_per_100g': 280,
-             'meals': int(num_main_meals * 0.1), 'portion_grams': 120},  # ~10%
-            
-            # ===== LUNCH & MIDDAG - KOLHYDRATER =====
-            {'search': 'pasta', 'priority': 1, 'type': 'carbs', 'kcal_per_100g': 355,
-             'meals': int(num_main_meals * 0.35), 'portion_grams': 100},  # ~35% av måltider
-            
-            {'search': 'ris', 'priority': 1, 'type': 'carbs', 'kcal_per_100g': 355,
-             'meals': int(num_main_meals * 0.35), 'portion_grams': 85},  # ~35%
-            
-            {'search': 'potatis', 'priority': 1, 'type': 'carbs', 'kcal_per_100g': 85,
-             'meals': int(num_main_meals * 0.3), 'portion_grams': 300},  # ~30%
-            
-            # ===== FETTER - KRITISKT FÖR KALORIER =====
-            {'search': 'olja', 'priority': 2, 'type': 'fat', 'kcal_per_100g': 880,
-             'meals': int(num_main_meals * 0.6), 'portion_grams': 15},  # Stekning
-            
-            {'search': 'grädde', 'priority': 3, 'type': 'fat', 'kcal_per_100g': 290,
-             'meals': int(num_dinners * 0.3), 'portion_grams': 100},  # Till såser
-            
-            # ===== GRÖNSAKER =====
-            {'search': 'tomat', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 20,
-             'meals': int(num_main_meals * 0.4), 'portion_grams': 150},
-            
-            {'search': 'gurka', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 12,
-             'meals': int(num_lunches * 0.4), 'portion_grams': 100},
-            
-            {'search': 'morot', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 35,
-             'meals': int(num_main_meals * 0.3), 'portion_grams': 100},
-            
-            {'search': 'broccoli', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 35,
-             'meals': int(num_dinners * 0.4), 'portion_grams': 150},
-            
-            {'search': 'lök', 'priority': 4, 'type': 'vegetables', 'kcal_per_100g': 40,
-             'meals': int(num_dinners * 0.6), 'portion_grams': 75},
-            
-            {'search': 'paprika', 'priority': 4, 'type': 'vegetables', 'kcal_per_100g': 25,
-             'meals': int(num_dinners * 0.3), 'portion_grams': 100},
-        ])
-    
-    # ===== MELLANMÅL & FRUKT (endast om valt) =====
-    if include_snacks:
-        product_categories.extend([
-            {'search': 'banan', 'priority': 2, 'type': 'snack', 'kcal_per_100g': 95,
-             'meals': int(num_snacks * 0.6), 'portion_grams': 130},
-            
-            {'search': 'äpple', 'priority': 2, 'type': 'snack', 'kcal_per_100g': 55,
-             'meals': int(num_snacks * 0.5), 'portion_grams': 180},
-            
-            {'search': 'kvarg', 'priority': 2, 'type': 'snack', 'kcal_per_100g': 65,
-             'meals': int(num_snacks * 0.5), 'portion_grams': 200},
-        ])
+    return _generate_list(_list_generator(plan, params, progress), params['session_id'])
+
+
+def _generate_list(generator, session_id):
+    """Generera listan och bygg svaret för /api/generate-list"""
+    # ============== GENERERA (behov → kandidater → kvantiteter → persistens) ==============
+    # Med samma indata som en tidigare lista kopieras den i stället (GenerationCache)
+    shopping_list, demand, solution = generator.generate(session_id)
+    _precompute_alternatives_after_commit(shopping_list)
+    db.session.commit()
     
-    # Lägg till vegetariska proteinkällor om vegetarian/vegan
-    if 'vegetarian' in allergies or 'vegan' in allergies:
-        # Ta bort köttprodukter och lägg till vegetariska
-        protein_meals = int((num_lunches + num_dinners) * 0.25)
-        product_categories = [p for p in product_categories if p['type'] != 'protein' or 'ägg' in p['search']]
-        product_categories.insert(0, {'search': 'tofu', 'portion_grams': 200, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 120, 'meals': protein_meals})
-        product_categories.insert(1, {'search': 'quorn', 'portion_grams': 150, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 100, 'meals': protein_meals})
-        product_categories.insert(2, {'search': 'linser', 'portion_grams': 100, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 115, 'meals': protein_meals})
-        product_categories.insert(3, {'search': 'bönor', 'portion_grams': 150, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 130, 'meals': protein_meals})
-        product_categories.insert(4, {'search': 'sojafärs', 'portion_grams': 125, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 140, 'meals': protein_meals})
-    
-    # Sortera efter prioritet
-    product_categories.sort(key=lambda x: x['priority'])
-    
-    # Skapa ny inköpslista
-    shopping_list = ShoppingList(
-        session_id=session_id,
-        name=f"Inköpslista - {plan.name} ({days} dagar, {household_size} pers)",
-        store=store,
-        days=days,
-        plan_id=plan_id,
-        budget=budget,
-        household_size=household_size
+    # Svaret läser alla varor med produkter, priser och näringsvärden - ladda dem i ett svep
+    # (efter commit är raderna utgångna och skulle annars laddas en och en)
+    shopping_list = (
+        ShoppingList.query
+        .options(
+            selectinload(ShoppingList.items).selectinload(ShoppingItem.product).selectinload(Product.prices),
+            selectinload(ShoppingList.items).selectinload(ShoppingItem.product).selectinload(Product.nutrition)
+        )
+        .populate_existing()
+        .filter_by(id=shopping_list.id)
+        .one()
     )
-    db.session.add(shopping_list)
-    db.session.flush()
     
-    added_products = []
-    running_total = 0
+    # Lägg till info om näringsuppfyllnad i svaret
+    result = shopping_list.to_dict()
+    result.update(nutrition_report(demand, solution))
     
-    def parse_weight_grams(weight_str):
-        """Konvertera viktstring till gram (t.ex. '500g' -> 500, '1kg' -> 1000)"""
-        if not weight_str:
-            return 500  # Anta 500g om okänd
-        weight_str = str(weight_str).lower().replace(' ', '')
-        
-        # Hantera kg
-        kg_match = re.search(r'(\d+(?:[.,]\d+)?)\s*kg', weight_str)
-        if kg_match:
-            return float(kg_match.group(1).replace(',', '.')) * 1000
-        
-        # Hantera gram
-        g_match = re.search(r'(\d+(?:[.,]\d+)?)\s*g', weight_str)
-        if g_match:
-            return float(g_match.group(1).replace(',', '.'))
-        
-        # Hantera liter (mjölk etc) - anta 1L = 1000g
-        l_match = re.search(r'(\d+(?:[.,]\d+)?)\s*l', weight_str)
-        if l_match:
-            return float(l_match.group(1).replace(',', '.')) * 1000
-        
-        # Hantera dl
-        dl_match = re.search(r'(\d+)\s*dl', weight_str)
-        if dl_match:
-            return float(dl_match.group(1)) * 100
-        
-        # Hantera ml
-        ml_match = re.search(r'(\d+)\s*ml', weight_str)
-        if ml_match:
-            return float(ml_match.group(1))
-        
-        # Hantera st (ägg: 6st ≈ 360g, 12st ≈ 720g)
-        st_match = re.search(r'(\d+)\s*st', weight_str)
-        if st_match:
-            count = int(st_match.group(1))
-            return count * 60  # Anta 60g per styck
-        
-        return 500  # Default
-    
-    # ============== BYGG LISTAN SMART ==============
-    for product_info in product_categories:
-        # Kolla om vi redan nått våra mål (med 10% marginal)
-        calories_fulfilled = current_calories >= total_calories_needed * 0.9
-        protein_fulfilled = current_protein >= total_protein_needed * 0.9
-        carbs_fulfilled = current_carbs >= total_carbs_needed * 0.9
-        
-        # Hoppa över proteinkällor om vi har tillräckligt protein
-        if product_info['type'] == 'protein' and protein_fulfilled and calories_fulfilled:
-            continue
-        
-        # Hoppa över kolhydrater om vi har tillräckligt
-        if product_info['type'] == 'carbs' and carbs_fulfilled and calories_fulfilled:
-            continue
-        
-        # Sök produkt med allergifiltrering
-        results = scraper.search_products_filtered(
-            product_info['search'], 
-            allergies=allergies,
-            prefer_cheaper=prefer_cheaper or (budget is not None),
-            limit=3
-        )
-        
-        if not results:
-            continue
-        
-        prod_data = results[0]
-        
-        # Hämta pris
-        prod_prices = prod_data.get('prices', {})
-        if store and store in prod_prices:
-            prod_price = prod_prices[store]
-        else:
-            prod_price = min(prod_prices.values()) if prod_prices else 0
-        
-        # ============== SMART KVANTITETSBERÄKNING ==============
-        # Använder 'meals' för antal måltider produkten ska täcka
-        portion_grams = product_info['portion_grams']
-        meals_to_cover = product_info.get('meals', 1)  # Antal måltider att täcka
-        
-        # Totalt antal gram som behövs för alla måltider
-        total_grams_needed = portion_grams * meals_to_cover
-        
-        # Hur mycket är det i en förpackning?
-        pack_grams = parse_weight_grams(prod_data.get('weight', '500g'))
-        
-        # Hur många förpackningar behövs? (runda upp för att täcka behovet)
-        quantity = max(1, math.ceil(total_grams_needed / pack_grams))
-        
-        # Begränsa till rimliga mängder (men mer generös för att nå mål)
-        max_quantity = max(2, math.ceil(days * household_size / 2))  # Generösare max
-        quantity = min(quantity, max_quantity)
-        
-        item_cost = prod_price * quantity
-        
-        # Budgetkontroll
-        if budget and running_total + item_cost > budget:
-            # Försök med billigare alternativ
-            for alt in results[1:]:
-                alt_prices = alt.get('prices', {})
-                if store and store in alt_prices:
-                    alt_price = alt_prices[store]
-                else:
-                    alt_price = min(alt_prices.values()) if alt_prices else 0
-                
-                alt_cost = alt_price * quantity
-                if running_total + alt_cost <= budget:
-                    prod_data = alt
-                    prod_price = alt_price
-                    item_cost = alt_cost
-                    pack_grams = parse_weight_grams(alt.get('weight', '500g'))
-                    break
-            else:
-                # Minska kvantitet eller hoppa över
-                if quantity > 1:
-                    quantity = max(1, quantity - 1)
-                    item_cost = prod_price * quantity
-                    if running_total + item_cost > budget:
-                        continue
-                else:
-                    continue
-        
-        running_total += item_cost
-        
-        # Beräkna näringsbidrag från denna produkt
-        nutr_data = prod_data.get('nutrition', {})
-        actual_grams = pack_grams * quantity
-        
-        if nutr_data and nutr_data.get('calories'):
-            # Näringsvärden är per 100g, beräkna för faktisk mängd
-            factor = actual_grams / 100
-            current_calories += (nutr_data.get('calories') or 0) * factor
-            current_protein += (nutr_data.get('protein') or 0) * factor
-            current_carbs += (nutr_data.get('carbs') or 0) * factor
-            current_fat += (nutr_data.get('fat') or 0) * factor
-            current_fiber += (nutr_data.get('fiber') or 0) * factor
-        else:
-            # Använd uppskattade värden från product_info om nutrition saknas
-            factor = actual_grams / 100
-            est_kcal = product_info.get('kcal_per_100g', 100)
-            current_calories += est_kcal * factor
-        
-        # Spara produkt i databas
-        product = Product(
-            name=prod_data.get('name'),
-            brand=prod_data.get('brand'),
-            weight=prod_data.get('weight'),
-            category=prod_data.get('category', product_info['type']),
-            matspar_url=prod_data.get('url'),
-            image_url=prod_data.get('image'),
-            allergen_tags=','.join(prod_data.get('allergens', []))
-        )
-        db.session.add(product)
-        db.session.flush()
-        
-        # Lägg till priser
-        for store_name, price in prod_data.get('prices', {}).items():
-            price_obj = Price(product_id=product.id, store=store_name, price=price)
-            db.session.add(price_obj)
-        
-        # Lägg till näringsvärden
-        if nutr_data:
-            nutrition = Nutrition(
-                product_id=product.id,
-                calories=nutr_data.get('calories'),
-                protein=nutr_data.get('protein'),
-                carbs=nutr_data.get('carbs'),
-                fat=nutr_data.get('fat'),
-                fiber=nutr_data.get('fiber'),
-                salt=nutr_data.get('salt'),
-                vitamin_c=nutr_data.get('vitamin_c'),
-                vitamin_d=nutr_data.get('vitamin_d'),
-                vitamin_a=nutr_data.get('vitamin_a'),
-                calcium=nutr_data.get('calcium'),
-                iron=nutr_data.get('iron'),
-                potassium=nutr_data.get('potassium')
-            )
-            db.session.add(nutrition)
-        
-        # Lägg till i lista
-        item = ShoppingItem(
-            list_id=shopping_list.id,
-            product_id=product.id,
-            quantity=quantity
-        )
-        db.session.add(item)
-        added_products.append(f"{prod_data.get('name')} x{quantity}")
-    
-    # ============== FYLLNADS-LOOP: Säkerställ att vi når kalori-målet ==============
-    # Om vi fortfarande saknar >10% av kalorierna, köp mer av kaloritäta produkter
-    calories_deficit = total_calories_needed - current_calories
-    calories_coverage = (current_calories / total_calories_needed * 100) if total_calories_needed else 100
-    
-    if calories_coverage < 90:
-        # Lista med kaloritäta produkter att fylla med
-        filler_products = [
-            {'search': 'nötfärs', 'kcal_per_100g': 205, 'portion_grams': 400},   # Protein + kalorier
-            {'search': 'kycklingfilé', 'kcal_per_100g': 120, 'portion_grams': 400},
-            {'search': 'pasta', 'kcal_per_100g': 355, 'portion_grams': 500},
-            {'search': 'ris', 'kcal_per_100g': 355, 'portion_grams': 500},
-            {'search': 'havregryn', 'kcal_per_100g': 370, 'portion_grams': 500},
-            {'search': 'bröd', 'kcal_per_100g': 250, 'portion_grams': 500},
-            {'search': 'ost', 'kcal_per_100g': 350, 'portion_grams': 200},
-            {'search': 'smör', 'kcal_per_100g': 720, 'portion_grams': 250},
-        ]
-        
-        for filler in filler_products:
-            if current_calories >= total_calories_needed * 0.98:
-                break  # Nära nog - 98% är bra
-            
-            # Hur mycket saknas?
-            remaining_deficit = total_calories_needed - current_calories
-            
-            # Sök produkten
-            filler_results = scraper.search_products_filtered(
-                filler['search'], 
-                allergies=allergies,
-                prefer_cheaper=True,
-                limit=1
-            )
-            
-            if not filler_results:
-                continue
-            
-            filler_prod = filler_results[0]
-            filler_prices = filler_prod.get('prices', {})
-            filler_price = min(filler_prices.values()) if filler_prices else 0
-            
-            # Beräkna hur mycket vi behöver för att fylla deficit
-            grams_needed = (remaining_deficit / filler['kcal_per_100g']) * 100
-            pack_grams = parse_weight_grams(filler_prod.get('weight', '500g'))
-            # Mer aggressiv: köp hela behovet, inte bara halva
-            extra_quantity = max(1, math.ceil(grams_needed / pack_grams * 0.7))  # 70% för att inte överdriva massivt
-            
-            extra_cost = filler_price * extra_quantity
-            
-            # Budgetkontroll
-            if budget and running_total + extra_cost > budget:
-                continue
-            
-            running_total += extra_cost
-            
-            # Lägg till kalorier
-            nutr = filler_prod.get('nutrition', {})
-            actual_grams = pack_grams * extra_quantity
-            kcal_added = (nutr.get('calories') or filler['kcal_per_100g']) * actual_grams / 100
-            current_calories += kcal_added
-            current_protein += (nutr.get('protein') or 0) * actual_grams / 100
-            current_carbs += (nutr.get('carbs') or 0) * actual_grams / 100
-            current_fat += (nutr.get('fat') or 0) * actual_grams / 100
-            
-            # Spara produkt
-            filler_product = Product(
-                name=filler_prod.get('name'),
-                brand=filler_prod.get('brand'),
-                weight=filler_prod.get('weight'),
-                category=filler_prod.get('category'),
-                image_url=filler_prod.get('image'),
-                allergen_tags=','.join(filler_prod.get('allergens', []))
-            )
-            db.session.add(filler_product)
-            db.session.flush()
-            
-            for store_name, price in filler_prod.get('prices', {}).items():
-                price_obj = Price(product_id=filler_product.id, store=store_name, price=price)
-                db.session.add(price_obj)
-            
-            if nutr:
-                nutrition = Nutrition(
-                    product_id=filler_product.id,
-                    calories=nutr.get('calories'),
-                    protein=nutr.get('protein'),
-                    carbs=nutr.get('carbs'),
-                    fat=nutr.get('fat'),
-                    fiber=nutr.get('fiber')
-                )
-                db.session.add(nutrition)
-            
-            filler_item = ShoppingItem(
-                list_id=shopping_list.id,
-                product_id=filler_product.id,
-                quantity=extra_quantity
-            )
-            db.session.add(filler_item)
-            added_products.append(f"{filler_prod.get('name')} x{extra_quantity} (extra)")
+    return result, 201
+
+
+def _run_recipes_job(params, progress):
+    """Jobb för /api/shopping-lists/<id>/regenerate-recipes"""
+    shopping_list = db.session.get(ShoppingList, params['list_id'])
+    plan = db.session.get(NutritionPlan, shopping_list.plan_id) if shopping_list else None
+    if plan is None:
+        return {'error': 'Ingen näringsplan kopplad till listan'}, 400
     
-    _update_list_total(shopping_list)
-    db.session.commit()
+    return generate_with_ai_recipes(
+        plan=plan,
+        days=shopping_list.days,
+        store=shopping_list.store,
+        household_size=shopping_list.household_size or 1,
+        budget=shopping_list.budget,
+        include_breakfast=params.get('include_breakfast', True),
+        include_lunch=params.get('include_lunch', True),
+        include_dinner=params.get('include_dinner', True),
+        include_snacks=params.get('include_snacks', False),
+        allergies=plan.get_allergies_list(),
+        previous_list_id=shopping_list.id,
+        progress=progress
+    )
+
+
+# Genereringsjobb (MATSPAR_GENERATION_JOBS=thread|off, se jobs.py)
+job_queue = JobQueue(app, {'list': _run_list_job, 'recipes': _run_recipes_job})
+
+
+def _submit_generation(kind, session_id, params):
+    """Lägg genereringen i jobbkön (202 med jobbet), eller kör den direkt om kön är avstängd"""
+    if not job_queue.enabled:
+        result, status = job_queue.run_inline(kind, params)
+        return jsonify(result), status
     
-    # Lägg till info om näringsuppfyllnad i svaret
-    result = shopping_list.to_dict()
-    result['nutrition_coverage'] = {
-        'calories': round(current_calories / total_calories_needed * 100) if total_calories_needed else 0,
-        'protein': round(current_protein / total_protein_needed * 100) if total_protein_needed else 0,
-        'carbs': round(current_carbs / total_carbs_needed * 100) if total_carbs_needed else 0,
-        'fat': round(current_fat / total_fat_needed * 100) if total_fat_needed else 0,
-    }
-    result['nutrition_totals'] = {
-        'calories': round(current_calories),
-        'protein': round(current_protein),
-        'carbs': round(current_carbs),
-        'fat': round(current_fat),
-        'fiber': round(current_fiber)
-    }
-    result['nutrition_targets'] = {
-        'calories': round(total_calories_needed),
-        'protein': round(total_protein_needed),
-        'carbs': round(total_carbs_needed),
-        'fat': round(total_fat_needed),
-        'fiber': round(total_fiber_needed)
-    }
+    try:
+        job = job_queue.submit(kind, session_id, params)
+    except QueueFull:
+        response = jsonify({'error': 'Många genereringar pågår just nu. Försök igen om en stund.'})
+        response.headers['Retry-After'] = '10'
+        return response, 503
     
-    return jsonify(result), 201
+    response = jsonify(job.to_dict())
+    response.headers['Location'] = url_for('api_get_job', job_id=job.id)
+    return response, 202
+
+
+@app.route('/api/jobs/<job_id>')
+def api_get_job(job_id):
+    """Status för ett genereringsjobb - result och http_status finns när status är 'done'"""
+    job = job_queue.get(job_id, request.cookies.get('matplanerare_session'))
+    if job is None:
+        return jsonify({'error': 'Jobbet hittades inte'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """Avbryt ett genereringsjobb (köade direkt, pågående vid nästa steg)"""
+    job = job_queue.cancel(job_id, request.cookies.get('matplanerare_session'))
+    if job is None:
+        return jsonify({'error': 'Jobbet hittades inte'}), 404
+    return jsonify(job.to_dict())
 
 
 # ============== PRODUKTERSÄTTNING ==============
@@ -1218,35 +861,8 @@ def api_substitute_item(item_id):
     if not item.original_product_id:
         item.original_product_id = item.product_id
     
-    # Skapa ny produkt från substitut
-    new_product = Product(
-        name=substitute.get('name'),
-        brand=substitute.get('brand'),
-        weight=substitute.get('weight'),
-        category=substitute.get('category'),
-        image_url=substitute.get('image'),
-        allergen_tags=','.join(substitute.get('allergens', []))
-    )
-    db.session.add(new_product)
-    db.session.flush()
-    
-    # Lägg till priser
-    for store_name, price in substitute.get('prices', {}).items():
-        price_obj = Price(product_id=new_product.id, store=store_name, price=price)
-        db.session.add(price_obj)
-    
-    # Lägg till näringsvärden
-    nutr_data = substitute.get('nutrition', {})
-    if nutr_data:
-        nutrition = Nutrition(
-            product_id=new_product.id,
-            calories=nutr_data.get('calories'),
-            protein=nutr_data.get('protein'),
-            carbs=nutr_data.get('carbs'),
-            fat=nutr_data.get('fat'),
-            fiber=nutr_data.get('fiber')
-        )
-        db.session.add(nutrition)
+    # Produkt för substitutet (befintlig rad återanvänds på naturlig nyckel)
+    new_product = upsert_products([substitute])[0]
     
     # Uppdatera item med ny produkt
     item.product_id = new_product.id
@@ -1315,7 +931,7 @@ def api_substitute_combined(item_id):
         item.original_product_id = item.product_id
     
     # Hitta de nya produkterna
-    # Produkterna kan vara antingen från databasen eller från FALLBACK_PRODUCTS
+    # Produkterna kan vara antingen från databasen eller från produktkatalogen
     new_items_created = []
     
     for idx, (prod_id, qty) in enumerate(zip(product_ids, quantities)):
@@ -1340,50 +956,14 @@ def api_substitute_combined(item_id):
                 db.session.add(new_item)
                 new_items_created.append(new_item)
         else:
-            # Produkten finns inte i DB - leta i FALLBACK_PRODUCTS
-            fallback_product = None
-            for cat_products in scraper.FALLBACK_PRODUCTS.values():
-                for p in cat_products:
-                    if p.get('id') == prod_id:
-                        fallback_product = p
-                        break
-                if fallback_product:
-                    break
+            # Produkten finns inte i DB - slå upp den i produktkatalogen (stabila ID:n)
+            fallback_product = scraper.get_product_by_id(prod_id)
             
             if not fallback_product:
                 return jsonify({'error': f'Produkten med id {prod_id} hittades inte'}), 404
             
-            # Skapa ny produkt från fallback
-            new_product = Product(
-                name=fallback_product.get('name'),
-                brand=fallback_product.get('brand'),
-                weight=fallback_product.get('weight'),
-                category=fallback_product.get('category'),
-                image_url=fallback_product.get('image'),
-                allergen_tags=','.join(fallback_product.get('allergens', []))
-            )
-            db.session.add(new_product)
-            db.session.flush()
-            
-            # Lägg till priser
-            for store_name, price in fallback_product.get('prices', {}).items():
-                price_obj = Price(product_id=new_product.id, store=store_name, price=price)
-                db.session.add(price_obj)
-            
-            # Lägg till näringsvärden
-            nutr_data = fallback_product.get('nutrition', {})
-            if nutr_data:
-                nutrition = Nutrition(
-                    product_id=new_product.id,
-                    calories=nutr_data.get('calories'),
-                    protein=nutr_data.get('protein'),
-                    carbs=nutr_data.get('carbs'),
-                    fat=nutr_data.get('fat'),
-                    fiber=nutr_data.get('fiber')
-                )
-                db.session.add(nutrition)
-            
-            db.session.flush()
+            # Produkt för katalogvaran (befintlig rad återanvänds på naturlig nyckel)
+            new_product = upsert_products([fallback_product])[0]
             
             if idx == 0:
                 item.product_id = new_product.id
@@ -1410,6 +990,95 @@ def api_substitute_combined(item_id):
     })
 
 
+def _alternatives_product_dict(product):
+    """Konvertera en databasprodukt till dict för scraperns alternativsökning"""
+    product_dict = {
+        'name': product.name,
+        'category': product.category,
+        'weight': product.weight,
+        'prices': {},
+        'nutrition': {}
+    }
+    
+    # Lägg till priser
+    for price in product.prices:
+        product_dict['prices'][price.store] = price.price
+    
+    # Lägg till näringsvärden
+    if product.nutrition:
+        product_dict['nutrition'] = {
+            'calories': product.nutrition.calories,
+            'protein': product.nutrition.protein,
+            'carbs': product.nutrition.carbs,
+            'fat': product.nutrition.fat,
+            'fiber': product.nutrition.fiber
+        }
+    
+    return product_dict
+
+
+def _alternatives_target_grams(item):
+    """Målvikt för kombinerade ersättningar: förpackningens vikt gånger antal"""
+    return scraper._parse_weight(item.product.weight) * item.quantity
+
+
+def _list_alternatives_entries(shopping_list):
+    """
+    Allt som alternativen för listans varor beror på
+    
+    Returns:
+        (allergier, budget, [(vara-ID, produkt-dict, målvikt), ...]) - produkt None om varan saknar produkt
+    """
+    allergies = []
+    if shopping_list.plan:
+        allergies = shopping_list.plan.get_allergies_list()
+    
+    # Alla varor med produkter, priser och näringsvärden i tre frågor (inte tre per vara)
+    items = (
+        ShoppingItem.query
+        .filter_by(list_id=shopping_list.id)
+        .options(
+            selectinload(ShoppingItem.product).selectinload(Product.prices),
+            selectinload(ShoppingItem.product).selectinload(Product.nutrition)
+        )
+        .order_by(ShoppingItem.id)
+        .all()
+    )
+    entries = [
+        (item.id, _alternatives_product_dict(item.product), _alternatives_target_grams(item))
+        if item.product else (item.id, None, 0)
+        for item in items
+    ]
+    return allergies, shopping_list.budget, entries
+
+
+def _load_list_alternatives(list_id):
+    shopping_list = ShoppingList.query.get(list_id)
+    if shopping_list is None:
+        return None
+    return _list_alternatives_entries(shopping_list)
+
+
+# Förberäknade alternativ för nygenererade listor (se alternatives_cache.py)
+alternatives_precomputer = AlternativesPrecomputer(app, scraper, _load_list_alternatives)
+
+
+def _precompute_alternatives_after_commit(shopping_list):
+    """Förberäkna listans alternativ i bakgrunden när transaktionen har committats"""
+    db.session.info.setdefault('precompute_alternatives', set()).add(shopping_list.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _schedule_precomputed_alternatives(session):
+    for list_id in sorted(session.info.pop('precompute_alternatives', ())):
+        alternatives_precomputer.schedule(list_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_precomputed_alternatives(session):
+    session.info.pop('precompute_alternatives', None)
+
+
 @app.route('/api/shopping-items/<int:item_id>/alternatives')
 def api_get_alternatives(item_id):
     """Hämta alternativa produkter för en vara i listan baserat på näringsprofil och typ"""
@@ -1428,27 +1097,14 @@ def api_get_alternatives(item_id):
     budget = shopping_list.budget
     
     # Konvertera produkten till dict för scraper
-    product_dict = {
-        'name': item.product.name,
-        'category': item.product.category,
-        'weight': item.product.weight,
-        'prices': {},
-        'nutrition': {}
-    }
-    
-    # Lägg till priser
-    for price in item.product.prices:
-        product_dict['prices'][price.store] = price.price
+    product_dict = _alternatives_product_dict(item.product)
+    target_grams = _alternatives_target_grams(item)
     
-    # Lägg till näringsvärden
-    if item.product.nutrition:
-        product_dict['nutrition'] = {
-            'calories': item.product.nutrition.calories,
-            'protein': item.product.nutrition.protein,
-            'carbs': item.product.nutrition.carbs,
-            'fat': item.product.nutrition.fat,
-            'fiber': item.product.nutrition.fiber
-        }
+    # Förberäknat direkt efter listgenereringen?
+    version = alternatives_precomputer.version(product_dict, target_grams, allergies, budget)
+    precomputed = alternatives_precomputer.get(item.id, version)
+    if precomputed is not None:
+        return jsonify(precomputed)
     
     # Hitta enskilda alternativ (med strikt typ-matchning)
     single_alternatives = scraper.find_alternatives(
@@ -1456,42 +1112,19 @@ def api_get_alternatives(item_id):
         allergies=allergies,
         budget=budget,
         same_category=False,
-        limit=8
+        limit=SINGLE_LIMIT
     )
     
     # Filtrera bort nuvarande produkt
     single_alternatives = [a for a in single_alternatives if a.get('name') != item.product.name]
     
-    # Beräkna målvikt för kombinerade ersättningar
-    target_grams = 0
-    if item.product.weight:
-        # Parsa vikt från produkten
-        weight_str = item.product.weight.lower()
-        if 'kg' in weight_str:
-            try:
-                target_grams = int(float(weight_str.replace('kg', '').strip()) * 1000)
-            except:
-                target_grams = 500
-        elif 'g' in weight_str:
-            try:
-                target_grams = int(weight_str.replace('g', '').strip())
-            except:
-                target_grams = 500
-        else:
-            target_grams = 500
-    else:
-        target_grams = 500  # Default
-    
-    # Multiplicera med antal
-    target_grams = target_grams * item.quantity
-    
     # Hitta kombinerade ersättningar (t.ex. 2x 500g istället för 1x 1kg)
     combined_alternatives = scraper.find_combined_alternatives(
         product_dict,
         target_grams=target_grams,
         allergies=allergies,
         budget=budget,
-        limit=5
+        limit=COMBINED_LIMIT
     )
     
     return jsonify({
@@ -1500,6 +1133,50 @@ def api_get_alternatives(item_id):
     })
 
 
+@app.route('/api/shopping-lists/<int:list_id>/alternatives')
+def api_get_list_alternatives(list_id):
+    """
+    Alternativ för alla varor i en lista i ett anrop (se alternatives_batch.py)
+    
+    Svaret strömmas som NDJSON, en rad per vara i listans ordning så fort den är klar:
+        {"item_id": 12, "single": [...], "combined": [...]}
+    och sist en sammanfattning:
+        {"done": true, "precomputed": 20, "items": 5, "duplicates": 0, "pools": 6, "seconds": 0.02}
+    
+    Varor som förberäknades efter listgenereringen (se alternatives_cache.py) läses
+    från cachen; resten räknas i batchen.
+    
+    Varje rad är samma svar som /api/shopping-items/<id>/alternatives ger för varan.
+    """
+    shopping_list = ShoppingList.query.get_or_404(list_id)
+    
+    # Läs allt från databasen innan strömningen börjar
+    allergies, budget, entries = _list_alternatives_entries(shopping_list)
+    batch = AlternativesBatch(scraper, allergies, budget)
+    
+    def generate():
+        precomputed = 0
+        for item_id, product, target_grams in entries:
+            # Förberäknat direkt efter listgenereringen?
+            result = None
+            if product is not None:
+                version = alternatives_precomputer.version(product, target_grams, allergies, budget)
+                result = alternatives_precomputer.get(item_id, version)
+            if result is not None:
+                precomputed += 1
+            else:
+                for _, single, combined in batch.run([(item_id, product, target_grams)]):
+                    result = {
+                        # Filtrera bort nuvarande produkt
+                        'single': [a for a in single if product is None or a.get('name') != product['name']],
+                        'combined': combined
+                    }
+            yield json.dumps({'item_id': item_id, **result}, ensure_ascii=False) + '\n'
+        yield json.dumps({'done': True, 'precomputed': precomputed, **batch.stats}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 # ============== EXPORT-FUNKTIONER ==============
 
 @app.route('/api/shopping-lists/<int:list_id>/export/csv')
@@ -1733,7 +1410,7 @@ def export_for_store(list_id, store):
 # ============== AI RECEPTGENERERING ==============
 def generate_with_ai_recipes(plan, days, store, household_size, budget, 
                              include_breakfast, include_lunch, include_dinner, 
-                             include_snacks, allergies, session_id=None):
+                             include_snacks, allergies, session_id=None, previous_list_id=None, progress=None):
     """
     Generera inköpslista baserat på AI-genererade recept
     
@@ -1741,13 +1418,23 @@ def generate_with_ai_recipes(plan, days, store, household_size, budget,
     2. Ingredienser extraheras från recepten
     3. Produkter söks på Matspar.se för vald butik
     4. Inköpslista skapas
+    
+    Körs som jobb (se jobs.py): progress(steg) anropas före varje steg. Inget skrivs till
+    databasen före sista steget, så att jobbkön kan uppdatera jobbets status under tiden.
+    
+    Args:
+        previous_list_id: Lista vars recept ska tas bort (generera om recept)
+    
+    Returns:
+        (svar-dict, HTTP-status)
     """
+    progress = progress or (lambda stage: None)
     try:
         from ai_service import get_ai_service
         ai_service = get_ai_service()
         
         if not ai_service.is_available():
-            return jsonify({'error': 'AI-tjänsten är inte tillgänglig. Kontrollera API-nyckel.'}), 400
+            return {'error': 'AI-tjänsten är inte tillgänglig. Kontrollera API-nyckel.'}, 400
         
         # Skapa AI-parametrar
         ai_params = {
@@ -1763,13 +1450,14 @@ def generate_with_ai_recipes(plan, days, store, household_size, budget,
         }
         
         # Generera recept med AI
+        progress('recipes')
         recipes_data, error = ai_service.generate_recipes(ai_params)
         
         if error:
-            return jsonify({'error': f'AI-fel: {error}'}), 400
+            return {'error': f'AI-fel: {error}'}, 400
         
         if not recipes_data or 'recipes' not in recipes_data:
-            return jsonify({'error': 'Kunde inte generera recept. Försök igen.'}), 400
+            return {'error': 'Kunde inte generera recept. Försök igen.'}, 400
         
         # Debug: visa vad AI returnerade
         print(f"DEBUG: recipes_data type = {type(recipes_data)}")
@@ -1786,6 +1474,42 @@ def generate_with_ai_recipes(plan, days, store, household_size, budget,
         # Extrahera ingredienser
         ingredients = ai_service.extract_ingredients_for_search(recipes_data)
         
+        # Sök produkter på Matspar och lägg till i listan
+        progress('search')
+        # Sök alla ingredienser parallellt, och sedan förenklade söktermer för de som saknade träffar
+        search_results = scraper.search_many(
+            [ing['search_term'] for ing in ingredients], allergies=allergies, limit=3
+        )
+        simple_terms = {
+            ing['search_term']: ing['search_term'].split()[0]
+            for ing in ingredients
+            if not search_results.get(ing['search_term']) and ' ' in ing['search_term']
+        }
+        simple_results = scraper.search_many(simple_terms.values(), allergies=allergies, limit=3)
+        
+        chosen = []
+        for ing in ingredients:
+            search_term = ing['search_term']
+            
+            products = search_results.get(search_term, [])
+            
+            if not products and search_term in simple_terms:
+                # Förenklad sökning
+                products = simple_results.get(simple_terms[search_term], [])
+            
+            if products:
+                product_data = products[0]
+                chosen.append({
+                    **product_data,
+                    'category': ing['category'],
+                    'image': product_data.get('image_url', product_data.get('image', ''))
+                })
+        
+        progress('persist')
+        if previous_list_id:
+            # Ta bort gamla recept
+            Recipe.query.filter_by(shopping_list_id=previous_list_id).delete()
+        
         # Skapa inköpslista
         shopping_list = ShoppingList(
             session_id=session_id,
@@ -1798,6 +1522,7 @@ def generate_with_ai_recipes(plan, days, store, household_size, budget,
         )
         db.session.add(shopping_list)
         db.session.flush()  # Få ID
+        _precompute_alternatives_after_commit(shopping_list)
         
         # Spara recept i databasen
         for recipe_data in recipes_data['recipes']:
@@ -1820,74 +1545,15 @@ def generate_with_ai_recipes(plan, days, store, household_size, budget,
             recipe.set_instructions(recipe_data.get('instructions', []))
             db.session.add(recipe)
         
-        # Sök produkter på Matspar och lägg till i listan
-        total_cost = 0
-        items_added = 0
-        
-        for ing in ingredients:
-            search_term = ing['search_term']
-            
-            # Sök efter produkten med allergifiltrering
-            products = scraper.search_products_filtered(search_term, allergies=allergies, limit=3)
-            
-            if not products:
-                # Prova förenklad sökning
-                simple_term = search_term.split()[0] if ' ' in search_term else search_term
-                products = scraper.search_products_filtered(simple_term, allergies=allergies, limit=3)
-            
-            if products:
-                product_data = products[0]
-                
-                # Hitta eller skapa produkt i databasen
-                product = Product.query.filter_by(name=product_data['name']).first()
-                if not product:
-                    product = Product(
-                        name=product_data['name'],
-                        brand=product_data.get('brand', ''),
-                        weight=product_data.get('weight', ''),
-                        category=ing['category'],
-                        image_url=product_data.get('image_url', product_data.get('image', ''))
-                    )
-                    db.session.add(product)
-                    db.session.flush()
-                    
-                    # Lägg till priser - prices är en dict {butik: pris}
-                    prices_data = product_data.get('prices', {})
-                    if isinstance(prices_data, dict):
-                        for store_name, price_value in prices_data.items():
-                            price = Price(
-                                product_id=product.id,
-                                store=store_name,
-                                price=price_value
-                            )
-                            db.session.add(price)
-                    
-                    # Lägg till nutrition om tillgängligt
-                    if product_data.get('nutrition'):
-                        nutr = product_data['nutrition']
-                        nutrition = Nutrition(
-                            product_id=product.id,
-                            calories=nutr.get('calories', 0),
-                            protein=nutr.get('protein', 0),
-                            carbs=nutr.get('carbs', 0),
-                            fat=nutr.get('fat', 0),
-                            fiber=nutr.get('fiber', 0)
-                        )
-                        db.session.add(nutrition)
-                
-                # Lägg till i inköpslistan
-                item = ShoppingItem(
-                    list_id=shopping_list.id,
-                    product_id=product.id,
-                    quantity=1
-                )
-                db.session.add(item)
-                items_added += 1
-                
-                # Beräkna kostnad
-                if product.prices:
-                    price = min(p.price for p in product.prices)
-                    total_cost += price
+        # Hitta eller skapa produkterna i databasen (ett uppslag, batchade INSERT)
+        products = upsert_products(chosen)
+        if products:
+            db.session.execute(insert(ShoppingItem), [
+                {'list_id': shopping_list.id, 'product_id': product.id, 'quantity': 1}
+                for product in products
+            ])
+        # Beräkna kostnad
+        total_cost = sum(min(p.price for p in product.prices) for product in products if product.prices)
         
         shopping_list.total_cost = total_cost
         db.session.commit()
@@ -1903,13 +1569,15 @@ def generate_with_ai_recipes(plan, days, store, household_size, budget,
             'fat': 100
         }
         
-        return jsonify(result)
+        return result, 200
         
     except ImportError:
-        return jsonify({'error': 'AI-modulen kunde inte laddas. Installera google-generativeai.'}), 400
+        return {'error': 'AI-modulen kunde inte laddas. Installera google-generativeai.'}, 400
+    except JobCancelled:
+        raise
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': f'Ett fel uppstod: {str(e)}'}), 500
+        return {'error': f'Ett fel uppstod: {str(e)}'}, 500
 
 
 @app.route('/api/shopping-lists/<int:list_id>/regenerate-recipes', methods=['POST'])
@@ -1921,24 +1589,11 @@ def regenerate_recipes(list_id):
     if not plan:
         return jsonify({'error': 'Ingen näringsplan kopplad till listan'}), 400
     
-    # Ta bort gamla recept
-    Recipe.query.filter_by(shopping_list_id=list_id).delete()
-    
-    # Generera nya recept
+    # Generera nya recept (gamla recept tas bort när de nya sparas)
     data = request.json or {}
+    meals = {key: data[key] for key in ('include_breakfast', 'include_lunch', 'include_dinner', 'include_snacks') if key in data}
     
-    return generate_with_ai_recipes(
-        plan=plan,
-        days=shopping_list.days,
-        store=shopping_list.store,
-        household_size=shopping_list.household_size or 1,
-        budget=shopping_list.budget,
-        include_breakfast=data.get('include_breakfast', True),
-        include_lunch=data.get('include_lunch', True),
-        include_dinner=data.get('include_dinner', True),
-        include_snacks=data.get('include_snacks', False),
-        allergies=plan.get_allergies_list()
-    )
+    return _submit_generation('recipes', request.cookies.get('matplanerare_session'), {'list_id': list_id, **meals})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,612 @@
+"""
+Prestandamätningar för Matplanerare
+Körs offline - anropen mot matspar.se besvaras av en lokal stub-adapter.
+
+Användning:
+    python benchmark.py                 # alla mätningar
+    python benchmark.py search-latency  # en specifik mätning
+    python benchmark.py parser          # parsning av HTML-fixturerna i fixtures/matspar/
+    python benchmark.py online-search   # hela onlinesökningen mot uppspelade svar (replay)
+    python benchmark.py scoring         # poängsättning av ersättningskandidater upp till 100 000 produkter
+    python benchmark.py substitutions   # find_alternatives live mot ersättningscachen och substitutionsgrafen
+    python benchmark.py candidates      # kandidatinsamling (med bredare sökning) i en katalog på upp till 30 000 produkter
+    python benchmark.py combinations    # förpackningslösaren: tid, avbrutna sökningar och avstånd till optimum
+    python benchmark.py list-solver     # listlösaren mot den giriga loopen på 1 000 kandidater
+    python benchmark.py generation      # listgenereringens steg var för sig (behov, kandidater, lösning, persistens)
+    python benchmark.py products        # upprepade add-item/prisuppdateringar mot en databas med genererade listor
+
+Lasttest av listgenerering utan matspar.se: starta appen med MATSPAR_HTTP_MODE=replay
+(och MATSPAR_REPLAY_LATENCY_MS) mot svar inspelade med MATSPAR_HTTP_MODE=record.
+"""
+
+import glob
+import math
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+# Använd en temporär cache så att mätningarna inte påverkar (eller påverkas av) appens cache
+os.environ.setdefault('MATPLANERARE_CACHE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_cache.db'))
+# Substitutionsgrafen byggs direkt i konstruktorn (inte i en bakgrundstråd mitt i mätningarna)
+os.environ.setdefault('MATSPAR_SUBSTITUTION_GRAPH', 'sync')
+
+import matspar_parser
+from catalog import ProductCatalog, ProductFeatures, stable_id
+from generation import STAGES, GenerationCache, ListGenerator, StageTimings
+from http_client import FixtureStore
+from list_solver import GROUP_SLACK, NUTRIENT_KEYS, TARGET_TOLERANCE, ListSolver, pack_nutrients
+from pack_solver import DEFAULT_TIME_BUDGET, PackSolver
+from scraper import MatsparScraper
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'matspar')
+
+
+def synthetic_results_page(num_cards=40):
+    """En sökresultatsida med num_cards produktkort i samma form som matspar.se"""
+    cards = []
+    for i in range(num_cards):
+        cards.append(
+            f'<div class="product"><a href="/produkt/testprodukt-{i}">'
+            f'<img src="https://d1ax460061ulao.cloudfront.net/{i}.jpg">'
+            f'<span>Testprodukt {i} Märke</span><span>{400 + i}g</span><span>{19 + i},90 kr</span>'
+            f'</a></div>'
+        )
+    return f"<html><body><nav>{'<a href=/kategori>x</a>' * 50}</nav>{''.join(cards)}</body></html>"
+
+
+class StubAdapter(HTTPAdapter):
+    """Transport-adapter som svarar direkt med en fast HTML-sida (ingen nätverkstrafik)"""
+
+    def __init__(self, body, limiter=None):
+        super().__init__()
+        self.body = body.encode('utf-8')
+        self.limiter = limiter
+
+    def send(self, request, **kwargs):
+        if self.limiter:
+            self.limiter.acquire(request.url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.body
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class LegacyScraper(MatsparScraper):
+    """Den tidigare onlinesökningen (time.sleep(0.1) per parsat produktkort) - endast för jämförelse"""
+
+    def _search_matspar_online(self, query, limit=20, postal_code=None):
+        response = self.session.get(f"{self.BASE_URL}/kategori?q={query}", timeout=10)
+        soup = BeautifulSoup(response.text, 'html.parser')
+        products = []
+        seen_urls = set()
+        for card in soup.select('a[href*="/produkt/"]')[:limit * 2]:
+            href = card.get('href', '')
+            if not href or href in seen_urls:
+                continue
+            seen_urls.add(href)
+            product_data = self._parse_product_card(card, href)
+            if product_data:
+                products.append(product_data)
+                if len(products) >= limit:
+                    break
+            time.sleep(0.1)
+        return products or None
+
+
+def legacy_parse_results_page(html, limit=20, base_url=MatsparScraper.BASE_URL):
+    """Den tidigare parsningen (hela dokumentet, regex per kort) - endast för jämförelse"""
+    soup = BeautifulSoup(html, 'html.parser')
+    products = []
+    seen_urls = set()
+    for card in soup.select('a[href*="/produkt/"]')[:limit * 2]:
+        href = card.get('href', '')
+        if not href or href in seen_urls or '/produkt/' not in href:
+            continue
+        seen_urls.add(href)
+        text = card.get_text(separator=' ', strip=True)
+        price_match = re.search(r'(\d+[,.]?\d*)\s*kr', text)
+        price = float(price_match.group(1).replace(',', '.')) if price_match else None
+        weight_match = re.search(r'(\d+(?:[,.]?\d+)?)\s*(g|kg|ml|l|cl|dl)', text, re.IGNORECASE)
+        weight = f"{weight_match.group(1)}{weight_match.group(2)}" if weight_match else None
+        img = card.find('img')
+        src = img.get('src', '') if img else ''
+        name_parts = text.split()
+        products.append({
+            'id': stable_id('matspar', href),
+            'name': ' '.join(name_parts[:4]) if name_parts else 'Okänd produkt',
+            'brand': None,
+            'weight': weight,
+            'category': None,
+            'prices': {'Matspar': price} if price else {},
+            'nutrition': {},
+            'allergens': [],
+            'image': src if 'cloudfront.net' in src else None,
+            'url': f"{base_url}{href}" if not href.startswith('http') else href
+        })
+        if len(products) >= limit:
+            break
+    return products
+
+
+def load_fixtures():
+    """{filnamn: html} för alla sparade matspar-sidor (syntetisk sida om katalogen är tom)"""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures or {'synthetic.html': synthetic_results_page()}
+
+
+def _install_stub(scraper, body, rate_limited=True):
+    """Byt transporten mot stubben (med eller utan scraperns hastighetsbegränsning)"""
+    adapter = StubAdapter(body, scraper.rate_limiter if rate_limited else None)
+    scraper.session.mount('https://', adapter)
+    scraper.session.mount('http://', adapter)
+
+
+def _time_searches(scraper, queries, limit):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        scraper._search_matspar_online(query, limit=limit)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _report(label, timings, unit='sökningar'):
+    print(f"  {label:<38} medel {statistics.mean(timings) * 1000:8.1f} ms   "
+          f"max {max(timings) * 1000:8.1f} ms   ({len(timings)} {unit})")
+
+
+def bench_search_latency(num_cards=40, searches=6):
+    """Latens per onlinesökning: sleep per produktkort (före) mot token bucket per värd (efter)"""
+    print(f"\n=== Söklatens, {num_cards} produktkort per sida ===")
+    page = synthetic_results_page(num_cards)
+    queries = [f"vara{i}" for i in range(searches)]
+
+    legacy = LegacyScraper()
+    _install_stub(legacy, page, rate_limited=False)
+    _report('före: time.sleep(0.1) per kort', _time_searches(legacy, queries, limit=num_cards))
+
+    current = MatsparScraper()
+    _install_stub(current, page)
+    _report(f'efter: token bucket {current.rate_limiter.requests_per_second:g} req/s', _time_searches(current, queries, limit=num_cards))
+    print(f"  begränsare: {current.rate_limiter.stats()}")
+
+
+def bench_parser(rounds=20, limit=40):
+    """Parsning per sida: hela dokumentet (före) mot bara produktlänkar (efter), samma resultat krävs"""
+    fixtures = load_fixtures()
+    backends = ['html.parser']
+    if matspar_parser.PARSER_BACKEND != 'html.parser':
+        backends.append(matspar_parser.PARSER_BACKEND)
+    print(f"\n=== HTML-parsning, {len(fixtures)} sidor x {rounds} varv ===")
+
+    for name, html in fixtures.items():
+        expected = legacy_parse_results_page(html, limit)
+        for backend in backends:
+            actual = matspar_parser.parse_results_page(html, limit, MatsparScraper.BASE_URL, backend=backend)
+            if actual != expected:
+                raise AssertionError(f"{name}: {backend} ger annat resultat än den tidigare parsningen")
+    print(f"  utdata identisk med den tidigare parsningen för alla sidor ({', '.join(backends)})")
+
+    def time_parse(parse):
+        timings = []
+        for _ in range(rounds):
+            for html in fixtures.values():
+                start = time.perf_counter()
+                parse(html)
+                timings.append(time.perf_counter() - start)
+        return timings
+
+    _report('före: hela dokumentet, html.parser', time_parse(lambda html: legacy_parse_results_page(html, limit)), 'sidor')
+    for backend in backends:
+        _report(f'efter: produktlänkar, {backend}', time_parse(
+            lambda html: matspar_parser.parse_results_page(html, limit, MatsparScraper.BASE_URL, backend=backend)
+        ), 'sidor')
+
+
+def bench_online_search(latencies_ms=(0, 50), rounds=5, limit=20):
+    """Hela onlinevägen (session, värdsemafor, adapter, parsning) mot uppspelade svar"""
+    pages = load_fixtures()
+    queries = [os.path.splitext(name)[0].replace('kategori_', '') for name in pages]
+    print(f"\n=== Onlinesökning med uppspelade svar, {len(queries)} sökord x {rounds} varv ===")
+
+    fixture_dir = tempfile.mkdtemp()
+    seed = FixtureStore(fixture_dir)
+    for query, html in zip(queries, pages.values()):
+        seed.save('GET', f"{MatsparScraper.BASE_URL}/kategori?q={query}", None, 200, html)
+
+    for latency_ms in latencies_ms:
+        store = FixtureStore(fixture_dir, latency=latency_ms / 1000)
+        scraper = MatsparScraper(http_mode='replay', fixtures=store)
+        scraper.rate_limiter.requests_per_second = scraper.rate_limiter.burst = 1e6
+        _report(f'replay, latens {latency_ms} ms', _time_searches(scraper, queries * rounds, limit))
+        print(f"  fixturer: {store.stats()}")
+
+
+def synthetic_catalog(scraper, size, seed=42):
+    """size produkter i katalogformat: basvarorna med slumpade priser och näringsvärden"""
+    rng = random.Random(seed)
+    base = scraper.get_all_base_products()
+    products = []
+    for i in range(size):
+        template = base[i % len(base)]
+        nutrition = {k: round(v * rng.uniform(0.7, 1.3), 1) for k, v in template['nutrition'].items()}
+        prices = {store: round(price * rng.uniform(0.8, 1.2), 2) for store, price in template['prices'].items()}
+        products.append({**template, 'id': i, 'name': f"{template['name']} #{i}", 'nutrition': nutrition, 'prices': prices})
+    return products
+
+
+def bench_scoring(sizes=(100, 1000, 10000, 100000), limit=10):
+    """Poängsättning + topp-k: en kandidat i taget (före) mot en vektoriserad körning (efter)"""
+    print(f"\n=== Poängsättning av ersättningskandidater (topp {limit}) ===")
+    scraper = MatsparScraper()
+    original = scraper.get_products_by_category('kyckling')[0]
+    profile = scraper._get_nutrition_profile(original['nutrition'])
+
+    for size in sizes:
+        candidates = synthetic_catalog(scraper, size)
+        features = ProductFeatures.from_products(candidates)
+
+        start = time.perf_counter()
+        scored = [(c, scraper._calculate_similarity_score(original, c, profile)) for c in candidates]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        before = [c['id'] for c, _ in scored[:limit]]
+        loop_time = time.perf_counter() - start
+
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            scores = scraper._similarity_scores(original, profile, features)
+            after = [candidates[i]['id'] for i in scraper._top_k(scores, limit)]
+            timings.append(time.perf_counter() - start)
+
+        if after != before:
+            raise AssertionError(f"{size} produkter: vektoriserad rankning skiljer sig från den tidigare")
+        print(f"  {size:>7} produkter   före {loop_time * 1000:9.2f} ms   efter {min(timings) * 1000:7.2f} ms   (samma topp {limit})")
+
+
+def bench_substitutions(rounds=5, limit=8):
+    """find_alternatives för alla katalogprodukter: live-beräkning mot substitutionsgrafen"""
+    print(f"\n=== Alternativ för alla katalogprodukter (topp {limit}) ===")
+    scraper = MatsparScraper()
+    graph = scraper.substitutions
+    print(f"  Graf byggd på {graph.stats()['last_build_seconds'] * 1000:.1f} ms")
+
+    products = scraper.get_all_base_products()
+    cases = [(p, allergies, budget) for p in products for allergies in ([], ['lactose'], ['vegan']) for budget in (None, 40)]
+
+    def live(p, allergies, budget):
+        return scraper._live_alternatives(p, allergies, budget, False, limit)
+
+    def find(p, allergies, budget):
+        return scraper.find_alternatives(p, allergies, budget, same_category=False, limit=limit)
+
+    built = graph._state
+    results = {}
+    # live: ingen graf eller cache; cache: ersättningscachen (varm efter första varvet); graf: uppslag
+    for label, state, function in (('live', None, live), ('cache', None, find), ('graf', built, find)):
+        graph._state = state
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            results[label] = [[a['id'] for a in function(p, allergies, budget)] for p, allergies, budget in cases]
+            timings.append((time.perf_counter() - start) / len(cases))
+        print(f"  {label:<6} {min(timings) * 1e6:8.1f} µs per anrop   ({len(cases)} anrop x {rounds} varv)")
+
+    for label in ('cache', 'graf'):
+        if results[label] != results['live']:
+            raise AssertionError(f"{label} ger andra alternativ än live-beräkningen")
+    stats = scraper.substitution_cache_stats()
+    print(f"  Ersättningscachen: {stats['size']} poster, träffgrad {stats['hit_rate']}, {stats['evictions']} evictions")
+
+
+def bench_candidates(sizes=(1000, 10000, 30000), limit=10, seed=42):
+    """
+    find_alternatives live när katalogen har size extra produkter i en kategori som inte är
+    relaterad till något - produkter med få relaterade kandidater söker då i hela katalogen
+    """
+    print(f"\n=== Kandidatinsamling med bredare sökning (topp {limit}) ===")
+    scraper = MatsparScraper()
+    base = scraper.get_all_base_products()
+    rng = random.Random(seed)
+
+    for size in sizes:
+        filler = []
+        for i in range(size):
+            template = base[i % len(base)]
+            filler.append({
+                'name': f"{template['name']} #{i}",
+                'brand': template.get('brand'),
+                'weight': template.get('weight'),
+                'prices': {store: round(price * rng.uniform(0.8, 1.2), 2) for store, price in template['prices'].items()},
+                'nutrition': {k: round(v * rng.uniform(0.7, 1.3), 1) for k, v in template['nutrition'].items()},
+                'allergens': list(template.get('allergens', ()))
+            })
+        # Grafen gäller den ursprungliga katalogen - alla anrop nedan räknas live
+        scraper.catalog = ProductCatalog({**scraper.FALLBACK_PRODUCTS, 'sortiment': filler}, scraper.PRODUCT_IMAGES)
+
+        broadened = 0
+        timings = []
+        for product in base:
+            profile = scraper._get_nutrition_profile(product['nutrition'])
+            related = scraper._candidate_rows(product['category'], profile, 'related')
+            broadened += len(related) < limit * 2 and not profile.get('high_protein')
+            start = time.perf_counter()
+            scraper.find_alternatives(product, ['lactose'], limit=limit)
+            timings.append(time.perf_counter() - start)
+
+        print(f"  {len(scraper.catalog):>6} produkter: medel {statistics.mean(timings) * 1000:6.2f} ms   "
+              f"max {max(timings) * 1000:6.2f} ms   ({broadened}/{len(base)} anrop söker i hela katalogen)")
+
+
+def bench_combinations(multiples=(1, 2), budgets=(None, 150)):
+    """find_combined_alternatives för alla katalogprodukter: tid och lösningskvalitet mot en obegränsad sökning"""
+    print("\n=== Kombinerade ersättningar (PackSolver) ===")
+    scraper = MatsparScraper()
+
+    timings = []
+    timed_out = 0
+    gaps = []
+    for product in scraper.get_all_base_products():
+        nutrition = product['nutrition']
+        for multiple in multiples:
+            target_grams = scraper._parse_weight(product['weight']) * multiple
+            target_protein = (nutrition.get('protein', 0) or 0) * target_grams / 100
+            target_calories = (nutrition.get('calories', 0) or 0) * target_grams / 100
+            alternatives = scraper.find_alternatives(product, budget=None, limit=20)
+            candidates, packs = scraper._combination_packs(alternatives)
+            if not candidates:
+                continue
+            reference_price = scraper._reference_price(product, target_grams, candidates, packs)
+            for budget in budgets:
+                start = time.perf_counter()
+                scraper.find_combined_alternatives(product, target_grams, budget=budget)
+                timings.append(time.perf_counter() - start)
+
+                solvers = [
+                    PackSolver(target_protein, target_calories, reference_price, budget, time_budget=time_budget)
+                    for time_budget in (DEFAULT_TIME_BUDGET, float('inf'))
+                ]
+                limited, unlimited = (solver.solve(packs, limit=5) for solver in solvers)
+                timed_out += solvers[0].stats['timed_out']
+                if limited and unlimited:
+                    gaps.append(limited[0][0] - unlimited[0][0])
+
+    print(f"  {len(timings)} anrop   medel {statistics.mean(timings) * 1000:.2f} ms   "
+          f"max {max(timings) * 1000:.2f} ms   avbrutna av tidsbudgeten: {timed_out}")
+    print(f"  Bästa lösningens kostnad jämfört med obegränsad sökning: "
+          f"optimal i {sum(1 for gap in gaps if gap <= 1e-9)}/{len(gaps)}, största avstånd {max(gaps):.3f}")
+
+
+# NutritionPlan-standardvärden (mål per dag och läge)
+DEFAULT_PLAN_GOALS = {
+    'calories': (2000, 'target'), 'protein': (60, 'min'), 'carbs': (280, 'target'), 'fat': (70, 'max'),
+    'fiber': (30, 'min'), 'sugar': (50, 'max'), 'salt': (6, 'max'), 'vitamin_c': (80, 'min'),
+    'vitamin_d': (15, 'min'), 'vitamin_a': (800, 'min'), 'calcium': (900, 'min'), 'iron': (12, 'min'),
+    'potassium': (3500, 'ignore'),
+}
+
+
+def legacy_greedy_list(groups, needed_grams, prices, grams, budget, max_quantity):
+    """
+    Den tidigare loopen i api_generate_list (utan fyllnadsloopen): billigaste kandidaten i
+    varje grupp i tur och ordning, behovet avrundat uppåt till hela förpackningar, och
+    nästa kandidat (eller en förpackning mindre) när budgeten inte räcker
+    """
+    quantities = np.zeros(len(prices), dtype=np.int64)
+    running_total = 0.0
+    for group, need in enumerate(needed_grams):
+        members = sorted(np.flatnonzero(groups == group), key=lambda i: prices[i])
+        if not members:
+            continue
+        quantity = min(max(1, math.ceil(need / grams[members[0]])), max_quantity)
+        for index in members:
+            if budget is None or running_total + prices[index] * quantity <= budget:
+                break
+        else:
+            index = members[0]
+            quantity = max(1, quantity - 1)
+            if running_total + prices[index] * quantity > budget:
+                continue
+        quantities[index] = quantity
+        running_total += prices[index] * quantity
+    return quantities
+
+
+def bench_list_solver(size=1000, days=7, household_size=2, budgets=(None, 1500, 800), seed=42):
+    """Listgenerering för standardplanen: den giriga loopen mot ListSolver på size kandidater"""
+    print(f"\n=== Listlösaren ({size} kandidater, {days} dagar, {household_size} pers) ===")
+    scraper = MatsparScraper()
+    candidates = synthetic_catalog(scraper, size, seed)
+
+    grams = np.array([scraper._parse_weight(p['weight']) for p in candidates])
+    prices = np.array([min(p['prices'].values()) for p in candidates])
+    nutrients = np.array([pack_nutrients(p['nutrition'], g) for p, g in zip(candidates, grams)])
+    # En grupp per produkttyp, behov: ungefär 1 kg mat per persondag fördelat på grupperna
+    types = [scraper._get_product_type(p) for p in candidates]
+    type_index = {product_type: i for i, product_type in enumerate(dict.fromkeys(types))}
+    groups = np.array([type_index[product_type] for product_type in types])
+    needed_grams = np.full(len(type_index), 1000.0 * days * household_size / len(type_index))
+    smallest = [grams[groups == group].min() for group in range(len(type_index))]
+    group_caps = np.maximum(needed_grams * GROUP_SLACK, smallest)
+
+    plan = _default_plan()
+    goals = ListSolver.for_plan(plan, days, household_size).goals
+
+    def report(label, quantities, seconds):
+        totals = dict(zip(NUTRIENT_KEYS, quantities @ nutrients))
+        hit = 0
+        for key, (mode, total) in goals.items():
+            low = total * (1 - TARGET_TOLERANCE) if mode == 'target' else total if mode == 'min' else -math.inf
+            high = total * (1 + TARGET_TOLERANCE) if mode == 'target' else total if mode == 'max' else math.inf
+            hit += low <= totals[key] <= high
+        macros = '  '.join(f"{key} {totals[key] / goals[key][1] * 100:4.0f}%" for key in ('calories', 'protein', 'carbs', 'fat'))
+        print(f"    {label:<8} {seconds * 1000:7.1f} ms   {quantities @ prices:7.0f} kr   mål nådda {hit}/{len(goals)}   {macros}")
+
+    for budget in budgets:
+        print(f"  Budget: {budget or 'ingen'}")
+        start = time.perf_counter()
+        greedy = legacy_greedy_list(groups, needed_grams, prices, grams, budget, max(2, math.ceil(days * household_size / 2)))
+        report('girig', greedy, time.perf_counter() - start)
+
+        solver = ListSolver.for_plan(plan, days, household_size, budget=budget)
+        start = time.perf_counter()
+        quantities = solver.solve(nutrients, prices, grams, groups, group_caps)
+        report('lösare', quantities, time.perf_counter() - start)
+        print(f"             LP-gräns {solver.stats['lp_bound']}, kostnad {solver.stats['cost']}, "
+              f"{solver.stats['nodes']} noder, avbruten av tidsbudgeten: {solver.stats['timed_out']}")
+
+
+def _default_plan(**overrides):
+    """Objekt med NutritionPlan-standardvärdena som *_target/*_mode-attribut"""
+    plan = type('Plan', (), {'id': None, 'name': 'Standard', 'get_allergies_list': lambda self: []})()
+    for key, (target, mode) in DEFAULT_PLAN_GOALS.items():
+        setattr(plan, f'{key}_target', target)
+        setattr(plan, f'{key}_mode', mode)
+    for key, value in overrides.items():
+        setattr(plan, key, value)
+    return plan
+
+
+def bench_generation(rounds=5):
+    """
+    ListGenerator steg för steg för några vanliga val, mot en SQLite-databas i minnet.
+    Sista kolumnen är samma val som träff i resultatcachen (behov + kopiering av listan).
+    """
+    from flask import Flask
+    from cache import SharedCache
+    from database import db, init_db
+
+    print(f"\n=== Listgenerering per steg ({rounds} varv) ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    init_db(app)
+    scraper = MatsparScraper()
+    scraper.online_search = False
+
+    cases = (
+        ('7 dagar, 2 pers', {'days': 7, 'household_size': 2}),
+        ('7 dagar, 2 pers, 1500 kr', {'days': 7, 'household_size': 2, 'budget': 1500}),
+        ('3 dagar, vegan, mellanmål', {'days': 3, 'allergies': ['vegan'], 'include_snacks': True}),
+        ('14 dagar, 4 pers, utan frukost', {'days': 14, 'household_size': 4, 'include_breakfast': False}),
+    )
+    cache = GenerationCache(SharedCache('generation', path=os.path.join(tempfile.mkdtemp(), 'cache.db')))
+    with app.app_context():
+        for label, options in cases:
+            timings = StageTimings()
+            for _ in range(rounds):
+                generator = ListGenerator(scraper, _default_plan(), recorder=timings, **options)
+                generator.generate()
+                db.session.rollback()
+            stats = timings.stats()
+            stages = '  '.join(f"{stage} {stats[stage]['mean_ms']:6.1f}" for stage in STAGES)
+            total = sum(stats[stage]['mean_ms'] for stage in STAGES)
+
+            ListGenerator(scraper, _default_plan(), cache=cache, **options).generate()
+            db.session.rollback()
+            hits = StageTimings()
+            for _ in range(rounds):
+                ListGenerator(scraper, _default_plan(), recorder=hits, cache=cache, **options).generate()
+                db.session.rollback()
+            hit = sum(entry['mean_ms'] for entry in hits.stats().values())
+            print(f"  {label:<32} {stages}   totalt {total:6.1f} ms   cachad {hit:5.1f} ms")
+
+
+def bench_products(rounds=3):
+    """
+    Produkter som redan finns i genererade listor, skrivna igen från de andra vägarna:
+    lägg till samma sökresultat i en lista (api_add_shopping_item/api_products) och
+    prisuppdateringar där matspar.se har samma produkt under en annan URL, eller en
+    ändrad vikt som skulle krocka med en annan rad. Antalet produkter ska inte växa.
+    """
+    from flask import Flask
+    from database import db, init_db, Product, ShoppingItem, upsert_products
+    from price_refresher import PriceRefresher
+
+    print(f"\n=== Produkter från olika vägar mot genererade listor ({rounds} varv) ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    init_db(app)
+    scraper = MatsparScraper()
+    scraper.online_search = False
+    refresher = PriceRefresher(app, scraper)
+
+    with app.app_context():
+        shopping_list, _, _ = ListGenerator(scraper, _default_plan(), days=7, household_size=2).generate()
+        db.session.commit()
+        list_id = shopping_list.id
+        stored = Product.query.order_by(Product.id).limit(10).all()
+        search_results = [
+            {'name': p.name, 'brand': p.brand, 'weight': p.weight, 'category': p.category,
+             'prices': {'ICA': 19.9}, 'nutrition': {'calories': 100}}
+            for p in stored
+        ]
+        online = [dict(product, url=f"https://www.matspar.se/produkt/{i}", prices={'Willys': 18.5})
+                  for i, product in enumerate(search_results)]
+        # Samma namn och varumärke som den första, annan vikt - en ändrad vikt krockar med den
+        other = upsert_products([dict(search_results[0], weight='999 g')])[0]
+        db.session.commit()
+        before = Product.query.count()
+
+        add_ms = []
+        refresh_ms = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for data in search_results:
+                product = upsert_products([data])[0]
+                db.session.add(ShoppingItem(list_id=list_id, product_id=product.id, quantity=1))
+            db.session.commit()
+            add_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            counts = refresher._persist(online + [dict(online[0], weight=other.weight)])
+            refresh_ms.append((time.perf_counter() - started) * 1000)
+            assert counts, f"prisuppdateringen misslyckades: {refresher.stats().get('last_error')}"
+
+        after = Product.query.count()
+        print(f"  lägg till {len(search_results)} varor          medel {statistics.mean(add_ms):6.1f} ms")
+        print(f"  prisuppdatering, {len(online)} produkter   medel {statistics.mean(refresh_ms):6.1f} ms   {counts}")
+        print(f"  produkter före {before}, efter {after}")
+        assert after == before, "nya produktrader för produkter som redan fanns"
+
+
+BENCHMARKS = {
+    'search-latency': bench_search_latency,
+    'parser': bench_parser,
+    'online-search': bench_online_search,
+    'scoring': bench_scoring,
+    'substitutions': bench_substitutions,
+    'candidates': bench_candidates,
+    'combinations': bench_combinations,
+    'list-solver': bench_list_solver,
+    'generation': bench_generation,
+    'products': bench_products,
+}
+
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Okänd mätning: {name}. Tillgängliga: {', '.join(BENCHMARKS)}")
+            return 1
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
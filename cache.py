@@ -0,0 +1,300 @@
+"""
+Delad cache för Matplanerare
+SQLite-baserad nyckel/värde-cache som delas mellan alla gunicorn-workers på samma maskin.
+
+EGENSKAPER:
+- Namnrymder: flera cachar (t.ex. 'search') kan dela samma databasfil
+- TTL per post: varje post har en egen utgångstid
+- LRU-eviction: när namnrymden har fler än max_entries poster tas de minst nyligen använda bort
+- Stale-while-revalidate: en utgången post serveras fortfarande (inom stale_ttl) medan
+  EN worker uppdaterar den i bakgrunden (låset ligger i databasen, inte i processen)
+- Statistik: träffar, missar, stale-träffar och evictions räknas i databasen så att
+  siffrorna gäller för alla workers tillsammans
+
+Ingen extern tjänst behövs - bara en SQLite-fil (WAL-läge).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    'MATPLANERARE_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'matplanerare_cache.db')
+)
+
+# Hur länge en worker får "äga" en bakgrundsuppdatering innan någon annan får ta över (sekunder)
+REFRESH_LOCK_SECONDS = 30
+
+
+def normalize_query(query):
+    """Normalisera en sökterm så att 'Mjölk ', 'mjölk' och 'MJÖLK' ger samma nyckel"""
+    query = unicodedata.normalize('NFC', str(query or ''))
+    return ' '.join(query.lower().split())
+
+
+def make_key(*parts):
+    """Bygg en stabil cachenyckel av godtyckliga (JSON-serialiserbara) delar"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    if len(raw) <= 200:
+        return raw
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class SharedCache:
+    """SQLite-baserad LRU-cache med TTL och stale-while-revalidate"""
+
+    def __init__(self, namespace, max_entries=2000, ttl=6 * 3600, stale_ttl=24 * 3600, path=None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.path = path or DEFAULT_CACHE_PATH
+        self._local = threading.local()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_schema()
+
+    # ============== ANSLUTNING ==============
+
+    def _connect(self):
+        """En anslutning per tråd (sqlite3-anslutningar får inte delas mellan trådar)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                refreshing_until REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_lru ON cache_entries (namespace, last_access)')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                namespace TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0,
+                stale_hits INTEGER NOT NULL DEFAULT 0,
+                evictions INTEGER NOT NULL DEFAULT 0,
+                refreshes INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute('INSERT OR IGNORE INTO cache_stats (namespace) VALUES (?)', (self.namespace,))
+
+    def _count(self, counter, amount=1):
+        self._connect().execute(
+            f'UPDATE cache_stats SET {counter} = {counter} + ? WHERE namespace = ?',
+            (amount, self.namespace)
+        )
+
+    # ============== LÄS/SKRIV ==============
+
+    def get(self, key):
+        """
+        Hämta en post
+
+        Returns:
+            (value, state) där state är 'fresh', 'stale' eller None (miss)
+        """
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?',
+            (self.namespace, key)
+        ).fetchone()
+
+        if row is None or now > row[1] + self.stale_ttl:
+            self._count('misses')
+            return None, None
+
+        conn.execute(
+            'UPDATE cache_entries SET last_access = ?, hits = hits + 1 WHERE namespace = ? AND key = ?',
+            (now, self.namespace, key)
+        )
+        if now <= row[1]:
+            self._count('hits')
+            return json.loads(row[0]), 'fresh'
+
+        self._count('stale_hits')
+        return json.loads(row[0]), 'stale'
+
+    def set(self, key, value, ttl=None):
+        """Spara en post och evicta de minst nyligen använda om cachen är full"""
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        conn = self._connect()
+        conn.execute(
+            """
+            INSERT INTO cache_entries (namespace, key, value, created_at, expires_at, last_access, hits, refreshing_until)
+            VALUES (?, ?, ?, ?, ?, ?, 0, 0)
+            ON CONFLICT (namespace, key) DO UPDATE SET
+                value = excluded.value,
+                created_at = excluded.created_at,
+                expires_at = excluded.expires_at,
+                last_access = excluded.last_access,
+                refreshing_until = 0
+            """,
+            (self.namespace, key, json.dumps(value, ensure_ascii=False), now, now + ttl, now)
+        )
+        self._evict()
+
+    def _evict(self):
+        """LRU-eviction: behåll de max_entries senast använda posterna"""
+        conn = self._connect()
+        size = conn.execute(
+            'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+        overflow = size - self.max_entries
+        if overflow <= 0:
+            return
+
+        conn.execute(
+            """
+            DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                SELECT key FROM cache_entries WHERE namespace = ?
+                ORDER BY last_access ASC LIMIT ?
+            )
+            """,
+            (self.namespace, self.namespace, overflow)
+        )
+        self._count('evictions', overflow)
+
+    def _claim_refresh(self, key):
+        """Försök bli den worker som uppdaterar en utgången post (atomärt i databasen)"""
+        now = time.time()
+        cursor = self._connect().execute(
+            """
+            UPDATE cache_entries SET refreshing_until = ?
+            WHERE namespace = ? AND key = ? AND refreshing_until < ?
+            """,
+            (now + REFRESH_LOCK_SECONDS, self.namespace, key, now)
+        )
+        return cursor.rowcount == 1
+
+    def get_or_compute(self, key, compute, ttl_for=None):
+        """
+        Hämta från cachen eller beräkna värdet
+
+        - Färsk träff: returneras direkt
+        - Utgången (stale) träff: returneras direkt, och en worker uppdaterar posten i bakgrunden
+        - Miss: beräknas synkront och sparas
+
+        Args:
+            key: Cachenyckel (se make_key)
+            compute: Funktion utan argument som returnerar värdet
+            ttl_for: Valfri funktion value -> ttl (sekunder) för att ge olika värden olika livslängd
+        """
+        value, state = self.get(key)
+        if state == 'fresh':
+            return value
+
+        if state == 'stale':
+            if self._claim_refresh(key):
+                thread = threading.Thread(
+                    target=self._refresh, args=(key, compute, ttl_for), daemon=True
+                )
+                thread.start()
+            return value
+
+        value = compute()
+        self.set(key, value, ttl_for(value) if ttl_for else None)
+        return value
+
+    def _refresh(self, key, compute, ttl_for):
+        try:
+            value = compute()
+            self.set(key, value, ttl_for(value) if ttl_for else None)
+            self._count('refreshes')
+        except Exception as e:
+            print(f"Cache-uppdatering misslyckades ({self.namespace}): {e}")
+
+    def delete(self, key):
+        self._connect().execute(
+            'DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (self.namespace, key)
+        )
+
+    def clear(self):
+        """Töm namnrymden (t.ex. när katalogen eller priserna uppdaterats)"""
+        self._connect().execute('DELETE FROM cache_entries WHERE namespace = ?', (self.namespace,))
+
+    def acquire_lease(self, key, seconds, owner):
+        """
+        Ta (eller förnya) ett lås som gäller för alla workers i `seconds` sekunder
+
+        Används t.ex. så att bara en gunicorn-worker kör prisuppdateraren åt gången.
+
+        Returns:
+            True om `owner` har låset
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO cache_entries (namespace, key, value, created_at, expires_at, last_access, hits, refreshing_until)
+            VALUES (?, ?, ?, ?, ?, ?, 0, 0)
+            """,
+            (self.namespace, key, json.dumps(owner), now, now, now)
+        )
+        cursor = conn.execute(
+            """
+            UPDATE cache_entries SET value = ?, refreshing_until = ?, last_access = ?
+            WHERE namespace = ? AND key = ? AND (refreshing_until < ? OR value = ?)
+            """,
+            (json.dumps(owner), now + seconds, now, self.namespace, key, now, json.dumps(owner))
+        )
+        return cursor.rowcount == 1
+
+    def keys_by_hits(self, limit=50):
+        """De mest använda nycklarna, mest träffar först"""
+        rows = self._connect().execute(
+            'SELECT key, hits FROM cache_entries WHERE namespace = ? ORDER BY hits DESC LIMIT ?',
+            (self.namespace, limit)
+        ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    # ============== STATISTIK ==============
+
+    def stats(self):
+        """Räknare för alla workers tillsammans - används för att dimensionera cachen"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT hits, misses, stale_hits, evictions, refreshes FROM cache_stats WHERE namespace = ?',
+            (self.namespace,)
+        ).fetchone() or (0, 0, 0, 0, 0)
+        size = conn.execute(
+            'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+
+        hits, misses, stale_hits, evictions, refreshes = row
+        lookups = hits + misses + stale_hits
+        return {
+            'namespace': self.namespace,
+            'size': size,
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'stale_hits': stale_hits,
+            'misses': misses,
+            'evictions': evictions,
+            'refreshes': refreshes,
+            'hit_rate': round((hits + stale_hits) / lookups, 3) if lookups else 0.0
+        }
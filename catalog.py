@@ -0,0 +1,335 @@
+"""
+Produktkatalog för Matplanerare
+Byggs EN gång när scrapern startar. Alla sökningar och uppslag lämnar ut referenser
+till samma produktobjekt i stället för att bygga om dem vid varje anrop.
+
+EGENSKAPER:
+- Stabila ID:n: blake2b-hash av (namn, märke, kategori) - samma ID i alla gunicorn-workers
+  och mellan omstarter (Pythons hash() är saltad per process och går inte att använda)
+- ID:n trunkeras till 53 bitar så att de kan skickas som Number i JavaScript utan avrundning
+- Kollisionskontroll: två olika produkter med samma ID stoppar uppbyggnaden direkt
+- Skrivskyddade produkter: CatalogProduct är en dict (fungerar med jsonify och .get())
+  men kan inte ändras - använd dict(produkt) för en muterbar kopia
+- version: hash över hela katalogens innehåll, används för att ogiltigförklara cachar
+- features: näringsvärden och lägsta pris som en tät NumPy-matris (en rad per produkt),
+  för vektoriserad poängsättning av ersättningsprodukter
+- nutrients: alla näringsvärden per 100 g som matris (nutrients.NUTRIENT_FIELDS, en rad
+  per produkt), för listornas näringssummor
+- Produkttyper (product_types.classify_product) beräknas en gång per produkt
+- Allergener som bitmask per produkt (features.allergens, se allergens.py)
+- Index kategori -> rader och produkttyp -> rader (rad = position i products), så att
+  kandidatmängder byggs som unioner av radnummer och produkterna plockas fram först
+  när filtreringen är klar
+"""
+
+import copy
+import hashlib
+import json
+
+import numpy as np
+
+from allergens import allergen_mask
+from nutrients import nutrient_matrix
+from product_types import classify_product
+
+# Största heltal som JavaScript representerar exakt är 2^53 - 1
+ID_BITS = 53
+
+
+def stable_id(*parts):
+    """Deterministiskt 53-bitars ID från godtyckliga delar (t.ex. namn, märke, kategori)"""
+    raw = '\x1f'.join(str(part or '') for part in parts)
+    digest = hashlib.blake2b(raw.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & ((1 << ID_BITS) - 1)
+
+
+class CatalogProduct(dict):
+    """Skrivskyddad dict för katalogprodukter (och deras prices/nutrition)"""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Katalogprodukter är skrivskyddade - använd dict(produkt) för en kopia')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class ProductFeatures:
+    """
+    Täta NumPy-vektorer för en mängd produkter (samma radordning som produktlistan)
+
+    values: matris (n, 6) med kolumnerna i COLUMNS - saknade värden är 0, precis som
+            `nutrition.get(x, 0) or 0` och `min(prices.values()) if prices else 0`
+    has_nutrition: True där produkten har en icke-tom nutrition-dict
+    category: heltalskod per produkt (se category_codes)
+    allergens: allergenmask per produkt (allergens.allergen_mask)
+    """
+
+    COLUMNS = ('protein', 'carbs', 'fat', 'calories', 'fiber', 'price')
+    PROTEIN, CARBS, FAT, CALORIES, FIBER, PRICE = range(6)
+
+    def __init__(self, values, has_nutrition, category, category_codes, allergens):
+        self.values = values
+        self.has_nutrition = has_nutrition
+        self.category = category
+        self.category_codes = category_codes
+        self.allergens = allergens
+
+    @classmethod
+    def from_products(cls, products):
+        category_codes = {}
+        rows = []
+        has_nutrition = []
+        category = []
+        allergens = []
+        for product in products:
+            nutrition = product.get('nutrition') or {}
+            prices = product.get('prices') or {}
+            rows.append((
+                nutrition.get('protein', 0) or 0,
+                nutrition.get('carbs', 0) or 0,
+                nutrition.get('fat', 0) or 0,
+                nutrition.get('calories', 0) or 0,
+                nutrition.get('fiber', 0) or 0,
+                min(prices.values()) if prices else 0
+            ))
+            has_nutrition.append(bool(nutrition))
+            category.append(category_codes.setdefault(product.get('category'), len(category_codes)))
+            allergens.append(allergen_mask(product.get('allergens')))
+
+        return cls(
+            np.array(rows, dtype=np.float64).reshape(len(rows), len(cls.COLUMNS)),
+            np.array(has_nutrition, dtype=bool),
+            np.array(category, dtype=np.int32),
+            category_codes,
+            np.array(allergens, dtype=np.int64)
+        )
+
+    def take(self, rows):
+        """Delmängd av raderna (samma kategorikoder)"""
+        rows = np.asarray(rows, dtype=np.intp)
+        return ProductFeatures(
+            self.values[rows], self.has_nutrition[rows], self.category[rows], self.category_codes, self.allergens[rows]
+        )
+
+    def category_code(self, category):
+        """Kod för en kategori, -1 om den inte finns bland produkterna"""
+        return self.category_codes.get(category, -1)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ProductCatalog:
+    """Oföränderlig katalog: ID -> produkt, kategori -> produkter"""
+
+    def __init__(self, products_by_category, images=None):
+        """
+        Args:
+            products_by_category: Dict {kategori: [rå produkt, ...]} (t.ex. FALLBACK_PRODUCTS)
+            images: Dict {bildnyckel: url} (t.ex. PRODUCT_IMAGES)
+        """
+        images = images or {}
+        by_id = {}
+        by_category = {}
+
+        for category, raw_products in products_by_category.items():
+            built = []
+            for raw in raw_products:
+                product = self._build(raw, category, images)
+                existing = by_id.get(product['id'])
+                if existing is not None:
+                    raise ValueError(
+                        f"ID-kollision i produktkatalogen: '{existing['name']}' ({existing['category']}) "
+                        f"och '{product['name']}' ({category}) har båda id {product['id']}"
+                    )
+                by_id[product['id']] = product
+                built.append(product)
+            by_category[category] = tuple(built)
+
+        self._by_id = by_id
+        self._by_category = by_category
+        self.products = tuple(p for products in by_category.values() for p in products)
+        self._row_of = {p['id']: row for row, p in enumerate(self.products)}
+        self.features = ProductFeatures.from_products(self.products)
+        self.nutrients = nutrient_matrix(p.get('nutrition') for p in self.products)
+        self.types = tuple(classify_product(p) for p in self.products)
+
+        # Index: kategori -> rader (kategorierna ligger i följd) och produkttyp -> rader
+        self._category_rows = {}
+        start = 0
+        for category, products in by_category.items():
+            self._category_rows[category] = np.arange(start, start + len(products), dtype=np.intp)
+            start += len(products)
+        types = np.array(self.types, dtype=object)
+        self._type_rows = {t: np.flatnonzero(types == t) for t in set(self.types)}
+        self._name_rows = {}
+        for row, product in enumerate(self.products):
+            self._name_rows.setdefault(product['name'], []).append(row)
+        self._has_prices = np.array([bool(p['prices']) for p in self.products], dtype=bool)
+        self._price_levels = np.unique(self.features.values[self._has_prices, ProductFeatures.PRICE])
+        self.version = hashlib.blake2b(
+            json.dumps(self.products, ensure_ascii=False, sort_keys=True).encode('utf-8'),
+            digest_size=8
+        ).hexdigest()
+
+    @staticmethod
+    def _build(product, category, images):
+        """Formatera en rå produkt (samma struktur som MatsparScraper tidigare byggde per anrop)"""
+        # Produkter använder en nyckel till bilddatabasen, annars används kategorins bild
+        image_key = product.get('image', '')
+        image_url = None
+        if image_key and image_key in images:
+            image_url = images[image_key]
+        elif category and category.lower() in images:
+            image_url = images[category.lower()]
+
+        name = product.get('name', '')
+        brand = product.get('brand', '')
+
+        return CatalogProduct({
+            'id': stable_id(name, brand, category),
+            'name': f"{product['name']} {product.get('brand', '')}".strip(),
+            'brand': product.get('brand'),
+            'weight': product.get('weight'),
+            'category': category,
+            'prices': CatalogProduct(product.get('prices', {})),
+            'nutrition': CatalogProduct(product.get('nutrition', {})),
+            'allergens': tuple(product.get('allergens', [])),
+            'image': image_url,
+            'url': None
+        })
+
+    def get(self, product_id):
+        """Produkten med ett visst ID, eller None"""
+        try:
+            return self._by_id.get(int(product_id))
+        except (TypeError, ValueError):
+            return None
+
+    def by_category(self, category):
+        """Alla produkter i en kategori (tom tuple om kategorin saknas)"""
+        return self._by_category.get((category or '').lower(), ())
+
+    def categories(self):
+        return list(self._by_category)
+
+    def rows_in_categories(self, categories, rest=False):
+        """
+        Unionen av kategoriernas rader, i kategoriernas ordning och utan dubbletter
+
+        rest=True lägger till resten av katalogen sist (i katalogordning).
+        """
+        seen = np.zeros(len(self.products), dtype=bool)
+        parts = []
+        for category in categories:
+            rows = self._category_rows.get((category or '').lower())
+            if rows is None:
+                continue
+            rows = rows[~seen[rows]]
+            seen[rows] = True
+            parts.append(rows)
+        if rest:
+            parts.append(np.flatnonzero(~seen))
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(parts)
+
+    def rows_of_types(self, rows, types):
+        """De rader vars produkttyp finns i types (ordningen behålls)"""
+        member = np.zeros(len(self.products), dtype=bool)
+        for product_type in types:
+            member[self._type_rows.get(product_type, [])] = True
+        return rows[member[rows]]
+
+    def rows_without_name(self, rows, name):
+        """Raderna utom produkter med ett visst namn"""
+        excluded = self._name_rows.get(name)
+        if not excluded:
+            return rows
+        return rows[~np.isin(rows, excluded)]
+
+    def rows_within_budget(self, rows, budget):
+        """Rader med minst ett pris och lägsta pris <= budget"""
+        return rows[self._has_prices[rows] & (self.features.values[rows, ProductFeatures.PRICE] <= budget)]
+
+    def budget_bucket(self, budget):
+        """
+        Hink för en budget (t.ex. i cachenycklar): antalet olika lägsta priser som ryms
+
+        Alla budgetar i samma hink släpper igenom samma produkter i rows_within_budget.
+        None om budget saknas (ingen budgetfiltrering).
+        """
+        if not budget:
+            return None
+        return int(np.searchsorted(self._price_levels, budget, side='right'))
+
+    def take(self, rows):
+        """Produkterna för en följd radnummer"""
+        return [self.products[row] for row in np.asarray(rows).tolist()]
+
+    def rows_for(self, products):
+        """Katalogens radnummer för produkterna, eller None om någon inte är en katalogprodukt"""
+        rows = []
+        for product in products:
+            row = self._row_of.get(product.get('id'))
+            if row is None or self.products[row] is not product:
+                return None
+            rows.append(row)
+        return np.array(rows, dtype=np.intp)
+
+    def features_for(self, products):
+        """
+        ProductFeatures för en lista produkter i samma ordning
+
+        Katalogprodukter slås upp i den förbyggda matrisen; innehåller listan något annat
+        (t.ex. onlineprodukter) byggs vektorerna från produkterna själva.
+        """
+        rows = self.rows_for(products)
+        if rows is None:
+            return ProductFeatures.from_products(products)
+        return self.features.take(rows)
+
+    def allergen_masks(self, products):
+        """Allergenmasker för en lista produkter (som features_for, men bara den kolumnen)"""
+        rows = self.rows_for(products)
+        if rows is None:
+            return np.array([allergen_mask(p.get('allergens')) for p in products], dtype=np.int64)
+        return self.features.allergens[rows]
+
+    def nutrients_for(self, products):
+        """Näringsvektorer per 100 g för en lista produkter (som features_for, men nutrients)"""
+        rows = self.rows_for(products)
+        if rows is None:
+            return nutrient_matrix(p.get('nutrition') for p in products)
+        return self.nutrients[rows]
+
+    def product_type(self, product):
+        """Produkttyp - uppslag för katalogprodukter, annars klassificeras produkten"""
+        row = self._row_of.get(product.get('id'))
+        if row is not None and self.products[row] is product:
+            return self.types[row]
+        return classify_product(product)
+
+    def resolve(self, products):
+        """Byt ut produkter (t.ex. från sökcachen) mot katalogens referenser där ID:t finns"""
+        return [self._by_id.get(p.get('id'), p) for p in products]
+
+    def __iter__(self):
+        return iter(self.products)
+
+    def __len__(self):
+        return len(self.products)
+
+    def __contains__(self, product_id):
+        return self.get(product_id) is not None
@@ -41,9 +41,17 @@ Individuella behov kan variera baserat på ålder, kön, graviditet, sjukdomar e
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload, validates
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
+import hashlib
 import re
 
+from allergens import ALLERGEN_BITS, allergen_mask, allergy_mask
+from nutrients import as_dict, nutrient_matrix, nutrient_totals
+
 db = SQLAlchemy()
 
 # Fördefinierade allergener/intoleranser
@@ -152,6 +160,10 @@ class Product(db.Model):
     # Allergen-taggar (komma-separerad lista)
     # Möjliga: gluten, lactose, nuts, eggs, fish, soy, meat, animal
     allergen_tags = db.Column(db.String(500), default='')
+    # Samma taggar som bitmask (se allergens.py) - sätts automatiskt från allergen_tags
+    allergen_mask = db.Column(db.Integer, nullable=False, default=0, index=True)
+    # Naturlig nyckel (namn, varumärke, vikt) - sätts automatiskt, unik, se upsert_products
+    natural_key = db.Column(db.String(40), index=True, unique=True)
     
     # Tidsstämplar
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -161,14 +173,38 @@ class Product(db.Model):
     prices = db.relationship('Price', backref='product', lazy=True, cascade='all, delete-orphan')
     nutrition = db.relationship('Nutrition', backref='product', uselist=False, cascade='all, delete-orphan')
     
+    @validates('allergen_tags')
+    def _update_allergen_mask(self, key, tags):
+        self.allergen_mask = allergen_mask((tags or '').split(','))
+        return tags
+    
+    @validates('name', 'brand', 'weight')
+    def _update_natural_key(self, key, value):
+        values = {'name': self.name, 'brand': self.brand, 'weight': self.weight, key: value}
+        self.natural_key = product_natural_key(values['name'], values['brand'], values['weight'])
+        return value
+    
+    @classmethod
+    def without_allergens(cls, allergies):
+        """SQL-villkor som utesluter produkter med allergierna, t.ex. Product.query.filter(Product.without_allergens(['vegan']))"""
+        return cls.allergen_mask.op('&')(allergy_mask(allergies)) == 0
+    
     def get_allergen_list(self):
         """Returnerar allergener som lista"""
         if not self.allergen_tags:
             return []
-        return [tag.strip() for tag in self.allergen_tags.split(',') if tag.strip()]
+        # Tolkad lista sparas på instansen så länge taggsträngen är densamma
+        cached = getattr(self, '_allergen_list', None)
+        if cached is None or cached[0] != self.allergen_tags:
+            cached = (self.allergen_tags, [tag.strip() for tag in self.allergen_tags.split(',') if tag.strip()])
+            self._allergen_list = cached
+        return list(cached[1])
     
     def has_allergen(self, allergen):
         """Kontrollerar om produkten innehåller ett visst allergen"""
+        bit = ALLERGEN_BITS.get(allergen.lower())
+        if bit is not None:
+            return bool((self.allergen_mask or 0) & bit)
         return allergen.lower() in [a.lower() for a in self.get_allergen_list()]
     
     def to_dict(self):
@@ -185,6 +221,12 @@ class Product(db.Model):
         }
 
 
+def product_natural_key(name, brand, weight):
+    """Nyckel för samma produkt oavsett källa: namn, varumärke och vikt (normaliserade)"""
+    raw = '|'.join(str(value or '').strip().lower() for value in (name, brand, weight))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
 class Price(db.Model):
     """Priser per butik"""
     __tablename__ = 'prices'
@@ -331,6 +373,10 @@ class NutritionPlan(db.Model):
             return []
         return [a.strip() for a in self.allergies.split(',') if a.strip()]
     
+    def get_allergy_mask(self):
+        """Allergierna som bitmask (se allergens.py)"""
+        return allergy_mask(self.get_allergies_list())
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -389,38 +435,14 @@ class ShoppingList(db.Model):
         return self.total_cost / self.household_size
     
     def calculate_nutrition_summary(self):
-        """Beräknar total näringssummering för listan"""
-        summary = {
-            'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0,
-            'fiber': 0, 'vitamin_c': 0, 'vitamin_d': 0, 'calcium': 0, 'iron': 0
-        }
-        
-        for item in self.items:
-            if item.product and item.product.nutrition:
-                nutr = item.product.nutrition
-                grams = item.estimate_grams()
-                factor = (grams / 100) * item.quantity
-                
-                if nutr.calories:
-                    summary['calories'] += nutr.calories * factor
-                if nutr.protein:
-                    summary['protein'] += nutr.protein * factor
-                if nutr.carbs:
-                    summary['carbs'] += nutr.carbs * factor
-                if nutr.fat:
-                    summary['fat'] += nutr.fat * factor
-                if nutr.fiber:
-                    summary['fiber'] += nutr.fiber * factor
-                if nutr.vitamin_c:
-                    summary['vitamin_c'] += nutr.vitamin_c * factor
-                if nutr.vitamin_d:
-                    summary['vitamin_d'] += nutr.vitamin_d * factor
-                if nutr.calcium:
-                    summary['calcium'] += nutr.calcium * factor
-                if nutr.iron:
-                    summary['iron'] += nutr.iron * factor
-        
-        return summary
+        """Beräknar total näringssummering för listan (alla näringsvärden i Nutrition)"""
+        items = [item for item in self.items if item.product and item.product.nutrition]
+        totals = nutrient_totals(
+            [item.quantity for item in items],
+            [item.estimate_grams() for item in items],
+            nutrient_matrix(item.product.nutrition for item in items)
+        )
+        return as_dict(totals)
     
     def to_dict(self):
         return {
@@ -562,8 +584,306 @@ class Recipe(db.Model):
         }
 
 
+class GenerationJob(db.Model):
+    """Generering av inköpslista eller recept som körs i bakgrunden (se jobs.py)"""
+    __tablename__ = 'generation_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True)  # UUID
+    session_id = db.Column(db.String(36), index=True)  # Kopplar till användarens session
+    kind = db.Column(db.String(20), nullable=False)  # list, recipes
+    
+    # queued → running → done/failed/cancelled
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    stage = db.Column(db.String(50))  # Steg som körs just nu
+    cancel_requested = db.Column(db.Boolean, default=False)
+    
+    params_json = db.Column(db.Text)  # JSON med anropets parametrar
+    result_json = db.Column(db.Text)  # JSON med svaret när jobbet är klart
+    http_status = db.Column(db.Integer)  # Status som svaret hade fått synkront
+    error = db.Column(db.String(500))
+    timings_json = db.Column(db.Text)  # JSON {steg: sekunder}
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    FINISHED = ('done', 'failed', 'cancelled')
+    
+    def get_params(self):
+        """Hämta parametrarna som dict"""
+        import json
+        return json.loads(self.params_json) if self.params_json else {}
+    
+    def to_dict(self):
+        import json
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'cancel_requested': bool(self.cancel_requested),
+            'error': self.error,
+            'timings': json.loads(self.timings_json) if self.timings_json else {},
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'queued_seconds': None,
+            'run_seconds': None
+        }
+        if self.started_at and self.created_at:
+            data['queued_seconds'] = round((self.started_at - self.created_at).total_seconds(), 3)
+        if self.finished_at and self.started_at:
+            data['run_seconds'] = round((self.finished_at - self.started_at).total_seconds(), 3)
+        if self.status == 'done' or self.result_json:
+            data['http_status'] = self.http_status
+            data['result'] = json.loads(self.result_json) if self.result_json else None
+        return data
+
+
+def upsert_products(products):
+    """
+    Product-rader för produkt-dicts (katalog/sökresultat), återanvända på naturlig nyckel
+    
+    Finns produkten redan (samma namn, varumärke och vikt) återanvänds raden och dess
+    priser, allergener och näringsvärden uppdateras (skrivs i anroparens nästa flush).
+    Annars skapas den med sina Price- och Nutrition-rader. Antalet anrop mot databasen
+    beror inte på antalet produkter: ett uppslag för befintliga rader (priser och
+    näringsvärden med selectinload) och en batchad INSERT per tabell för nya rader.
+    
+    natural_key är unik, så samtidiga genereringar (jobbtrådar, gunicorn-workers) kan inte
+    skapa samma produkt två gånger: en INSERT som krockar hoppas över och raden som den
+    andra genereringen skapade läses i stället.
+    
+    Args:
+        products: Produkt-dicts med name, brand, weight, category, url, image, allergens,
+                  prices ({butik: pris}) och nutrition (per 100g)
+    
+    Returns:
+        Product-instanser i samma ordning (samma instans för dubbletter)
+    """
+    keys = [product_natural_key(p.get('name'), p.get('brand'), p.get('weight')) for p in products]
+    existing = _products_by_key(set(keys))
+    
+    created = {}
+    for key, data in zip(keys, products):
+        product = existing.get(key)
+        if product is None:
+            created.setdefault(key, data)
+        else:
+            _update_product(product, data)
+    if created:
+        inserted = _insert_products(created)
+        existing.update(inserted)
+        # Skapade av en samtidig generering mellan uppslaget och INSERT
+        lost = {key: data for key, data in created.items() if key not in inserted}
+        if lost:
+            for key, product in _products_by_key(set(lost)).items():
+                _update_product(product, lost[key])
+                existing[key] = product
+    return [existing[key] for key in keys]
+
+
+def _products_by_key(keys):
+    """{naturlig nyckel: Product} med priser och näringsvärden laddade"""
+    if not keys:
+        return {}
+    query = Product.query.options(
+        selectinload(Product.prices), selectinload(Product.nutrition)
+    ).filter(Product.natural_key.in_(keys))
+    return {product.natural_key: product for product in query}
+
+
+def _nutrition_fields():
+    return [c.name for c in Nutrition.__table__.columns if c.name not in ('id', 'product_id')]
+
+
+def _update_product(product, data):
+    """Uppdatera en befintlig produkt med priser, allergener och näringsvärden från en produkt-dict"""
+    prices = {price.store: price for price in product.prices}
+    for store, amount in (data.get('prices') or {}).items():
+        price = prices.get(store)
+        if price is None:
+            product.prices.append(Price(store=store, price=amount))
+        elif price.price != amount:
+            price.price = amount
+    if 'allergens' in data:
+        tags = ','.join(data['allergens'])
+        if tags != (product.allergen_tags or ''):
+            product.allergen_tags = tags
+    nutr_data = data.get('nutrition') or {}
+    if nutr_data:
+        if product.nutrition is None:
+            product.nutrition = Nutrition(**{field: nutr_data.get(field) for field in _nutrition_fields()})
+        else:
+            for field in _nutrition_fields():
+                if field in nutr_data and getattr(product.nutrition, field) != nutr_data[field]:
+                    setattr(product.nutrition, field, nutr_data[field])
+    product.matspar_url = product.matspar_url or data.get('url')
+    product.image_url = product.image_url or data.get('image')
+
+
+def _insert_products(created):
+    """
+    Nya produkter med priser och näringsvärden: en INSERT per tabell för alla produkter
+    
+    Skrivs med bulk-INSERT i stället för db.session.add - ORM-flushen skickar en INSERT
+    per rad när primärnyckeln måste läsas tillbaka (SQLite). Validatorerna körs inte här,
+    så natural_key och allergen_mask sätts direkt. Relationerna fylls i på instanserna så
+    att to_dict inte behöver ladda dem igen.
+    
+    Produkter vars nyckel redan finns (ON CONFLICT DO NOTHING) skapas inte och får inga
+    priser eller näringsvärden här - de saknas i svaret och uppdateras av anroparen.
+    
+    Args:
+        created: {naturlig nyckel: produkt-dict}
+    
+    Returns:
+        {naturlig nyckel: Product} för raderna som faktiskt skapades
+    """
+    rows = []
+    for key, data in created.items():
+        tags = ','.join(data.get('allergens', []))
+        rows.append({
+            'name': data.get('name'),
+            'brand': data.get('brand'),
+            'weight': data.get('weight'),
+            'category': data.get('category'),
+            'matspar_url': data.get('url'),
+            'image_url': data.get('image'),
+            'allergen_tags': tags,
+            'allergen_mask': allergen_mask(tags.split(',')),
+            'natural_key': key
+        })
+    # Ordningen i RETURNING är inte garanterad - produkterna kopplas ihop via nyckeln
+    inserted = {product.natural_key: product for product in db.session.scalars(
+        sqlite_insert(Product).on_conflict_do_nothing(index_elements=['natural_key']).returning(Product),
+        rows, execution_options={'render_nulls': True}
+    )}
+    
+    price_rows = []
+    nutrition_rows = []
+    fields = _nutrition_fields()
+    for key, data in created.items():
+        if key not in inserted:
+            continue
+        product_id = inserted[key].id
+        for store, amount in (data.get('prices') or {}).items():
+            price_rows.append({'product_id': product_id, 'store': store, 'price': amount})
+        nutr_data = data.get('nutrition') or {}
+        if nutr_data:
+            nutrition_rows.append({'product_id': product_id, **{field: nutr_data.get(field) for field in fields}})
+    
+    prices = {}
+    if price_rows:
+        for price in db.session.scalars(insert(Price).returning(Price), price_rows):
+            prices.setdefault(price.product_id, []).append(price)
+    nutrition = {}
+    if nutrition_rows:
+        nutrition = {n.product_id: n for n in db.session.scalars(
+            insert(Nutrition).returning(Nutrition), nutrition_rows, execution_options={'render_nulls': True}
+        )}
+    
+    for product in inserted.values():
+        set_committed_value(product, 'prices', prices.get(product.id, []))
+        set_committed_value(product, 'nutrition', nutrition.get(product.id))
+    return inserted
+
+
 def init_db(app):
     """Initierar databasen"""
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        _add_allergen_mask_column()
+        _add_natural_key_column()
+
+
+def _add_allergen_mask_column():
+    """
+    Lägg till products.allergen_mask i databaser skapade innan kolumnen fanns
+    (create_all skapar bara saknade tabeller, inte saknade kolumner)
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('products')}
+    if 'allergen_mask' in columns:
+        return
+    
+    with db.engine.begin() as conn:
+        conn.execute(text('ALTER TABLE products ADD COLUMN allergen_mask INTEGER NOT NULL DEFAULT 0'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_products_allergen_mask ON products (allergen_mask)'))
+        # Fyll i masken från befintliga taggar (en uppdatering per unik taggsträng)
+        rows = conn.execute(text(
+            "SELECT DISTINCT allergen_tags FROM products WHERE allergen_tags IS NOT NULL AND allergen_tags != ''"
+        )).fetchall()
+        for (tags,) in rows:
+            conn.execute(
+                text('UPDATE products SET allergen_mask = :mask WHERE allergen_tags = :tags'),
+                {'mask': allergen_mask(tags.split(',')), 'tags': tags}
+            )
+    print("Databas uppdaterad: products.allergen_mask")
+
+
+def _add_natural_key_column():
+    """
+    Lägg till products.natural_key i databaser skapade innan kolumnen fanns (se _add_allergen_mask_column)
+    
+    Indexet ix_products_natural_key är unikt. Databaser med kolumnen men ett vanligt index
+    (eller dubbletter från tiden före nyckeln) slås först ihop, se _merge_duplicate_products.
+    """
+    inspector = inspect(db.engine)
+    columns = {column['name'] for column in inspector.get_columns('products')}
+    indexes = {index['name']: index for index in inspector.get_indexes('products')}
+    index = indexes.get('ix_products_natural_key')
+    if 'natural_key' in columns and index is not None and index['unique']:
+        return
+    
+    with db.engine.begin() as conn:
+        if 'natural_key' not in columns:
+            conn.execute(text('ALTER TABLE products ADD COLUMN natural_key VARCHAR(40)'))
+            rows = conn.execute(text('SELECT id, name, brand, weight FROM products')).fetchall()
+            if rows:
+                conn.execute(
+                    text('UPDATE products SET natural_key = :key WHERE id = :id'),
+                    [{'key': product_natural_key(name, brand, weight), 'id': product_id} for product_id, name, brand, weight in rows]
+                )
+        merged = _merge_duplicate_products(conn)
+        conn.execute(text('DROP INDEX IF EXISTS ix_products_natural_key'))
+        conn.execute(text('CREATE UNIQUE INDEX ix_products_natural_key ON products (natural_key)'))
+    print(f"Databas uppdaterad: products.natural_key (unik, {merged} dubbletter sammanslagna)")
+
+
+def _merge_duplicate_products(conn):
+    """
+    Slå ihop produkter med samma natural_key till den äldsta raden
+    
+    Varor i inköpslistor pekas om till den raden. Priser (per butik) och näringsvärden
+    som den raden saknar flyttas över, resten tas bort med dubbletten.
+    
+    Returns:
+        Antal borttagna dubbletter
+    """
+    rows = conn.execute(text(
+        'SELECT id, natural_key FROM products WHERE natural_key IN '
+        '(SELECT natural_key FROM products WHERE natural_key IS NOT NULL '
+        'GROUP BY natural_key HAVING COUNT(*) > 1) ORDER BY id'
+    )).fetchall()
+    keep = {}
+    duplicates = []
+    for product_id, key in rows:
+        if key in keep:
+            duplicates.append({'keep': keep[key], 'duplicate': product_id})
+        else:
+            keep[key] = product_id
+    if not duplicates:
+        return 0
+    
+    for statement in (
+        'UPDATE shopping_items SET product_id = :keep WHERE product_id = :duplicate',
+        'UPDATE shopping_items SET original_product_id = :keep WHERE original_product_id = :duplicate',
+        'UPDATE prices SET product_id = :keep WHERE product_id = :duplicate '
+        'AND store NOT IN (SELECT store FROM prices WHERE product_id = :keep)',
+        'DELETE FROM prices WHERE product_id = :duplicate',
+        'UPDATE nutrition SET product_id = :keep WHERE product_id = :duplicate '
+        'AND NOT EXISTS (SELECT 1 FROM nutrition WHERE product_id = :keep)',
+        'DELETE FROM nutrition WHERE product_id = :duplicate',
+        'DELETE FROM products WHERE id = :duplicate',
+    ):
+        conn.execute(text(statement), duplicates)
+    return len(duplicates)
@@ -0,0 +1,609 @@
+"""
+Listgenerering för Matplanerare
+api_generate_list uppdelad i fristående steg. Varje steg är en vanlig funktion som inte
+behöver någon request (persistensen behöver en app-kontext för databasen), så stegen kan
+köras från CLI, batchjobb och benchmark.py - och mätas och optimeras var för sig.
+
+STEGEN:
+1. compute_demand: totalt näringsbehov och produktkategorier (sökterm, portion, antal
+   måltider) utifrån plan, dagar, hushåll, allergier och valda måltider
+2. retrieve_candidates: sökningar för alla kategorier (parallellt via search_many) och
+   kandidatmatrisen som listlösaren räknar på
+3. solve_quantities: antal förpackningar per kandidat (list_solver)
+4. persist_list: ShoppingList med varor, produkter återanvända på naturlig nyckel (utan commit)
+
+ListGenerator kör stegen i ordning och mäter tiden för varje steg (timings). Med en
+StageTimings samlas tiderna från alla genereringar (visas i /api/metrics). Med en
+GenerationCache återanvänds färdiga listor för samma indata: steg 2-4 ersätts då av
+steget 'clone' (varorna kopieras till en ny lista).
+"""
+
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.orm.attributes import set_committed_value
+
+from cache import SharedCache, make_key
+from database import db, ShoppingList, ShoppingItem, upsert_products
+from list_solver import DEFAULT_TIME_BUDGET, GROUP_SLACK, NUTRIENT_KEYS, ListSolver, pack_matrix, with_fallback_kcal
+from nutrients import as_dict, nutrient_totals
+
+# Kandidater per produktkategori som listlösaren får välja mellan
+CANDIDATES_PER_SEARCH = 10
+
+STAGES = ('demand', 'candidates', 'solve', 'persist')
+
+# Resultatcachen (GenerationCache)
+DEFAULT_CACHE_SIZE = int(os.environ.get('MATSPAR_GENERATION_CACHE_SIZE', 500))
+DEFAULT_CACHE_TTL = 6 * 3600
+BUDGET_BUCKET = 50
+
+
+def parse_weight_grams(weight_str):
+    """Konvertera viktstring till gram (t.ex. '500g' -> 500, '1kg' -> 1000)"""
+    if not weight_str:
+        return 500  # Anta 500g om okänd
+    weight_str = str(weight_str).lower().replace(' ', '')
+    
+    # Hantera kg
+    kg_match = re.search(r'(\d+(?:[.,]\d+)?)\s*kg', weight_str)
+    if kg_match:
+        return float(kg_match.group(1).replace(',', '.')) * 1000
+    
+    # Hantera gram
+    g_match = re.search(r'(\d+(?:[.,]\d+)?)\s*g', weight_str)
+    if g_match:
+        return float(g_match.group(1).replace(',', '.'))
+    
+    # Hantera liter (mjölk etc) - anta 1L = 1000g
+    l_match = re.search(r'(\d+(?:[.,]\d+)?)\s*l', weight_str)
+    if l_match:
+        return float(l_match.group(1).replace(',', '.')) * 1000
+    
+    # Hantera dl
+    dl_match = re.search(r'(\d+)\s*dl', weight_str)
+    if dl_match:
+        return float(dl_match.group(1)) * 100
+    
+    # Hantera ml
+    ml_match = re.search(r'(\d+)\s*ml', weight_str)
+    if ml_match:
+        return float(ml_match.group(1))
+    
+    # Hantera st (ägg: 6st ≈ 360g, 12st ≈ 720g)
+    st_match = re.search(r'(\d+)\s*st', weight_str)
+    if st_match:
+        count = int(st_match.group(1))
+        return count * 60  # Anta 60g per styck
+    
+    return 500  # Default
+
+
+# ============== STEG 1: BEHOV ==============
+
+def compute_demand(plan, days=7, household_size=1, allergies=None, include_breakfast=True,
+                   include_lunch=True, include_dinner=True, include_snacks=False):
+    """
+    Totalt näringsbehov och produktkategorier att köpa
+    
+    Returns:
+        Dict med 'days', 'household_size', 'allergies', 'totals' (makron för hela
+        listan: dagligt behov × dagar × personer) och 'categories' (sorterade efter prioritet)
+    """
+    allergies = list(allergies or [])
+    
+    # Totalt behov = dagligt behov × antal dagar × antal personer
+    totals = {
+        key: (getattr(plan, f'{key}_target') or 0) * days * household_size
+        for key in ('calories', 'protein', 'carbs', 'fat', 'fiber')
+    }
+    
+    # ============== NY MÅLTIDSBASERAD STRATEGI ==============
+    # Vi beräknar utifrån antal måltider som behöver täckas
+    #
+    # Antal måltider som behöver mat (baserat på vad som valts):
+    num_breakfasts = days * household_size if include_breakfast else 0
+    num_lunches = days * household_size if include_lunch else 0
+    num_dinners = days * household_size if include_dinner else 0
+    num_snacks = days * household_size if include_snacks else 0
+    
+    # ============== PRODUKTKATEGORIER - KÖPER TILLRÄCKLIGT FÖR ALLA MÅLTIDER ==============
+    # Varje produkt specificerar:
+    # - meals: antal måltider denna produkt ska täcka (baserat på num_breakfasts etc)
+    # - portion_grams: gram per portion
+    # - kcal_per_100g: ungefärliga kalorier (fallback om nutrition saknas)
+    
+    product_categories = []
+    
+    # ===== FRUKOST (endast om vald) =====
+    if include_breakfast:
+        product_categories.extend([
+            # Frukostar: gröt, bröd+pålägg, ägg, müsli etc
+            {'search': 'havregryn', 'priority': 1, 'type': 'breakfast', 'kcal_per_100g': 370,
+             'meals': int(num_breakfasts * 0.6), 'portion_grams': 70},  # Gröt ~60% av frukostar
+            
+            {'search': 'bröd', 'priority': 1, 'type': 'breakfast', 'kcal_per_100g': 250,
+             'meals': int(num_breakfasts * 1.0), 'portion_grams': 80},  # Bröd till alla frukostar + smörgås
+            
+            {'search': 'ägg', 'priority': 1, 'type': 'breakfast', 'kcal_per_100g': 155,
+             'meals': int(num_breakfasts * 0.6), 'portion_grams': 120},  # Ägg de flesta morgnar + matlagning
+            
+            {'search': 'mjölk', 'priority': 2, 'type': 'breakfast', 'kcal_per_100g': 45,
+             'meals': int(num_breakfasts * 1.5), 'portion_grams': 250},  # Till gröt, kaffe, etc
+            
+            {'search': 'yoghurt', 'priority': 2, 'type': 'breakfast', 'kcal_per_100g': 60,
+             'meals': int(num_breakfasts * 0.4), 'portion_grams': 200},
+            
+            {'search': 'smör', 'priority': 2, 'type': 'fat', 'kcal_per_100g': 720,
+             'meals': int(num_breakfasts * 1.5), 'portion_grams': 15},  # Smörgås
+            
+            {'search': 'ost', 'priority': 2, 'type': 'dairy', 'kcal_per_100g': 350,
+             'meals': int(num_breakfasts * 0.8), 'portion_grams': 30},  # Smörgåsost
+        ])
+    
+    # ===== LUNCH & MIDDAG - PROTEIN (endast om lunch eller middag vald) =====
+    if include_lunch or include_dinner:
+        num_main_meals = num_lunches + num_dinners
+        product_categories.extend([
+            # Huvudmåltider: num_lunches + num_dinners st
+            {'search': 'kycklingfilé', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 120,
+             'meals': int(num_main_meals * 0.3), 'portion_grams': 175},  # ~30% av måltider
+            
+            {'search': 'nötfärs', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 205,
+             'meals': int(num_main_meals * 0.25), 'portion_grams': 150},  # ~25% av måltider
+            
+            {'search': 'lax', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 205,
+             'meals': int(num_main_meals * 0.15), 'portion_grams': 150},  # Fisk ~15%
+            
+            {'search': 'fläskfilé', 'priority': 1, 'type': 'protein', 'kcal_per_100g': 145,
+             'meals': int(num_main_meals * 0.1), 'portion_grams': 150},  # ~10%
+            
+            {'search': 'korv', 'priority': 2, 'type': 'protein', 'kcal_per_100g': 280,
+             'meals': int(num_main_meals * 0.1), 'portion_grams': 120},  # ~10%
+            
+            # ===== LUNCH & MIDDAG - KOLHYDRATER =====
+            {'search': 'pasta', 'priority': 1, 'type': 'carbs', 'kcal_per_100g': 355,
+             'meals': int(num_main_meals * 0.35), 'portion_grams': 100},  # ~35% av måltider
+            
+            {'search': 'ris', 'priority': 1, 'type': 'carbs', 'kcal_per_100g': 355,
+             'meals': int(num_main_meals * 0.35), 'portion_grams': 85},  # ~35%
+            
+            {'search': 'potatis', 'priority': 1, 'type': 'carbs', 'kcal_per_100g': 85,
+             'meals': int(num_main_meals * 0.3), 'portion_grams': 300},  # ~30%
+            
+            # ===== FETTER - KRITISKT FÖR KALORIER =====
+            {'search': 'olja', 'priority': 2, 'type': 'fat', 'kcal_per_100g': 880,
+             'meals': int(num_main_meals * 0.6), 'portion_grams': 15},  # Stekning
+            
+            {'search': 'grädde', 'priority': 3, 'type': 'fat', 'kcal_per_100g': 290,
+             'meals': int(num_dinners * 0.3), 'portion_grams': 100},  # Till såser
+            
+            # ===== GRÖNSAKER =====
+            {'search': 'tomat', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 20,
+             'meals': int(num_main_meals * 0.4), 'portion_grams': 150},
+            
+            {'search': 'gurka', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 12,
+             'meals': int(num_lunches * 0.4), 'portion_grams': 100},
+            
+            {'search': 'morot', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 35,
+             'meals': int(num_main_meals * 0.3), 'portion_grams': 100},
+            
+            {'search': 'broccoli', 'priority': 3, 'type': 'vegetables', 'kcal_per_100g': 35,
+             'meals': int(num_dinners * 0.4), 'portion_grams': 150},
+            
+            {'search': 'lök', 'priority': 4, 'type': 'vegetables', 'kcal_per_100g': 40,
+             'meals': int(num_dinners * 0.6), 'portion_grams': 75},
+            
+            {'search': 'paprika', 'priority': 4, 'type': 'vegetables', 'kcal_per_100g': 25,
+             'meals': int(num_dinners * 0.3), 'portion_grams': 100},
+        ])
+    
+    # ===== MELLANMÅL & FRUKT (endast om valt) =====
+    if include_snacks:
+        product_categories.extend([
+            {'search': 'banan', 'priority': 2, 'type': 'snack', 'kcal_per_100g': 95,
+             'meals': int(num_snacks * 0.6), 'portion_grams': 130},
+            
+            {'search': 'äpple', 'priority': 2, 'type': 'snack', 'kcal_per_100g': 55,
+             'meals': int(num_snacks * 0.5), 'portion_grams': 180},
+            
+            {'search': 'kvarg', 'priority': 2, 'type': 'snack', 'kcal_per_100g': 65,
+             'meals': int(num_snacks * 0.5), 'portion_grams': 200},
+        ])
+    
+    # Lägg till vegetariska proteinkällor om vegetarian/vegan
+    if 'vegetarian' in allergies or 'vegan' in allergies:
+        # Ta bort köttprodukter och lägg till vegetariska
+        protein_meals = int((num_lunches + num_dinners) * 0.25)
+        product_categories = [p for p in product_categories if p['type'] != 'protein' or 'ägg' in p['search']]
+        product_categories.insert(0, {'search': 'tofu', 'portion_grams': 200, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 120, 'meals': protein_meals})
+        product_categories.insert(1, {'search': 'quorn', 'portion_grams': 150, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 100, 'meals': protein_meals})
+        product_categories.insert(2, {'search': 'linser', 'portion_grams': 100, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 115, 'meals': protein_meals})
+        product_categories.insert(3, {'search': 'bönor', 'portion_grams': 150, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 130, 'meals': protein_meals})
+        product_categories.insert(4, {'search': 'sojafärs', 'portion_grams': 125, 'priority': 1, 'type': 'protein', 'kcal_per_100g': 140, 'meals': protein_meals})
+    
+    # Sortera efter prioritet
+    product_categories.sort(key=lambda x: x['priority'])
+    
+    return {
+        'days': days,
+        'household_size': household_size,
+        'allergies': allergies,
+        'totals': totals,
+        'categories': product_categories
+    }
+
+
+# ============== STEG 2: KANDIDATER ==============
+
+def retrieve_candidates(scraper, demand, store=None, prefer_cheaper=False, budget=None, limit=CANDIDATES_PER_SEARCH):
+    """
+    Sök alla produktkategorier och bygg kandidatmatrisen
+    
+    En grupp per produktkategori. Gruppens tak i gram är GROUP_SLACK gånger behovet
+    (portion × måltider), men minst en förpackning av den minsta kandidaten.
+    
+    Returns:
+        Dict med 'products' (lista med (kategori, produkt-dict, pris, gram, grupp)),
+        'vectors' (n × len(NUTRIENT_FIELDS) per 100 g, från katalogen - kategorins
+        kcal_per_100g för produkter utan kalorier), 'nutrients'
+        (n × len(NUTRIENT_KEYS) per förpackning), 'prices', 'grams', 'groups' och 'group_caps'
+    """
+    categories = demand['categories']
+    # Sök alla produktkategorier parallellt i förväg (latens ≈ långsammaste sökningen)
+    search_results = scraper.search_many(
+        [p['search'] for p in categories],
+        allergies=demand['allergies'],
+        prefer_cheaper=prefer_cheaper or (budget is not None),
+        limit=limit
+    )
+    
+    products = []
+    group_caps = []
+    seen_names = set()
+    for group, product_info in enumerate(categories):
+        group_grams = []
+        for prod_data in search_results.get(product_info['search'], []):
+            prod_prices = prod_data.get('prices', {})
+            if not prod_prices or prod_data.get('name') in seen_names:
+                continue
+            seen_names.add(prod_data.get('name'))
+            
+            if store and store in prod_prices:
+                prod_price = prod_prices[store]
+            else:
+                prod_price = min(prod_prices.values())
+            pack_grams = parse_weight_grams(prod_data.get('weight', '500g'))
+            
+            products.append((product_info, prod_data, prod_price, pack_grams, group))
+            group_grams.append(pack_grams)
+        
+        grams_needed = product_info['portion_grams'] * product_info.get('meals', 1)
+        group_caps.append(max(grams_needed * GROUP_SLACK, min(group_grams)) if group_grams else 0)
+    
+    vectors = with_fallback_kcal(
+        scraper.catalog.nutrients_for([p[1] for p in products]),
+        [p[0].get('kcal_per_100g', 100) for p in products]
+    )
+    grams = np.array([p[3] for p in products], dtype=np.float64)
+    return {
+        'products': products,
+        'vectors': vectors,
+        'nutrients': pack_matrix(vectors, grams),
+        'prices': np.array([p[2] for p in products], dtype=np.float64),
+        'grams': grams,
+        'groups': np.array([p[4] for p in products], dtype=np.int64),
+        'group_caps': group_caps
+    }
+
+
+# ============== STEG 3: KVANTITETER ==============
+
+def solve_quantities(plan, demand, candidates, budget=None, time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Antal förpackningar per kandidat som når planens mål till lägsta pris inom budget
+    
+    Returns:
+        Dict med 'quantities' (int-array per kandidat), 'totals' (näringsvärden för
+        hela listan, alla NUTRIENT_FIELDS) och 'solver' (ListSolver.stats)
+    """
+    solver = ListSolver.for_plan(plan, demand['days'], demand['household_size'], budget=budget, time_budget=time_budget)
+    quantities = solver.solve(
+        candidates['nutrients'],
+        candidates['prices'],
+        candidates['grams'],
+        candidates['groups'],
+        candidates['group_caps']
+    )
+    return {
+        'quantities': quantities,
+        'totals': as_dict(nutrient_totals(quantities, candidates['grams'], candidates['vectors'])),
+        'solver': solver.stats
+    }
+
+
+# ============== STEG 4: PERSISTENS ==============
+
+def chosen_items(candidates, solution):
+    """
+    Varorna som lösningen valde
+    
+    Returns:
+        Lista med (produkt-dict med kategori, pris per förpackning, antal) för kandidater med antal > 0
+    """
+    return [
+        ({**prod_data, 'category': prod_data.get('category', product_info['type'])}, prod_price, quantity)
+        for (product_info, prod_data, prod_price, pack_grams, group), quantity
+        in zip(candidates['products'], solution['quantities'].tolist())
+        if quantity > 0
+    ]
+
+
+def persist_list(plan, demand, candidates, solution, session_id=None, store=None, budget=None):
+    """
+    Spara listan och dess varor i db.session (se save_list)
+    
+    Returns:
+        ShoppingList (flushad, har ID)
+    """
+    return save_list(plan, demand, chosen_items(candidates, solution), session_id, store, budget)
+
+
+def save_list(plan, demand, items, session_id=None, store=None, budget=None):
+    """
+    Spara en ShoppingList med varorna i db.session
+    
+    Produkterna återanvänds på naturlig nyckel (upsert_products), så products-tabellen
+    växer inte med antalet listor. Nya produkter, priser, näringsvärden och varor skrivs
+    med en batchad INSERT per tabell - antalet anrop mot databasen är detsamma oavsett
+    hur många varor listan har. Committar inte - anroparen gör det (och kan registrera
+    hooks på sessionen innan).
+    
+    Args:
+        items: Lista med (produkt-dict, pris per förpackning, antal) - se chosen_items
+    
+    Returns:
+        ShoppingList (flushad, har ID)
+    """
+    days = demand['days']
+    household_size = demand['household_size']
+    shopping_list = ShoppingList(
+        session_id=session_id,
+        name=f"Inköpslista - {plan.name} ({days} dagar, {household_size} pers)",
+        store=store,
+        days=days,
+        plan_id=plan.id,
+        budget=budget,
+        household_size=household_size,
+        # Samma pris som lösaren räknade med (vald butik, annars lägsta)
+        total_cost=sum(prod_price * quantity for prod_data, prod_price, quantity in items)
+    )
+    db.session.add(shopping_list)
+    db.session.flush()
+    
+    products = upsert_products([prod_data for prod_data, prod_price, quantity in items])
+    rows = []
+    if items:
+        rows = db.session.scalars(insert(ShoppingItem).returning(ShoppingItem), [
+            {'list_id': shopping_list.id, 'product_id': product.id, 'quantity': quantity}
+            for (prod_data, prod_price, quantity), product in zip(items, products)
+        ]).all()
+    # Varorna i listans ordning utan att ladda om dem (RETURNING har ingen garanterad ordning)
+    set_committed_value(shopping_list, 'items', sorted(rows, key=lambda item: item.id))
+    
+    db.session.flush()
+    return shopping_list
+
+
+def nutrition_report(demand, solution):
+    """nutrition_coverage, nutrition_totals och nutrition_targets för svaret"""
+    needed = demand['totals']
+    totals = solution['totals']
+    coverage = {
+        key: round(totals[key] / needed[key] * 100) if needed[key] else 0
+        for key in ('calories', 'protein', 'carbs', 'fat')
+    }
+    return {
+        'nutrition_coverage': coverage,
+        'nutrition_totals': {key: round(totals[key]) for key in ('calories', 'protein', 'carbs', 'fat', 'fiber')},
+        'nutrition_targets': {key: round(needed[key]) for key in ('calories', 'protein', 'carbs', 'fat', 'fiber')}
+    }
+
+
+# ============== RESULTATCACHE ==============
+
+class GenerationCache:
+    """
+    Färdiga listor per normaliserade indata, delas mellan gunicorn-workers (SharedCache)
+    
+    Många sessioner genererar med samma indata (standardplanen, 7 dagar, 1-2 personer,
+    samma butik). Nyckeln är en hash av allt kedjan beror på - planens mål och lägen,
+    allergier, dagar, hushåll, butik, budget (avrundad nedåt till BUDGET_BUCKET kr),
+    måltider, prefer_cheaper, lösarens tidsbudget och katalogens version. Värdet är de
+    valda varorna och listans näringssummor. En träff klonas till en ny ShoppingList
+    (save_list) utan sökningar eller lösare.
+    
+    En träff räknas bara om den cachade listan ryms i den exakta budgeten. Cachen töms när
+    prisuppdateraren har skrivit nya priser (PriceRefresher(invalidates=...)).
+    """
+    
+    def __init__(self, cache=None):
+        self.cache = cache or SharedCache('generation', max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, stale_ttl=0)
+    
+    @staticmethod
+    def key(generator):
+        plan = generator.plan
+        budget = generator.budget
+        return make_key(
+            'list',
+            [(key, getattr(plan, f'{key}_target', None), (getattr(plan, f'{key}_mode', None) or 'target').lower())
+             for key in NUTRIENT_KEYS],
+            sorted(allergy.lower() for allergy in generator.allergies),
+            generator.days,
+            generator.household_size,
+            (generator.store or '').lower(),
+            None if budget is None else int(budget // BUDGET_BUCKET),
+            sorted(generator.meals.items()),
+            bool(generator.prefer_cheaper),
+            generator.time_budget,
+            generator.scraper.catalog.version
+        )
+    
+    def get(self, generator):
+        """Cachad lista {'items', 'totals', 'total_cost'} för generatorns indata, eller None"""
+        entry, state = self.cache.get(self.key(generator))
+        if state != 'fresh':
+            return None
+        if generator.budget is not None and entry['total_cost'] > generator.budget:
+            return None
+        return entry
+    
+    def set(self, generator, items, solution):
+        self.cache.set(self.key(generator), {
+            'items': [[prod_data, float(prod_price), int(quantity)] for prod_data, prod_price, quantity in items],
+            'totals': solution['totals'],
+            'total_cost': sum(prod_price * quantity for prod_data, prod_price, quantity in items)
+        })
+    
+    def clear(self):
+        self.cache.clear()
+    
+    def stats(self):
+        return self.cache.stats()
+
+
+# ============== HELA KEDJAN ==============
+
+class StageTimings:
+    """Tid per steg summerat över alla genereringar (trådsäker)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+    
+    def record(self, stage, seconds):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            entry['count'] += 1
+            entry['total_seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['last_seconds'] = seconds
+    
+    def stats(self):
+        with self._lock:
+            return {
+                stage: {
+                    'count': entry['count'],
+                    'mean_ms': round(entry['total_seconds'] / entry['count'] * 1000, 1),
+                    'max_ms': round(entry['max_seconds'] * 1000, 1),
+                    'last_ms': round(entry['last_seconds'] * 1000, 1)
+                }
+                for stage, entry in self._stages.items()
+            }
+
+
+class ListGenerator:
+    """Kör stegen för en plan och mäter tiden för varje steg"""
+    
+    def __init__(self, scraper, plan, days=7, household_size=1, store=None, budget=None, prefer_cheaper=False,
+                 allergies=None, include_breakfast=True, include_lunch=True, include_dinner=True,
+                 include_snacks=False, time_budget=DEFAULT_TIME_BUDGET, recorder=None, progress=None, cache=None):
+        """
+        Args:
+            scraper: MatsparScraper som kandidaterna söks med
+            plan: NutritionPlan (eller objekt med samma *_target/*_mode-attribut)
+            days, household_size, store, budget, prefer_cheaper: Som i /api/generate-list
+            allergies: Allergier att undvika (standard: planens)
+            include_*: Vilka måltider listan ska täcka
+            time_budget: Listlösarens tidsbudget i sekunder
+            recorder: StageTimings som stegtiderna också rapporteras till
+            progress: Funktion(steg) som anropas före varje steg (jobbkön, se jobs.py)
+            cache: GenerationCache med färdiga listor (generate)
+        """
+        self.scraper = scraper
+        self.plan = plan
+        self.days = days
+        self.household_size = household_size
+        self.store = store
+        self.budget = budget
+        self.prefer_cheaper = prefer_cheaper
+        self.allergies = plan.get_allergies_list() if allergies is None else list(allergies)
+        self.meals = {
+            'include_breakfast': include_breakfast,
+            'include_lunch': include_lunch,
+            'include_dinner': include_dinner,
+            'include_snacks': include_snacks
+        }
+        self.time_budget = time_budget
+        self.recorder = recorder
+        self.progress = progress
+        self.cache = cache
+        self.timings = {}
+    
+    def _timed(self, stage, function, *args, **kwargs):
+        if self.progress is not None:
+            self.progress(stage)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            self.timings[stage] = round(seconds, 4)
+            if self.recorder is not None:
+                self.recorder.record(stage, seconds)
+    
+    def demand(self):
+        return self._timed('demand', compute_demand, self.plan, self.days, self.household_size,
+                           self.allergies, **self.meals)
+    
+    def candidates(self, demand):
+        return self._timed('candidates', retrieve_candidates, self.scraper, demand, self.store,
+                           self.prefer_cheaper, self.budget)
+    
+    def solve(self, demand, candidates):
+        return self._timed('solve', solve_quantities, self.plan, demand, candidates, self.budget, self.time_budget)
+    
+    def persist(self, demand, candidates, solution, session_id=None):
+        return self._timed('persist', persist_list, self.plan, demand, candidates, solution,
+                           session_id, self.store, self.budget)
+    
+    def plan_list(self):
+        """Steg 1-3 (ingen databas): (behov, kandidater, lösning)"""
+        demand = self.demand()
+        candidates = self.candidates(demand)
+        return demand, candidates, self.solve(demand, candidates)
+    
+    def cached(self):
+        """Cachad lista för generatorns indata (GenerationCache.get), eller None - slås upp en gång"""
+        if self.cache is None:
+            return None
+        if not hasattr(self, '_cached_entry'):
+            self._cached_entry = self.cache.get(self)
+        return self._cached_entry
+    
+    def clone(self, demand, entry, session_id=None):
+        return self._timed('clone', save_list, self.plan, demand, entry['items'], session_id, self.store, self.budget)
+    
+    def generate(self, session_id=None):
+        """
+        Alla steg, eller en kopia av en cachad lista med samma indata. Committar inte (se save_list)
+        
+        Returns:
+            (ShoppingList, behov, lösning) - lösningen från cachen har bara 'totals' och 'cached'
+        """
+        demand = self.demand()
+        entry = self.cached()
+        if entry is not None:
+            shopping_list = self.clone(demand, entry, session_id)
+            return shopping_list, demand, {'totals': entry['totals'], 'cached': True}
+        
+        candidates = self.candidates(demand)
+        solution = self.solve(demand, candidates)
+        shopping_list = self.persist(demand, candidates, solution, session_id)
+        if self.cache is not None:
+            self.cache.set(self, chosen_items(candidates, solution), solution)
+        return shopping_list, demand, solution
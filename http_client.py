@@ -0,0 +1,488 @@
+"""
+HTTP-klient för utgående anrop mot matspar.se
+Samlar det som hör till transporten: hastighetsbegränsning per värd, circuit breaker,
+adaptiva timeouts, en pool av sessioner per postnummer och inspelning/uppspelning av svar.
+
+HASTIGHETSBEGRÄNSNING:
+- En token bucket per värd (t.ex. www.matspar.se)
+- Begränsningen sitter i en transport-adapter på requests.Session och gäller därför
+  bara när ett anrop faktiskt skickas - cacheträffar och HTML-parsning kostar ingenting
+- Konfigureras med MATSPAR_REQUESTS_PER_SECOND (standard 2) och MATSPAR_REQUEST_BURST (standard 4)
+
+CIRCUIT BREAKER:
+- closed: alla anrop går till matspar.se
+- open: efter N misslyckanden i rad (fel, timeout eller tom parsning) går alla sökningar
+  direkt till den lokala databasen under en avkylningsperiod
+- half_open: efter avkylningen släpps EN provsökning igenom åt gången; lyckas den stängs
+  kretsen, misslyckas den öppnas den igen
+- Konfigureras med MATSPAR_BREAKER_FAILURES (standard 3) och MATSPAR_BREAKER_COOLDOWN (sekunder, standard 60)
+
+ADAPTIVA TIMEOUTS:
+- Separata connect- och read-timeouts
+- Read-timeouten följer observerad p95-latens (med marginal) inom fasta gränser
+
+SESSIONSPOOL:
+- En keep-alive requests.Session per postnummer, med zipcode-cookien satt när sessionen skapas
+- Postnumret är därmed en parameter per anrop i stället för delat, muterbart tillstånd, så
+  samtidiga sökningar från olika användare (gthread-workers) kan inte läcka postnummer till varandra
+- LRU-begränsad: den minst nyligen använda sessionen stängs när poolen är full
+- Konfigureras med MATSPAR_SESSION_POOL_SIZE (standard 32)
+
+INSPELNING/UPPSPELNING (MATSPAR_HTTP_MODE):
+- passthrough (standard): anropen går till matspar.se som vanligt
+- record: anropen går till matspar.se och svaren sparas på disk
+- replay: svaren läses från disk - inga anrop lämnar maskinen. Saknas ett svar
+  behandlas det som ett nätverksfel (sökningen faller tillbaka på lokal data)
+- Svaren nycklas på metod, URL och zipcode-cookie och sparas som JSON i
+  MATSPAR_FIXTURE_DIR (standard fixtures/matspar/http)
+- I replay-läge kan latens läggas på: MATSPAR_REPLAY_LATENCY_MS (+ slumpmässig
+  MATSPAR_REPLAY_JITTER_MS) för deterministiska benchmarks och lasttester
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_REQUESTS_PER_SECOND = float(os.environ.get('MATSPAR_REQUESTS_PER_SECOND', 2))
+DEFAULT_REQUEST_BURST = float(os.environ.get('MATSPAR_REQUEST_BURST', 4))
+DEFAULT_BREAKER_FAILURES = int(os.environ.get('MATSPAR_BREAKER_FAILURES', 3))
+DEFAULT_BREAKER_COOLDOWN = float(os.environ.get('MATSPAR_BREAKER_COOLDOWN', 60))
+DEFAULT_SESSION_POOL_SIZE = int(os.environ.get('MATSPAR_SESSION_POOL_SIZE', 32))
+DEFAULT_HTTP_MODE = os.environ.get('MATSPAR_HTTP_MODE', 'passthrough').lower()
+DEFAULT_FIXTURE_DIR = os.environ.get(
+    'MATSPAR_FIXTURE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'matspar', 'http')
+)
+DEFAULT_REPLAY_LATENCY = float(os.environ.get('MATSPAR_REPLAY_LATENCY_MS', 0)) / 1000
+DEFAULT_REPLAY_JITTER = float(os.environ.get('MATSPAR_REPLAY_JITTER_MS', 0)) / 1000
+
+HTTP_MODES = ('passthrough', 'record', 'replay')
+
+
+class TokenBucket:
+    """Trådsäker token bucket: `rate` tokens per sekund, högst `capacity` sparade"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reservera en token och returnera hur länge anroparen måste vänta (sekunder)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Vänta tills en token finns (väntan sker utanför låset)"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class HostRateLimiter:
+    """En token bucket per värd, med statistik över väntetider"""
+
+    def __init__(self, requests_per_second=None, burst=None):
+        self.requests_per_second = requests_per_second or DEFAULT_REQUESTS_PER_SECOND
+        self.burst = burst or DEFAULT_REQUEST_BURST
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._throttled = 0
+        self._wait_seconds = 0.0
+
+    def _bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+            return bucket
+
+    def acquire(self, url):
+        """Vänta på en token för värden i url"""
+        wait = self._bucket(urlparse(url).netloc).acquire()
+        with self._lock:
+            self._requests += 1
+            if wait > 0:
+                self._throttled += 1
+                self._wait_seconds += wait
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests_per_second': self.requests_per_second,
+                'burst': self.burst,
+                'requests': self._requests,
+                'throttled': self._throttled,
+                'wait_seconds': round(self._wait_seconds, 3)
+            }
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Transport-adapter som tar en token från värdens bucket innan varje anrop skickas
+
+    Svaret får server_elapsed: sekunder från att token är tagen tills svarshuvudena har
+    kommit. response.elapsed räknas av requests runt hela adapterns send och innehåller
+    därför även väntan på token.
+    """
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.limiter.acquire(request.url)
+        started = time.monotonic()
+        response = super().send(request, **kwargs)
+        response.server_elapsed = time.monotonic() - started
+        return response
+
+
+def server_elapsed(response):
+    """Serverns svarstid i sekunder (RateLimitedAdapter), annars response.elapsed"""
+    elapsed = getattr(response, 'server_elapsed', None)
+    if elapsed is None:
+        elapsed = response.elapsed.total_seconds()
+    return elapsed
+
+
+def mount_rate_limiter(session, limiter, mode=None, fixtures=None):
+    """
+    Montera hastighetsbegränsningen på en requests.Session (http och https)
+
+    Args:
+        mode: 'passthrough', 'record' eller 'replay' (standard MATSPAR_HTTP_MODE)
+        fixtures: FixtureStore för record/replay (standard en FixtureStore() med miljöns inställningar)
+    """
+    mode = mode or DEFAULT_HTTP_MODE
+    if mode == 'passthrough':
+        adapter = RateLimitedAdapter(limiter)
+    else:
+        adapter = FixtureAdapter(limiter, mode, fixtures or FixtureStore())
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter
+
+
+class FixtureStore:
+    """Sparade HTTP-svar på disk, ett JSON-dokument per (metod, URL, postnummer)"""
+
+    def __init__(self, directory=None, latency=None, jitter=None):
+        self.directory = directory or DEFAULT_FIXTURE_DIR
+        self.latency = DEFAULT_REPLAY_LATENCY if latency is None else latency
+        self.jitter = DEFAULT_REPLAY_JITTER if jitter is None else jitter
+        self._lock = threading.Lock()
+        self._counts = {'replayed': 0, 'recorded': 0, 'misses': 0, 'passthrough': 0}
+
+    @staticmethod
+    def key(method, url, zipcode=None):
+        raw = f"{method.upper()} {url} zipcode={zipcode or ''}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, method, url, zipcode=None):
+        """Det sparade svaret som dict, eller None"""
+        try:
+            with open(self._path(self.key(method, url, zipcode)), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, method, url, zipcode, status_code, body, content_type='text/html; charset=utf-8', reason='OK'):
+        """Spara ett svar (skrivs atomärt så att samtidiga läsare aldrig ser en halv fil)"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(self.key(method, url, zipcode))
+        record = {
+            'method': method.upper(),
+            'url': url,
+            'zipcode': zipcode,
+            'status_code': status_code,
+            'reason': reason,
+            'content_type': content_type,
+            'recorded_at': datetime.utcnow().isoformat(),
+            'body': body
+        }
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+        return path
+
+    def replay_delay(self):
+        """Latens att lägga på ett uppspelat svar (sekunder)"""
+        if self.jitter:
+            return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        return self.latency
+
+    def count(self, counter):
+        with self._lock:
+            self._counts[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'replay_latency_ms': round(self.latency * 1000, 1),
+                'replay_jitter_ms': round(self.jitter * 1000, 1),
+                **self._counts
+            }
+
+
+ZIPCODE_COOKIE_RE = re.compile(r'(?:^|;\s*)zipcode=([^;]*)')
+
+
+class FixtureAdapter(RateLimitedAdapter):
+    """Transport-adapter med lägena passthrough, record och replay (se modulens beskrivning)"""
+
+    def __init__(self, limiter, mode, fixtures, **kwargs):
+        if mode not in HTTP_MODES:
+            raise ValueError(f"Okänt HTTP-läge: {mode} (tillgängliga: {', '.join(HTTP_MODES)})")
+        self.mode = mode
+        self.fixtures = fixtures
+        super().__init__(limiter, **kwargs)
+
+    @staticmethod
+    def _zipcode(request):
+        match = ZIPCODE_COOKIE_RE.search(request.headers.get('Cookie', ''))
+        return match.group(1) if match else None
+
+    def send(self, request, **kwargs):
+        if self.mode == 'replay':
+            return self._replay(request)
+
+        # Riktiga anrop går genom hastighetsbegränsningen
+        response = super().send(request, **kwargs)
+        if self.mode == 'record':
+            self.fixtures.save(
+                request.method, request.url, self._zipcode(request), response.status_code,
+                self._body_text(response), response.headers.get('Content-Type', 'text/html'), response.reason or ''
+            )
+            self.fixtures.count('recorded')
+        else:
+            self.fixtures.count('passthrough')
+        return response
+
+    @staticmethod
+    def _body_text(response):
+        """Svarskroppen som text (requests gissar ISO-8859-1 när charset saknas, så gissa från innehållet)"""
+        if 'charset' in response.headers.get('Content-Type', '').lower():
+            return response.text
+        return response.content.decode(response.apparent_encoding or 'utf-8', errors='replace')
+
+    def _replay(self, request):
+        record = self.fixtures.load(request.method, request.url, self._zipcode(request))
+        if record is None:
+            self.fixtures.count('misses')
+            raise requests.ConnectionError(f"Inget sparat svar för {request.method} {request.url}", request=request)
+
+        delay = self.fixtures.replay_delay()
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = record['status_code']
+        response.reason = record.get('reason', '')
+        response.headers = CaseInsensitiveDict({'Content-Type': record.get('content_type', 'text/html')})
+        response._content = record['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=delay)
+        response.server_elapsed = delay
+        self.fixtures.count('replayed')
+        return response
+
+
+class CircuitBreaker:
+    """Circuit breaker (closed -> open -> half_open -> closed) med historik över övergångar"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=None, cooldown=None, name='matspar'):
+        self.name = name
+        self.failure_threshold = failure_threshold or DEFAULT_BREAKER_FAILURES
+        self.cooldown = cooldown or DEFAULT_BREAKER_COOLDOWN
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._counts = {'allowed': 0, 'short_circuited': 0, 'successes': 0, 'failures': 0, 'probes': 0}
+        self._transitions = deque(maxlen=20)
+
+    def _transition(self, new_state):
+        if new_state != self.state:
+            self._transitions.append({'at': time.time(), 'from': self.state, 'to': new_state})
+            self.state = new_state
+
+    def allow(self):
+        """Får ett anrop skickas nu? I half_open släpps bara en provsökning åt gången."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._transition(self.HALF_OPEN)
+
+            if self.state == self.CLOSED:
+                self._counts['allowed'] += 1
+                return True
+
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._counts['allowed'] += 1
+                self._counts['probes'] += 1
+                return True
+
+            self._counts['short_circuited'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._counts['successes'] += 1
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._counts['failures'] += 1
+            self._consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self._consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'cooldown_seconds': self.cooldown,
+                **self._counts,
+                'transitions': list(self._transitions)
+            }
+
+
+class AdaptiveTimeout:
+    """
+    Connect/read-timeouts som anpassas efter observerad latens
+
+    Read-timeouten sätts till p95 av de senaste svarstiderna gånger en marginal,
+    begränsad till [min_read, max_read]. Tills tillräckligt många mätningar finns används max_read.
+    Svarstiden är server_elapsed (utan väntan på en token i HostRateLimiter), och anrop som
+    gav timeout räknas som den read-timeout som användes. Andra anslutningsfel (nekad
+    anslutning, DNS, saknad fixtur) säger inget om läshastigheten och räknas inte.
+    """
+
+    def __init__(self, connect=3.05, min_read=2.0, max_read=10.0, margin=2.0, window=100, min_samples=10):
+        self.connect = connect
+        self.min_read = min_read
+        self.max_read = max_read
+        self.margin = margin
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def current(self):
+        """(connect, read) att skicka som timeout till requests"""
+        with self._lock:
+            enough = len(self._samples) >= self.min_samples
+        if not enough:
+            return (self.connect, self.max_read)
+        read = min(self.max_read, max(self.min_read, self.p95() * self.margin))
+        return (self.connect, read)
+
+    def stats(self):
+        p95 = self.p95()
+        connect, read = self.current()
+        with self._lock:
+            samples = len(self._samples)
+        return {
+            'connect_timeout': connect,
+            'read_timeout': round(read, 3),
+            'p95_latency': round(p95, 3) if p95 is not None else None,
+            'samples': samples
+        }
+
+
+class SessionPool:
+    """LRU-begränsad pool av keep-alive-sessioner, en per postnummer"""
+
+    def __init__(self, factory, max_sessions=None):
+        """
+        Args:
+            factory: Funktion postal_code -> requests.Session (postal_code kan vara None)
+            max_sessions: Max antal öppna sessioner
+        """
+        self._factory = factory
+        self.max_sessions = max_sessions or DEFAULT_SESSION_POOL_SIZE
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'created': 0, 'evicted': 0}
+
+    def get(self, postal_code=None):
+        """Sessionen för ett postnummer (skapas vid behov)"""
+        key = postal_code or ''
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                self._counts['hits'] += 1
+                return session
+
+            session = self._factory(postal_code)
+            self._sessions[key] = session
+            self._counts['created'] += 1
+            evicted = []
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+                self._counts['evicted'] += 1
+
+        # Stäng utanför låset; pågående anrop på en utträngd session får avsluta som vanligt
+        for old in evicted:
+            old.close()
+        return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._sessions), 'max_sessions': self.max_sessions, **self._counts}
@@ -0,0 +1,268 @@
+"""
+Jobbkö för list- och receptgenerering i Matplanerare
+Generering (och framför allt AI-recept, där Groq-anropet kan ta upp till två minuter) körs
+som jobb i stället för i requesten. POST svarar direkt med 202 och ett jobb-ID, ett begränsat
+antal arbetstrådar per process gör jobbet, och klienten pollar /api/jobs/<id> tills det är
+klart. Webbtrådarna i gunicorn blir då lediga för billiga requests.
+
+JOBBEN:
+- Sparas i tabellen generation_jobs (GenerationJob) så att alla gunicorn-workers kan svara
+  på pollningen, oavsett vilken worker som tog emot jobbet och kör det
+- Status: queued → running → done/failed/cancelled, och steget som körs just nu (stage)
+- Resultatet sparas som JSON med samma svar och HTTP-status som det synkrona anropet
+- Tid i kön, körtid och tid per steg (timings) sparas per jobb
+
+GRÄNSER:
+- MATSPAR_JOB_WORKERS arbetstrådar per process (standard 2)
+- MATSPAR_JOB_QUEUE_DEPTH: max antal köade jobb totalt (standard 20) - annars QueueFull (503)
+- MATSPAR_JOB_TIMEOUT: jobb som inte är klara efter så många sekunder (standard 300)
+  räknas som misslyckade, t.ex. om processen som körde dem har startats om
+- Avslutade jobb tas bort efter FINISHED_TTL
+
+AVBRYTA:
+- Köade jobb avbryts direkt
+- Pågående jobb avbryts vid nästa steg (progress-anropet kastar JobCancelled) och
+  allt jobbet hunnit skriva rullas tillbaka. Ett anrop som redan pågår (t.ex. mot Groq)
+  avbryts inte mitt i
+
+MATSPAR_GENERATION_JOBS=thread|off (standard thread). Med off körs jobben direkt i
+requesten (run_inline), som innan kön fanns.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from database import db, GenerationJob
+
+DEFAULT_MODE = os.environ.get('MATSPAR_GENERATION_JOBS', 'thread').lower()
+DEFAULT_WORKERS = int(os.environ.get('MATSPAR_JOB_WORKERS', 2))
+DEFAULT_MAX_QUEUED = int(os.environ.get('MATSPAR_JOB_QUEUE_DEPTH', 20))
+DEFAULT_TIMEOUT = int(os.environ.get('MATSPAR_JOB_TIMEOUT', 300))
+FINISHED_TTL = 24 * 3600
+
+
+class QueueFull(Exception):
+    """För många köade jobb - försök igen senare"""
+
+
+class JobCancelled(Exception):
+    """Jobbet avbröts av användaren (kastas från progress)"""
+
+
+class JobQueue:
+    """Begränsad pool av arbetstrådar för genereringsjobb, med status i databasen"""
+
+    def __init__(self, app, handlers, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED,
+                 timeout=DEFAULT_TIMEOUT, mode=DEFAULT_MODE):
+        """
+        Args:
+            app: Flask-appen (jobben körs i en app-kontext i arbetstråden)
+            handlers: {jobbtyp: funktion(params, progress) -> (svar-dict, HTTP-status)}.
+                      progress(steg) anropas före varje steg och kastar JobCancelled om
+                      jobbet har avbrutits. Funktionen committar själv
+            workers: Antal arbetstrådar i den här processen
+            max_queued: Max antal köade (ej startade) jobb totalt
+            timeout: Sekunder innan ett jobb som inte är klart räknas som misslyckat
+            mode: 'thread' (arbetstrådar) eller 'off' (anroparen kör run_inline)
+        """
+        self.app = app
+        self.handlers = handlers
+        self.workers = workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.mode = mode
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'cancelled': 0, 'running': 0}
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    # ============== KÖ ==============
+
+    def submit(self, kind, session_id, params):
+        """
+        Lägg ett jobb i kön
+
+        Returns:
+            GenerationJob (committad)
+
+        Raises:
+            QueueFull: om kön redan har max_queued jobb
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Okänd jobbtyp: {kind}")
+        self._expire()
+        queued = GenerationJob.query.filter_by(status='queued').count()
+        if queued >= self.max_queued:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise QueueFull(f"{queued} jobb i kön")
+
+        job = GenerationJob(
+            id=str(uuid.uuid4()),
+            session_id=session_id,
+            kind=kind,
+            status='queued',
+            params_json=json.dumps(params, ensure_ascii=False)
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._start_workers()
+        self._queue.put(job.id)
+        return job
+
+    def _start_workers(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f'generation-job-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def get(self, job_id, session_id):
+        """Jobbet om det tillhör sessionen, annars None"""
+        job = db.session.get(GenerationJob, job_id)
+        if job is None or job.session_id != session_id:
+            return None
+        if job.status not in GenerationJob.FINISHED and job.created_at < datetime.utcnow() - timedelta(seconds=self.timeout):
+            self._expire()
+            db.session.refresh(job)
+        return job
+
+    def cancel(self, job_id, session_id):
+        """
+        Avbryt ett jobb: köade jobb direkt, pågående vid nästa steg
+
+        Returns:
+            GenerationJob eller None om det inte finns
+        """
+        job = self.get(job_id, session_id)
+        if job is None or job.status in GenerationJob.FINISHED:
+            return job
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = datetime.utcnow()
+            with self._lock:
+                self._stats['cancelled'] += 1
+        job.cancel_requested = True
+        db.session.commit()
+        return job
+
+    def _expire(self):
+        """Markera jobb som aldrig blev klara som misslyckade och ta bort gamla avslutade jobb"""
+        now = datetime.utcnow()
+        table = GenerationJob.__table__
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(table)
+                .where(table.c.status.in_(('queued', 'running')))
+                .where(table.c.created_at < now - timedelta(seconds=self.timeout))
+                .values(status='failed', error='Tidsgränsen för jobbet överskreds', finished_at=now)
+            )
+            conn.execute(
+                table.delete()
+                .where(table.c.status.in_(GenerationJob.FINISHED))
+                .where(table.c.finished_at < now - timedelta(seconds=FINISHED_TTL))
+            )
+
+    # ============== KÖRNING ==============
+
+    def run_inline(self, kind, params):
+        """Kör ett jobb direkt i anroparens request (mode off). Returns: (svar-dict, HTTP-status)"""
+        return self.handlers[kind](params, lambda stage: None)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self.execute(job_id)
+            except Exception as e:
+                print(f"Genereringsjobb {job_id} kunde inte köras: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _update(self, job_id, **values):
+        """Skriv jobbets status på en egen anslutning - jobbets session kan ha en öppen transaktion"""
+        table = GenerationJob.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.id == job_id).values(**values))
+
+    def _cancel_requested(self, job_id):
+        table = GenerationJob.__table__
+        with db.engine.connect() as conn:
+            return bool(conn.execute(table.select().with_only_columns(table.c.cancel_requested)
+                                     .where(table.c.id == job_id)).scalar())
+
+    def execute(self, job_id):
+        """Kör ett köat jobb (i arbetstråden, inom en app-kontext)"""
+        job = db.session.get(GenerationJob, job_id)
+        if job is None or job.status != 'queued':
+            return
+        kind, params = job.kind, job.get_params()
+        db.session.remove()
+
+        started = time.monotonic()
+        timings = {}
+        current = {'stage': None, 'started': started}
+
+        def finish_stage():
+            if current['stage'] is not None:
+                timings[current['stage']] = round(time.monotonic() - current['started'], 4)
+
+        def progress(stage):
+            finish_stage()
+            if self._cancel_requested(job_id):
+                raise JobCancelled()
+            current['stage'], current['started'] = stage, time.monotonic()
+            self._update(job_id, stage=stage, timings_json=json.dumps(timings))
+
+        self._update(job_id, status='running', started_at=datetime.utcnow())
+        with self._lock:
+            self._stats['running'] += 1
+        status, values = 'failed', {}
+        try:
+            result, http_status = self.handlers[kind](params, progress)
+            finish_stage()
+            status = 'done'
+            values = {'result_json': json.dumps(result, ensure_ascii=False), 'http_status': http_status}
+        except JobCancelled:
+            db.session.rollback()
+            status = 'cancelled'
+        except Exception as e:
+            db.session.rollback()
+            values = {'error': str(e)[:500]}
+            print(f"Genereringsjobb {job_id} misslyckades: {e}")
+        finally:
+            db.session.remove()
+            with self._lock:
+                self._stats['running'] -= 1
+                self._stats[status] += 1
+            self._update(job_id, status=status, stage=None, finished_at=datetime.utcnow(),
+                         timings_json=json.dumps(timings), **values)
+        return status
+
+    def wait(self):
+        """Vänta tills kön är tom (för mätningar och skript)"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mode'] = self.mode
+        stats['workers'] = self.workers
+        stats['max_queued'] = self.max_queued
+        stats['queued_local'] = self._queue.qsize()
+        return stats
@@ -0,0 +1,540 @@
+"""
+Listlösare för Matplanerare
+Väljer antal förpackningar av varje kandidatprodukt så att inköpslistan når planens
+näringsmål till lägsta pris, inom budget. Ersätter den giriga loopen i api_generate_list
+(en produkt i taget i prioritetsordning, uppåtavrundade antal och en fyllnadsloop för kalorier).
+
+PROBLEMET (heltalsprogram):
+- Variabler: antal förpackningar x_j >= 0 (heltal) per kandidat
+- Näringsmål från planens *_target/*_mode, skalade med dagar x personer:
+    target: inom ±TARGET_TOLERANCE (20 %) av målet, och så nära målet som det är billigt
+    min:    minst målet
+    max:    högst målet
+    ignore: inget villkor
+- Målen är mjuka: varje procent utanför kostar PENALTY_PER_PERCENT kr per persondag
+  (mikronäringsämnen MICRO_WEIGHT av det), så att problemet alltid går att lösa även när
+  budgeten eller sortimentet inte räcker - då fördelas bristen där den kostar minst
+- Hårda villkor: totalpris <= budget, och gram per produktgrupp (en sökning i
+  product_categories) <= gruppens tak, så att listan inte blir 30 paket pasta
+- Kostnad att minimera: pris + straff för avvikelser från målen
+
+LÖSNING:
+- LP-relaxationen löses med en tvåfas-simplex på en tät NumPy-tablå. Raderna är få
+  (näringsvillkor + budget + grupper), så även 1 000 kandidater ger en liten tablå
+- Startlösning: LP-lösningen avrundad nedåt, sedan en förpackning i taget där
+  kostnaden minskar mest (vektoriserat över alla kandidater)
+- Branch and bound på den mest fraktionella variabeln (uppåt först), med LP-värdet som
+  undre gräns. Barnnoderna varmstartas: villkoret läggs till i förälderns optimala tablå
+  och dual simplex återställer optimum på några pivoteringar. Kandidater vars reducerade kostnad i LP-optimum inte kan slå den bästa
+  lösningen lämnas utanför, och är de ändå fler än MAX_BRANCH_COLUMNS söks bara de
+  med lägst reducerad kostnad. Tidsbudget (MATSPAR_LIST_SOLVER_TIME_BUDGET_MS, standard 300 ms): när den
+  tar slut returneras den bästa heltalslösningen hittills
+"""
+
+import math
+import os
+import time
+
+import numpy as np
+
+from nutrients import CALORIES, NUTRIENT_FIELDS, columns, nutrient_vector
+
+DEFAULT_TIME_BUDGET = float(os.environ.get('MATSPAR_LIST_SOLVER_TIME_BUDGET_MS', 300)) / 1000
+
+# Näringsvärden som planen har mål och lägen för (samma namn som i Nutrition/katalogen)
+NUTRIENT_KEYS = (
+    'calories', 'protein', 'carbs', 'fat', 'fiber', 'sugar', 'salt',
+    'vitamin_c', 'vitamin_d', 'vitamin_a', 'calcium', 'iron', 'potassium'
+)
+MACRO_KEYS = ('calories', 'protein', 'carbs', 'fat')
+# NUTRIENT_KEYS som kolumner i nutrients.NUTRIENT_FIELDS
+SOLVER_COLUMNS = columns(NUTRIENT_KEYS)
+
+TARGET_TOLERANCE = 0.2
+# Straff per procent avvikelse och persondag (kr) - högt nog att mål som går att nå nås
+PENALTY_PER_PERCENT = 7.0
+MICRO_WEIGHT = 0.3
+# Inom toleransen för 'target' kostar avvikelsen från målet TARGET_WEIGHT av straffet
+TARGET_WEIGHT = 0.1
+# Gruppens tak: så här många gånger gruppens beräknade behov i gram
+GROUP_SLACK = 2.0
+
+EPS = 1e-9
+INTEGER_TOLERANCE = 1e-6
+DEGENERATE_LIMIT = 50
+DUAL_ITERATIONS = 500
+# Max antal kandidater i branch and bound (efter urvalet på reducerad kostnad)
+MAX_BRANCH_COLUMNS = 60
+
+
+def plan_goals(plan, days, household_size):
+    """
+    Planens näringsmål för hela listan
+
+    Returns:
+        Dict {näringsvärde: (läge, totalt mål)} - 'ignore' och saknade mål tas inte med
+    """
+    goals = {}
+    for key in NUTRIENT_KEYS:
+        target = getattr(plan, f'{key}_target', None)
+        mode = (getattr(plan, f'{key}_mode', None) or 'target').lower()
+        if not target or mode not in ('target', 'min', 'max'):
+            continue
+        goals[key] = (mode, target * days * household_size)
+    return goals
+
+
+def pack_nutrients(nutrition, pack_grams, fallback_kcal=None):
+    """
+    Näringsvärden för en förpackning som vektor i NUTRIENT_KEYS-ordning
+
+    Saknas kalorier uppskattas de från fallback_kcal (kcal/100g) och övriga värden
+    räknas som 0 - som den tidigare loopen gjorde. Se pack_matrix för många produkter.
+    """
+    vectors = with_fallback_kcal(nutrient_vector(nutrition)[np.newaxis], [fallback_kcal])
+    return pack_matrix(vectors, [pack_grams])[0]
+
+
+def with_fallback_kcal(vectors, fallback_kcal):
+    """
+    Kopia av näringsvektorerna (per 100 g) där rader utan kalorier nollställs och får
+    kalorierna fallback_kcal (kcal/100g per rad, None = 0)
+    """
+    vectors = np.array(vectors, dtype=np.float64).reshape(-1, len(NUTRIENT_FIELDS))
+    missing = np.flatnonzero(vectors[:, CALORIES] == 0)
+    vectors[missing] = 0
+    vectors[missing, CALORIES] = [fallback_kcal[row] or 0 for row in missing.tolist()]
+    return vectors
+
+
+def pack_matrix(vectors, pack_grams):
+    """Näringsvärden per förpackning (n × len(NUTRIENT_KEYS)) från vektorer per 100 g"""
+    grams = np.asarray(pack_grams, dtype=np.float64)
+    return np.asarray(vectors, dtype=np.float64)[:, SOLVER_COLUMNS] * (grams / 100)[:, np.newaxis]
+
+
+# ============== SIMPLEX ==============
+
+def _pivot(tableau, basis, row, col):
+    tableau[row] /= tableau[row, col]
+    column = tableau[:, col].copy()
+    column[row] = 0
+    tableau -= np.outer(column, tableau[row])
+    basis[row] = col
+
+
+def _iterate(tableau, basis, columns, deadline):
+    """
+    Pivotera tills den reducerade kostnaden (sista raden) inte har några negativa värden
+
+    Returns:
+        True vid optimum, False om problemet är obegränsat eller tiden tog slut
+    """
+    degenerate = 0
+    while True:
+        costs = tableau[-1, :columns]
+        if degenerate > DEGENERATE_LIMIT:
+            # Blands regel mot cykling när många pivoteringar i rad inte förbättrar
+            negative = np.flatnonzero(costs < -EPS)
+            if not len(negative):
+                return True
+            col = negative[0]
+        else:
+            col = int(np.argmin(costs))
+            if costs[col] >= -EPS:
+                return True
+
+        column = tableau[:-1, col]
+        positive = column > EPS
+        if not positive.any():
+            return False
+        ratios = np.full(len(column), np.inf)
+        ratios[positive] = tableau[:-1, -1][positive] / column[positive]
+        best = ratios.min()
+        rows = np.flatnonzero(ratios <= best + EPS)
+        row = min(rows, key=lambda r: basis[r]) if len(rows) > 1 else rows[0]
+
+        degenerate = degenerate + 1 if best <= EPS else 0
+        _pivot(tableau, basis, row, col)
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+
+
+def simplex(c, A, b, senses, deadline=None):
+    """
+    min c·x  då  A x (<=, >=, =) b  och  x >= 0  (tvåfas-simplex på en tät tablå)
+
+    Args:
+        c: Kostnad per variabel (n)
+        A: Villkorsmatris (m x n)
+        b: Högerled (m)
+        senses: '<=', '>=' eller '=' per rad
+        deadline: time.monotonic()-tid då lösningen avbryts (None = ingen gräns)
+
+    Returns:
+        Optimal tablå (tableau, basis) - se solution och add_bound - eller None om
+        problemet saknar lösning, är obegränsat eller tiden tog slut
+    """
+    A = np.array(A, dtype=np.float64)
+    b = np.array(b, dtype=np.float64)
+    senses = list(senses)
+    m, n = A.shape
+
+    # Negativa högerled: vänd raden
+    for i in np.flatnonzero(b < 0):
+        A[i] = -A[i]
+        b[i] = -b[i]
+        senses[i] = {'<=': '>=', '>=': '<=', '=': '='}[senses[i]]
+
+    slack_rows = [i for i, sense in enumerate(senses) if sense != '=']
+    artificial_rows = [i for i, sense in enumerate(senses) if sense != '<=']
+    slack_start = n
+    artificial_start = n + len(slack_rows)
+    columns = artificial_start + len(artificial_rows)
+
+    tableau = np.zeros((m + 1, columns + 1))
+    tableau[:m, :n] = A
+    tableau[:m, -1] = b
+    basis = np.zeros(m, dtype=np.int64)
+    for k, i in enumerate(slack_rows):
+        tableau[i, slack_start + k] = 1.0 if senses[i] == '<=' else -1.0
+        if senses[i] == '<=':
+            basis[i] = slack_start + k
+    for k, i in enumerate(artificial_rows):
+        tableau[i, artificial_start + k] = 1.0
+        basis[i] = artificial_start + k
+
+    # Fas 1: minimera summan av de artificiella variablerna
+    if artificial_rows:
+        tableau[-1, artificial_start:columns] = 1.0
+        for i in artificial_rows:
+            tableau[-1] -= tableau[i]
+        if not _iterate(tableau, basis, columns, deadline):
+            return None
+        if -tableau[-1, -1] > 1e-7:
+            return None
+        # Artificiella variabler kvar i basen (på nivå 0): pivotera ut eller stryk raden
+        keep = np.ones(m + 1, dtype=bool)
+        for i in range(m):
+            if basis[i] < artificial_start:
+                continue
+            candidates = np.flatnonzero(np.abs(tableau[i, :artificial_start]) > 1e-7)
+            if len(candidates):
+                _pivot(tableau, basis, i, candidates[0])
+            else:
+                keep[i] = False
+        basis = basis[keep[:m]]
+        tableau = tableau[keep]
+        tableau = np.delete(tableau, np.s_[artificial_start:columns], axis=1)
+        columns = artificial_start
+
+    # Fas 2: den riktiga kostnaden
+    costs = np.zeros(columns)
+    costs[:n] = c
+    tableau[-1] = 0.0
+    tableau[-1, :columns] = costs
+    for i, var in enumerate(basis):
+        if costs[var]:
+            tableau[-1] -= costs[var] * tableau[i]
+    if not _iterate(tableau, basis, columns, deadline):
+        return None
+    return tableau, basis
+
+
+def solution(tableau, basis, n):
+    """(x för de n första variablerna, värde, reducerade kostnader) ur en optimal tablå"""
+    x = np.zeros(tableau.shape[1] - 1)
+    x[basis] = tableau[:-1, -1]
+    return np.maximum(x[:n], 0.0), -tableau[-1, -1], tableau[-1, :n].copy()
+
+
+def add_bound(tableau, basis, j, sense, value, deadline=None):
+    """
+    Lägg till villkoret x_j <= value eller x_j >= value i en optimal tablå och
+    återställ optimum med dual simplex (varmstart: oftast bara några pivoteringar)
+
+    Returns:
+        Ny optimal tablå (tableau, basis), eller None om villkoret gör problemet olösligt
+    """
+    sign = 1.0 if sense == '<=' else -1.0
+    # Ny kolumn för villkorets slackvariabel (före högerledet) och en ny rad i basen
+    tableau = np.insert(tableau, tableau.shape[1] - 1, 0.0, axis=1)
+    row = np.zeros(tableau.shape[1])
+    row[j] = sign
+    row[-2] = 1.0
+    row[-1] = sign * value
+    basic = np.flatnonzero(basis == j)
+    if len(basic):
+        row -= sign * tableau[basic[0]]
+    tableau = np.vstack([tableau[:-1], row, tableau[-1]])
+    basis = np.append(basis, tableau.shape[1] - 2)
+
+    for _ in range(DUAL_ITERATIONS):
+        rhs = tableau[:-1, -1]
+        r = int(np.argmin(rhs))
+        if rhs[r] >= -1e-9:
+            return tableau, basis
+        entries = tableau[r, :-1]
+        negative = np.flatnonzero(entries < -EPS)
+        if not len(negative):
+            return None
+        ratios = tableau[-1, negative] / -entries[negative]
+        _pivot(tableau, basis, r, negative[int(np.argmin(ratios))])
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+    return None
+
+
+# ============== LISTLÖSARE ==============
+
+class ListSolver:
+    """Heltal förpackningar per kandidat som når näringsmålen till lägsta pris"""
+
+    def __init__(self, goals, budget=None, penalty=None, time_budget=DEFAULT_TIME_BUDGET):
+        """
+        Args:
+            goals: Dict {näringsvärde: (läge, totalt mål)}, se plan_goals
+            budget: Max totalpris (None = ingen gräns)
+            penalty: Straff (kr) för 100 % avvikelse från ett makromål
+                     (standard: PENALTY_PER_PERCENT för en persondag)
+            time_budget: Sekunder innan branch and bound avbryts
+        """
+        self.goals = goals
+        self.budget = budget
+        self.penalty = penalty if penalty is not None else PENALTY_PER_PERCENT * 100
+        self.time_budget = time_budget
+        self.stats = {'candidates': 0, 'columns': 0, 'nodes': 0, 'lp_solves': 0, 'timed_out': False,
+                      'lp_bound': None, 'cost': None, 'seconds': 0.0}
+
+    @classmethod
+    def for_plan(cls, plan, days, household_size, budget=None, time_budget=DEFAULT_TIME_BUDGET):
+        """Lösare för en NutritionPlan: mål och straff skalade med dagar x personer"""
+        return cls(
+            plan_goals(plan, days, household_size),
+            budget=budget,
+            penalty=PENALTY_PER_PERCENT * 100 * days * household_size,
+            time_budget=time_budget
+        )
+
+    def _goal_rows(self):
+        """Näringsvillkoren som (kolumn, riktning, nivå, normering, straff)"""
+        rows = []
+        for key, (mode, total) in self.goals.items():
+            col = NUTRIENT_KEYS.index(key)
+            penalty = self.penalty * (1.0 if key in MACRO_KEYS else MICRO_WEIGHT)
+            if mode == 'target':
+                rows.append((col, '>=', total * (1 - TARGET_TOLERANCE), total, penalty))
+                rows.append((col, '<=', total * (1 + TARGET_TOLERANCE), total, penalty))
+                rows.append((col, '>=', total, total, penalty * TARGET_WEIGHT))
+                rows.append((col, '<=', total, total, penalty * TARGET_WEIGHT))
+            else:
+                rows.append((col, '>=' if mode == 'min' else '<=', total, total, penalty))
+        return rows
+
+    def solve(self, nutrients, prices, grams, groups, group_caps):
+        """
+        Args:
+            nutrients: Näringsvärden per förpackning (n x len(NUTRIENT_KEYS)), se pack_nutrients
+            prices: Pris per förpackning (n)
+            grams: Gram per förpackning (n)
+            groups: Gruppindex per kandidat (n)
+            group_caps: Max gram per grupp
+
+        Returns:
+            Antal förpackningar per kandidat (int-array, n)
+        """
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        self._nutrients = np.asarray(nutrients, dtype=np.float64).reshape(-1, len(NUTRIENT_KEYS))
+        self._prices = np.asarray(prices, dtype=np.float64)
+        self._grams = np.asarray(grams, dtype=np.float64)
+        self._groups = np.asarray(groups, dtype=np.int64)
+        self._group_caps = np.asarray(group_caps, dtype=np.float64)
+        self._rows = self._goal_rows()
+        n = len(self._prices)
+        self.stats['candidates'] = n
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        root = self._relaxation(np.arange(n), None)
+        if root is None:
+            self.stats['seconds'] = round(time.monotonic() - started, 4)
+            return np.zeros(n, dtype=np.int64)
+        x, value, reduced = self._values(root, n)
+        self.stats['lp_bound'] = round(value, 2)
+
+        best = self._improve(np.floor(x + INTEGER_TOLERANCE).astype(np.int64))
+        best_cost = self.cost(best)
+
+        # Reducerade kostnader: en förpackning av kolumn j gör LP-värdet minst value + reduced[j]
+        # högre, så kolumner som då inte kan slå den bästa lösningen lämnas utanför sökningen
+        columns = np.flatnonzero((x > 0) | (value + reduced < best_cost - 1e-6) | (best > 0))
+        if len(columns) > MAX_BRANCH_COLUMNS:
+            # För många för att hinna söka igenom - behåll de med lägst reducerad kostnad
+            # (LP-lösningen och startlösningen är alltid med, de har reducerad kostnad 0)
+            order = np.lexsort((reduced[columns], ~((x[columns] > 0) | (best[columns] > 0))))
+            columns = np.sort(columns[order[:MAX_BRANCH_COLUMNS]])
+        self.stats['columns'] = len(columns)
+        if len(columns) < n:
+            root = self._relaxation(columns, deadline)
+        stack = [root] if root is not None else []
+
+        # Djupet först. Barnen varmstartas från förälderns tablå (add_bound)
+        while stack:
+            if time.monotonic() > deadline:
+                self.stats['timed_out'] = True
+                break
+            tableau, basis = stack.pop()
+            x, value, _ = self._values((tableau, basis), len(columns))
+            self.stats['nodes'] += 1
+            if value >= best_cost - 1e-6:
+                continue
+
+            fraction = x - np.floor(x)
+            fractional = np.flatnonzero((fraction > INTEGER_TOLERANCE) & (fraction < 1 - INTEGER_TOLERANCE))
+            if not len(fractional):
+                candidate = np.zeros(n, dtype=np.int64)
+                candidate[columns] = np.round(x).astype(np.int64)
+                candidate = self._improve(candidate)
+                candidate_cost = self.cost(candidate)
+                if candidate_cost < best_cost:
+                    best, best_cost = candidate, candidate_cost
+                continue
+
+            # Mest fraktionella variabeln - nedåt läggs först på stacken, så uppåt prövas först
+            j = fractional[np.argmin(np.abs(fraction[fractional] - 0.5))]
+            for sense, bound in (('<=', math.floor(x[j])), ('>=', math.ceil(x[j]))):
+                self.stats['lp_solves'] += 1
+                child = add_bound(tableau, basis, j, sense, bound, deadline)
+                if child is not None and -child[0][-1, -1] < best_cost - 1e-6:
+                    stack.append(child)
+
+        self.stats['cost'] = round(best_cost, 2)
+        self.stats['seconds'] = round(time.monotonic() - started, 4)
+        return best
+
+    # ============== LP-RELAXATION ==============
+
+    def _relaxation(self, columns, deadline):
+        """
+        LP-relaxationen för kandidaterna columns
+
+        Kolumner = kandidater + en avvikelsevariabel per näringsvillkor. Raderna är normerade:
+        näring mot målet, budget och grupper mot taket.
+
+        Returns:
+            Optimal tablå (tableau, basis) eller None
+        """
+        nutrients = self._nutrients[columns]
+        prices = self._prices[columns]
+        n = len(columns)
+        rows = self._rows
+
+        A = np.zeros((len(rows), n + len(rows)))
+        b = []
+        senses = []
+        for i, (col, sense, level, scale, _) in enumerate(rows):
+            A[i, :n] = nutrients[:, col] / scale
+            # Brist (>=) fylls med +s, överskott (<=) dras av med -s
+            A[i, n + i] = 1.0 if sense == '>=' else -1.0
+            b.append(level / scale)
+            senses.append(sense)
+
+        # Hårda villkor: grupptak (grupper utan tak får inte köpas alls) och budget
+        hard = []
+        group_rows = np.zeros((len(self._group_caps), n))
+        group_rows[self._groups[columns], np.arange(n)] = self._grams[columns]
+        for row, cap in zip(group_rows, self._group_caps):
+            if row.any():
+                hard.append(row / cap if cap > 0 else row)
+                b.append(1.0 if cap > 0 else 0.0)
+        if self.budget is not None:
+            hard.append(prices / self.budget if self.budget > 0 else prices)
+            b.append(1.0 if self.budget > 0 else 0.0)
+        if hard:
+            hard_A = np.zeros((len(hard), n + len(rows)))
+            hard_A[:, :n] = hard
+            A = np.vstack([A, hard_A])
+            senses += ['<='] * len(hard)
+
+        c = np.concatenate([prices, [penalty for *_, penalty in rows]])
+        self.stats['lp_solves'] += 1
+        return simplex(c, A, b, senses, deadline)
+
+    @staticmethod
+    def _values(state, n):
+        """(x, LP-värde, reducerade kostnader) för de n kandidaterna, utan avrundningsbrus runt heltal"""
+        x, value, reduced = solution(state[0], state[1], n)
+        nearest = np.round(x)
+        x = np.where(np.abs(x - nearest) < INTEGER_TOLERANCE, nearest, x)
+        return x, value, reduced
+
+    # ============== HELTALSLÖSNINGAR ==============
+
+    def cost(self, quantities):
+        """Pris + straff för en lösning, eller inf om den bryter mot budget eller grupptak"""
+        quantities = np.asarray(quantities, dtype=np.float64)
+        used = np.bincount(self._groups, weights=self._grams * quantities, minlength=len(self._group_caps))
+        if (used > self._group_caps + 1e-7).any():
+            return math.inf
+        return float(self._costs((quantities @ self._nutrients)[None, :], np.array([quantities @ self._prices]))[0])
+
+    def _costs(self, totals, spent):
+        """Kostnaden för lösningar med näringssummorna totals (en rad per lösning) och priset spent"""
+        costs = spent.copy()
+        for col, sense, level, scale, penalty in self._rows:
+            if sense == '>=':
+                costs += penalty * np.maximum(0, level - totals[:, col]) / scale
+            else:
+                costs += penalty * np.maximum(0, totals[:, col] - level) / scale
+        if self.budget is not None:
+            costs[spent > self.budget + 1e-7] = np.inf
+        return costs
+
+    def _improve(self, solution):
+        """
+        Lokal sökning från en heltalslösning: lägg till, ta bort eller byt en förpackning
+        så länge kostnaden sjunker (alla kandidater prövas på en gång med NumPy)
+        """
+        solution = np.array(solution, dtype=np.int64)
+        if self.cost(solution) == math.inf:
+            solution[:] = 0
+        totals = solution @ self._nutrients
+        spent = float(solution @ self._prices)
+        used = np.bincount(self._groups, weights=self._grams * solution, minlength=len(self._group_caps))
+        current = self._costs(totals[None, :], np.array([spent]))[0]
+
+        while True:
+            # En förpackning mer av varje kandidat
+            best_cost = current
+            move = None
+            costs = self._costs(totals + self._nutrients, spent + self._prices)
+            costs[used[self._groups] + self._grams > self._group_caps[self._groups] + 1e-7] = np.inf
+            j = int(np.argmin(costs))
+            if costs[j] < best_cost - 1e-9:
+                best_cost, move = costs[j], (None, j)
+
+            # En förpackning mindre, eventuellt mot en förpackning av en annan kandidat
+            for i in np.flatnonzero(solution > 0):
+                less_totals = totals - self._nutrients[i]
+                less_spent = spent - self._prices[i]
+                less_cost = self._costs(less_totals[None, :], np.array([less_spent]))[0]
+                if less_cost < best_cost - 1e-9:
+                    best_cost, move = less_cost, (i, None)
+                less_used = used.copy()
+                less_used[self._groups[i]] -= self._grams[i]
+                costs = self._costs(less_totals + self._nutrients, less_spent + self._prices)
+                costs[less_used[self._groups] + self._grams > self._group_caps[self._groups] + 1e-7] = np.inf
+                j = int(np.argmin(costs))
+                if costs[j] < best_cost - 1e-9:
+                    best_cost, move = costs[j], (i, j)
+
+            if move is None:
+                return solution
+            for index, sign in zip(move, (-1, 1)):
+                if index is not None:
+                    solution[index] += sign
+                    totals = totals + sign * self._nutrients[index]
+                    spent += sign * self._prices[index]
+                    used[self._groups[index]] += sign * self._grams[index]
+            current = best_cost
@@ -0,0 +1,165 @@
+"""
+Parsning av sökresultatsidor från matspar.se
+
+SNABBARE PARSNING:
+- lxml (om installerat, upptäcks vid import): hela sidan parsas i C och produktlänkarna
+  plockas ut med XPath - inga Python-anrop per tagg
+- html.parser (reserv): bara produktlänkarna (<a href=".../produkt/...">) och deras innehåll
+  byggs som BeautifulSoup-träd (SoupStrainer) - resten av sidan hoppas över
+- Kan styras med MATSPAR_HTML_PARSER=lxml|html.parser
+- Sidor utan en enda produktlänk returneras direkt utan parsning
+- Reguljära uttryck kompileras en gång när modulen laddas
+
+Resultatet är detsamma som den tidigare parsningen av hela dokumentet
+(se `python benchmark.py parser`, som jämför båda mot HTML-fixturer).
+"""
+
+import os
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from catalog import stable_id
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+
+def _detect_backend():
+    requested = os.environ.get('MATSPAR_HTML_PARSER')
+    if requested:
+        return requested
+    return 'lxml' if lxml is not None else 'html.parser'
+
+
+PARSER_BACKEND = _detect_backend()
+
+# Bara produktlänkar (samma urval som soup.select('a[href*="/produkt/"]'))
+PRODUCT_HREF = re.compile('/produkt/')
+PRODUCT_ANCHORS = SoupStrainer('a', href=PRODUCT_HREF)
+
+# Pris: siffror följt av kr ("24,90 kr")
+PRICE_RE = re.compile(r'(\d+[,.]?\d*)\s*kr')
+
+# Vikt: siffror följt av g, kg, ml, l, cl eller dl
+WEIGHT_RE = re.compile(r'(\d+(?:[,.]?\d+)?)\s*(g|kg|ml|l|cl|dl)', re.IGNORECASE)
+
+# Text i de här taggarna räknas inte som synlig text (samma som BeautifulSoups get_text)
+HIDDEN_TEXT_TAGS = {'script', 'style', 'template'}
+
+
+def parse_results_page(html, limit=20, base_url='', backend=None):
+    """
+    Parsa produktkorten på en sökresultatsida
+
+    Args:
+        html: Sidans HTML
+        limit: Max antal produkter
+        base_url: Läggs framför relativa produktlänkar
+        backend: Parser att använda (standard PARSER_BACKEND)
+
+    Returns:
+        Lista med produkter (tom om sidan saknar produktkort)
+    """
+    # Sidor helt utan produktlänkar (t.ex. när produkterna bara renderas med JavaScript)
+    # behöver inte parsas alls
+    if '/produkt/' not in html:
+        return []
+
+    backend = backend or PARSER_BACKEND
+    if backend == 'lxml' and lxml is not None:
+        root = lxml.html.document_fromstring(html)
+        product_cards = root.xpath('//a[contains(@href, "/produkt/")]')
+        parse_card = _parse_lxml_card
+    else:
+        soup = BeautifulSoup(html, backend, parse_only=PRODUCT_ANCHORS)
+        product_cards = soup.find_all('a', href=PRODUCT_HREF)
+        parse_card = parse_product_card
+
+    # Matspar.se renderar produkter via JavaScript så detta kan vara begränsat
+    products = []
+    seen_urls = set()
+    for card in product_cards[:limit * 2]:  # Hämta extra för att filtrera dubletter
+        href = card.get('href', '')
+        if not href or href in seen_urls or '/produkt/' not in href:
+            continue
+
+        seen_urls.add(href)
+
+        product_data = parse_card(card, href, base_url)
+        if product_data:
+            products.append(product_data)
+            if len(products) >= limit:
+                break
+
+    return products
+
+
+def parse_product_card(card, url, base_url=''):
+    """Försök parsa produktinfo från ett produktkort (BeautifulSoup-tagg, None om det inte går)"""
+    try:
+        # Format är ofta: "Produktnamn Produktnamn Varumärke Vikt pris"
+        text = card.get_text(separator=' ', strip=True)
+        img = card.find('img')
+        src = img.get('src', '') if img else ''
+        return _build_product(text, src, url, base_url)
+    except Exception:
+        return None
+
+
+def _parse_lxml_card(card, url, base_url=''):
+    """Som parse_product_card, men för ett lxml-element"""
+    try:
+        parts = []
+        _collect_text(card, parts)
+        text = ' '.join(part for part in (p.strip() for p in parts) if part)
+        img = card.find('.//img')
+        src = img.get('src', '') if img is not None else ''
+        return _build_product(text, src, url, base_url)
+    except Exception:
+        return None
+
+
+def _collect_text(element, parts):
+    """Synliga textbitar i dokumentordning (utan kommentarer, skript och stilmallar)"""
+    if isinstance(element.tag, str) and element.tag not in HIDDEN_TEXT_TAGS and element.text:
+        parts.append(element.text)
+    for child in element:
+        _collect_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+
+def _build_product(text, src, url, base_url):
+    """Produkt-dict från kortets synliga text och bildkälla"""
+    price_match = PRICE_RE.search(text)
+    price = None
+    if price_match:
+        price = float(price_match.group(1).replace(',', '.'))
+
+    weight_match = WEIGHT_RE.search(text)
+    weight = None
+    if weight_match:
+        weight = f"{weight_match.group(1)}{weight_match.group(2)}"
+
+    # Bara bilder från matspars CDN
+    image_url = src if 'cloudfront.net' in src else None
+
+    # Produktnamnet är första delen av texten
+    name_parts = text.split()
+    name = ' '.join(name_parts[:4]) if name_parts else 'Okänd produkt'
+
+    return {
+        'id': stable_id('matspar', url),
+        'name': name,
+        'brand': None,
+        'weight': weight,
+        'category': None,
+        'prices': {'Matspar': price} if price else {},
+        'nutrition': {},
+        'allergens': [],
+        'image': image_url,
+        'url': f"{base_url}{url}" if not url.startswith('http') else url
+    }
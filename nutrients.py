@@ -0,0 +1,68 @@
+"""
+Näringsvektorer för Matplanerare
+Ett gemensamt format för näringsvärden: en NumPy-vektor med en plats per kolumn i
+Nutrition (NUTRIENT_FIELDS, samma ordning som tabellen), per 100 g. Saknade värden är 0.
+
+ANVÄNDNING:
+- Katalogen bygger vektorerna en gång per produkt (ProductCatalog.nutrients), och
+  nutrient_vector fungerar lika för katalogens dicts och Nutrition-rader
+- En listas näringssummor är en matris-vektor-produkt:
+      (antal × gram / 100) @ matris (n × len(NUTRIENT_FIELDS))
+  i stället för ett fält i taget per vara - alla näringsvärden räknas, även vitaminer
+  och mineraler (ShoppingList.calculate_nutrition_summary, generation.solve_quantities)
+- columns(keys) väljer ut kolumnerna för en delmängd, t.ex. listlösarens NUTRIENT_KEYS
+"""
+
+import numpy as np
+
+# Alla näringsvärden i Nutrition (per 100 g), i tabellens ordning
+NUTRIENT_FIELDS = (
+    'calories', 'protein', 'carbs', 'sugar', 'fat', 'saturated_fat', 'fiber', 'salt',
+    'vitamin_a', 'vitamin_c', 'vitamin_d', 'vitamin_e', 'vitamin_b12',
+    'calcium', 'iron', 'magnesium', 'potassium', 'zinc'
+)
+FIELD_INDEX = {key: index for index, key in enumerate(NUTRIENT_FIELDS)}
+CALORIES = FIELD_INDEX['calories']
+
+
+def columns(keys):
+    """Kolumnindex i NUTRIENT_FIELDS för näringsvärdena i keys"""
+    return np.array([FIELD_INDEX[key] for key in keys], dtype=np.intp)
+
+
+def nutrient_vector(nutrition):
+    """
+    Näringsvärden per 100 g som vektor i NUTRIENT_FIELDS-ordning
+
+    Args:
+        nutrition: Dict (katalog/API) eller objekt med attributen (Nutrition), eller None
+    """
+    if not nutrition:
+        return np.zeros(len(NUTRIENT_FIELDS))
+    if isinstance(nutrition, dict):
+        values = [nutrition.get(key) for key in NUTRIENT_FIELDS]
+    else:
+        values = [getattr(nutrition, key, None) for key in NUTRIENT_FIELDS]
+    return np.array([value or 0 for value in values], dtype=np.float64)
+
+
+def nutrient_matrix(nutritions):
+    """Matris (n × len(NUTRIENT_FIELDS)) med en nutrient_vector per rad"""
+    rows = [nutrient_vector(nutrition) for nutrition in nutritions]
+    return np.array(rows, dtype=np.float64).reshape(len(rows), len(NUTRIENT_FIELDS))
+
+
+def nutrient_totals(quantities, grams, vectors):
+    """
+    Summan för en lista: antal förpackningar × gram per förpackning × näringsvärden per 100 g
+
+    Returns:
+        Vektor i NUTRIENT_FIELDS-ordning
+    """
+    factors = np.asarray(quantities, dtype=np.float64) * np.asarray(grams, dtype=np.float64) / 100
+    return factors @ np.asarray(vectors, dtype=np.float64).reshape(len(factors), len(NUTRIENT_FIELDS))
+
+
+def as_dict(vector, keys=NUTRIENT_FIELDS):
+    """{näringsvärde: värde} för en vektor i NUTRIENT_FIELDS-ordning"""
+    return {key: float(vector[FIELD_INDEX[key]]) for key in keys}
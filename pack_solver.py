@@ -0,0 +1,249 @@
+"""
+Förpackningslösare för kombinerade ersättningar i Matplanerare
+Väljer antal förpackningar av upp till MAX_PRODUCTS produkter så att summan matchar
+originalvarans protein och kalorier så väl som möjligt till lägsta pris, inom budget.
+
+PROBLEMET (begränsad kappsäck):
+- Varje kandidat är en förpackning: (protein, kalorier, pris) per förpackning
+- Antal förpackningar per produkt: 1..MAX_PACKS (0 = produkten är inte med)
+- Kostnad att minimera:
+      PROTEIN_WEIGHT * |protein - mål| / mål
+    + CALORIE_WEIGHT * |kalorier - mål| / mål
+    + PRICE_WEIGHT   * pris / referenspris
+    + PRODUCT_PENALTY per extra produkt (enklare inköp vid lika bra match)
+- Hårda villkor: pris <= budget, och kombinationer av flera produkter
+  måste nå minst MIN_COMBO_MATCH av proteinmålet
+
+SÖKNING (branch and bound):
+- Alla produktmängder med 1..MAX_PRODUCTS produkter, enskilda produkter först
+- Förpackningsantal för alla utom den sista produkten räknas upp; protein, kalorier och
+  pris kan bara öka (och resten av produkterna kommer med minst en förpackning var), så en
+  undre gräns för kostnaden stoppar uppräkningen så fort den inte kan slå den sämsta av
+  de hittills bästa `limit` lösningarna
+- Kostnaden är konvex i den sista produktens antal - bara heltalen runt protein- och
+  kalorioptimum (och största antalet inom budget) behöver provas
+- Tidsbudget (standard 20 ms): när den tar slut returneras de bästa lösningarna hittills
+- Mängdgränsen (en förpackning av varje produkt) räknas med NumPy för alla mängder av
+  en storlek på en gång; mängder som redan då inte kan slå de bästa hoppas över utan
+  att loopen i Python behöver besöka dem (gränsen blir bara snävare under sökningen)
+"""
+
+import heapq
+import itertools
+import math
+import os
+import time
+
+import numpy as np
+
+DEFAULT_TIME_BUDGET = float(os.environ.get('MATSPAR_COMBINATION_TIME_BUDGET_MS', 20)) / 1000
+
+MAX_PRODUCTS = 3
+MAX_PACKS = 10
+
+PROTEIN_WEIGHT = 1.0
+CALORIE_WEIGHT = 0.5
+PRICE_WEIGHT = 0.25
+PRODUCT_PENALTY = 0.02
+
+MIN_COMBO_MATCH = 0.6
+
+
+class PackSolver:
+    """Bästa förpackningsantal för en målmängd protein och kalorier"""
+
+    def __init__(self, target_protein, target_calories, reference_price=None, budget=None,
+                 max_products=MAX_PRODUCTS, max_packs=MAX_PACKS, time_budget=DEFAULT_TIME_BUDGET):
+        """
+        Args:
+            target_protein: Protein (g) att ersätta
+            target_calories: Kalorier att ersätta
+            reference_price: Pris som priset normaliseras mot (t.ex. originalets)
+            budget: Max totalpris (None = ingen gräns)
+            max_products: Max antal olika produkter i en kombination
+            max_packs: Max antal förpackningar per produkt
+            time_budget: Sekunder innan sökningen avbryts
+        """
+        self.target_protein = target_protein
+        self.target_calories = target_calories
+        self.reference_price = reference_price
+        self.budget = budget
+        self.max_products = max_products
+        self.max_packs = max_packs
+        self.time_budget = time_budget
+        self.stats = {'product_sets': 0, 'evaluated': 0, 'pruned': 0, 'timed_out': False, 'seconds': 0.0}
+
+    def cost(self, protein, calories, price, products=1):
+        """Kostnad för en lösning (lägre är bättre)"""
+        cost = PRODUCT_PENALTY * (products - 1)
+        if self.target_protein > 0:
+            cost += PROTEIN_WEIGHT * abs(protein - self.target_protein) / self.target_protein
+        if self.target_calories > 0:
+            cost += CALORIE_WEIGHT * abs(calories - self.target_calories) / self.target_calories
+        if self.reference_price:
+            cost += PRICE_WEIGHT * price / self.reference_price
+        return cost
+
+    def _lower_bound(self, protein, calories, price, products):
+        """Undre gräns för alla lösningar som bygger vidare på en dellösning (allt kan bara öka)"""
+        bound = PRODUCT_PENALTY * (products - 1)
+        if self.target_protein > 0:
+            bound += PROTEIN_WEIGHT * max(0, protein - self.target_protein) / self.target_protein
+        if self.target_calories > 0:
+            bound += CALORIE_WEIGHT * max(0, calories - self.target_calories) / self.target_calories
+        if self.reference_price:
+            bound += PRICE_WEIGHT * price / self.reference_price
+        return bound
+
+    def solve(self, packs, limit=5):
+        """
+        Args:
+            packs: Lista med (protein, kalorier, pris) per förpackning
+            limit: Antal lösningar att returnera
+
+        Returns:
+            Lista med (kostnad, index, antal) sorterad bäst först - en lösning per produktmängd
+        """
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        self._packs = packs
+        self._limit = limit
+        self._best = []  # max-heap (negerad kostnad) med de `limit` bästa lösningarna
+        self._set_best = None  # bästa lösningen för produktmängden som söks just nu
+        self._rest = None
+
+        # Bästa enskilda produkterna först - bra lösningar tidigt ger en snävare gräns
+        order = sorted(range(len(packs)), key=lambda i: self._single_cost(packs[i]))
+
+        for size in range(1, self.max_products + 1):
+            for product_set in self._candidate_sets(order, size):
+                if time.monotonic() > deadline:
+                    self.stats['timed_out'] = True
+                    break
+                self.stats['product_sets'] += 1
+                self._set_best = None
+                self._rest = self._remaining_packs(product_set)
+                # En förpackning av varje räcker för att avgöra om mängden kan slå de bästa
+                first_protein, first_calories, first_price = packs[product_set[0]]
+                rest_protein, rest_calories, rest_price = self._rest[0]
+                set_bound = self._lower_bound(
+                    first_protein + rest_protein, first_calories + rest_calories, first_price + rest_price, size
+                )
+                if set_bound >= self._bound():
+                    self.stats['pruned'] += 1
+                    continue
+                self._search(product_set, 0, 0.0, 0.0, 0.0, ())
+                if self._set_best is not None:
+                    if len(self._best) >= self._limit:
+                        heapq.heapreplace(self._best, self._set_best)
+                    else:
+                        heapq.heappush(self._best, self._set_best)
+            if self.stats['timed_out']:
+                break
+
+        self.stats['seconds'] = round(time.monotonic() - started, 4)
+        return sorted(((-neg_cost, indices, quantities) for neg_cost, indices, quantities in self._best))
+
+    def _candidate_sets(self, order, size):
+        """Produktmängder av en storlek, utom de som mängdgränsen redan utesluter"""
+        product_sets = itertools.combinations(order, size)
+        bound = self._bound()
+        if size == 1 or bound == math.inf:
+            return product_sets
+        product_sets = list(product_sets)
+        if not product_sets:
+            return product_sets
+
+        totals = np.array(self._packs, dtype=np.float64)[np.array(product_sets)].sum(axis=1)
+        lower = np.full(len(product_sets), PRODUCT_PENALTY * (size - 1))
+        if self.target_protein > 0:
+            lower += PROTEIN_WEIGHT * np.maximum(0, totals[:, 0] - self.target_protein) / self.target_protein
+        if self.target_calories > 0:
+            lower += CALORIE_WEIGHT * np.maximum(0, totals[:, 1] - self.target_calories) / self.target_calories
+        if self.reference_price:
+            lower += PRICE_WEIGHT * totals[:, 2] / self.reference_price
+
+        # Marginal för avrundning - gränsfallen avgörs av den exakta kontrollen i solve
+        keep = lower < bound + 1e-9
+        skipped = len(product_sets) - int(keep.sum())
+        self.stats['product_sets'] += skipped
+        self.stats['pruned'] += skipped
+        return [product_set for product_set, kept in zip(product_sets, keep.tolist()) if kept]
+
+    def _single_cost(self, pack):
+        """Ungefärlig kostnad för produkten ensam (antal avrundat mot proteinmålet)"""
+        pack_protein, pack_calories, pack_price = pack
+        quantity = 1
+        if self.target_protein > 0 and pack_protein > 0:
+            quantity = min(max(round(self.target_protein / pack_protein), 1), self.max_packs)
+        return self.cost(quantity * pack_protein, quantity * pack_calories, quantity * pack_price)
+
+    def _remaining_packs(self, product_set):
+        """Summan av en förpackning av varje produkt efter position i (alla måste vara med)"""
+        rest = [(0.0, 0.0, 0.0)]
+        for index in reversed(product_set[1:]):
+            protein, calories, price = rest[-1]
+            pack_protein, pack_calories, pack_price = self._packs[index]
+            rest.append((protein + pack_protein, calories + pack_calories, price + pack_price))
+        return rest[::-1]
+
+    def _bound(self):
+        """
+        Kostnaden som en ny lösning måste slå: den sämsta av de `limit` bästa
+        (oändlig tills så många finns) och det bästa hittills för samma produktmängd
+        """
+        bound = -self._best[0][0] if len(self._best) >= self._limit else math.inf
+        if self._set_best is not None:
+            bound = min(bound, -self._set_best[0])
+        return bound
+
+    def _search(self, product_set, depth, protein, calories, price, quantities):
+        pack_protein, pack_calories, pack_price = self._packs[product_set[depth]]
+
+        if depth == len(product_set) - 1:
+            self._finish(product_set, protein, calories, price, quantities)
+            return
+
+        rest_protein, rest_calories, rest_price = self._rest[depth]
+        for quantity in range(1, self.max_packs + 1):
+            new_protein = protein + quantity * pack_protein
+            new_calories = calories + quantity * pack_calories
+            new_price = price + quantity * pack_price
+            if self.budget is not None and new_price + rest_price > self.budget:
+                break
+            # Gränsen växer med antalet - fler förpackningar kan bara bli sämre härifrån
+            lower_bound = self._lower_bound(
+                new_protein + rest_protein, new_calories + rest_calories, new_price + rest_price, len(product_set)
+            )
+            if lower_bound >= self._bound():
+                self.stats['pruned'] += 1
+                break
+            self._search(product_set, depth + 1, new_protein, new_calories, new_price, quantities + (quantity,))
+
+    def _finish(self, product_set, protein, calories, price, quantities):
+        """Sista produkten: pröva antalen runt protein- och kalorioptimum"""
+        pack_protein, pack_calories, pack_price = self._packs[product_set[-1]]
+
+        candidates = {1}
+        for target, total, per_pack in ((self.target_protein, protein, pack_protein),
+                                        (self.target_calories, calories, pack_calories)):
+            if target > 0 and per_pack > 0:
+                exact = (target - total) / per_pack
+                candidates.update((math.floor(exact), math.ceil(exact)))
+        # Ligger optimum över budget är det största antalet inom budget bäst
+        if self.budget is not None and pack_price > 0:
+            candidates.add(math.floor((self.budget - price) / pack_price))
+
+        for quantity in sorted({min(max(q, 1), self.max_packs) for q in candidates}):
+            total_protein = protein + quantity * pack_protein
+            total_calories = calories + quantity * pack_calories
+            total_price = price + quantity * pack_price
+            self.stats['evaluated'] += 1
+            if self.budget is not None and total_price > self.budget:
+                continue
+            if (len(product_set) > 1 and self.target_protein > 0
+                    and total_protein < MIN_COMBO_MATCH * self.target_protein):
+                continue
+            cost = self.cost(total_protein, total_calories, total_price, len(product_set))
+            if cost < self._bound():
+                self._set_best = (-cost, product_set, quantities + (quantity,))
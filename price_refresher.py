@@ -0,0 +1,316 @@
+"""
+Prisuppdaterare för Matplanerare
+Hämtar priser från matspar.se i bakgrunden och sparar dem i Product/Price-tabellerna,
+så att request-vägen bara behöver läsa lokal data (sökcache + databas).
+
+KÖRS SOM:
+- Egen process:  python -m price_refresher [--once] [--interval SEKUNDER]
+- Tråd i appen:  MATSPAR_PRICE_REFRESHER=thread (startas i app.py, som då stänger av
+                 onlinesökning på request-vägen)
+
+VARJE VARV:
+1. De mest sökta termerna (sökcachens träffräknare)
+2. Produkter från matspar.se vars Price-rader är äldre än MATSPAR_PRICE_MAX_AGE (standard 24 h)
+
+Varje term hämtas via scraperns vanliga HTTP-väg (hastighetsbegränsning per värd och
+circuit breaker). Resultatet skrivs till sökcachen och produkter/priser upsertas i
+batchar - en transaktion per batch, med ett uppslag per tabell i stället för ett per produkt.
+
+Cachar som beror på priserna (invalidates, t.ex. listgenereringens resultatcache) töms
+efter varv som har skrivit priser.
+
+Bara en worker åt gången kör uppdateringen (lås i den delade cachen), även om flera
+gunicorn-workers startar varsin tråd.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from cache import SharedCache, normalize_query
+from database import db, Product, Price, product_natural_key, upsert_products
+
+DEFAULT_INTERVAL = int(os.environ.get('MATSPAR_REFRESH_INTERVAL', 30 * 60))
+DEFAULT_MAX_AGE = int(os.environ.get('MATSPAR_PRICE_MAX_AGE', 24 * 3600))
+
+# Vänta lite efter start så att uppdateringen inte konkurrerar med appens uppstart
+STARTUP_DELAY = 10
+
+
+class PriceRefresher:
+    """Uppdaterar sökcache och Product/Price-rader från matspar.se"""
+
+    def __init__(self, app, scraper, interval=None, max_age=None, top_terms=50, stale_products=50, batch_size=20,
+                 invalidates=()):
+        """
+        Args:
+            app: Flask-appen (för databaskontext)
+            scraper: MatsparScraper vars HTTP-väg och sökcache används
+            interval: Sekunder mellan varven
+            max_age: Price-rader äldre än så här (sekunder) räknas som inaktuella
+            top_terms: Antal mest sökta termer per varv
+            stale_products: Max antal inaktuella produkter per varv
+            batch_size: Antal onlineprodukter per databastransaktion
+            invalidates: Cachar (med clear()) som beror på priserna och töms när ett varv
+                         har skrivit priser, t.ex. GenerationCache
+        """
+        self.app = app
+        self.scraper = scraper
+        self.interval = interval or DEFAULT_INTERVAL
+        self.max_age = max_age or DEFAULT_MAX_AGE
+        self.top_terms = top_terms
+        self.stale_products = stale_products
+        self.batch_size = batch_size
+        self.invalidates = list(invalidates)
+
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._leases = SharedCache('leases', max_entries=100)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'skipped_runs': 0,
+            'terms': 0,
+            'online_results': 0,
+            'products_created': 0,
+            'products_updated': 0,
+            'prices_written': 0,
+            'last_run_at': None,
+            'last_run_seconds': None,
+            'last_error': None
+        }
+
+    # ============== TERMER ==============
+
+    def collect_terms(self):
+        """
+        Termer att uppdatera: mest sökta först, sedan inaktuella produkter
+
+        Returns:
+            Lista med (sökterm, postnummer, limit)
+        """
+        terms = []
+        seen = set()
+
+        for key, _hits in self.scraper.search_cache.keys_by_hits(self.top_terms):
+            parsed = self.scraper.parse_search_key(key)
+            if parsed and parsed not in seen:
+                seen.add(parsed)
+                terms.append(parsed)
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.max_age)
+        stale = (
+            db.session.query(Product.name)
+            .join(Price, Price.product_id == Product.id)
+            .filter(Product.matspar_url.isnot(None), Price.updated_at < cutoff)
+            .distinct()
+            .limit(self.stale_products)
+            .all()
+        )
+        for (name,) in stale:
+            term = (normalize_query(name), None, 20)
+            if term not in seen:
+                seen.add(term)
+                terms.append(term)
+
+        return terms
+
+    # ============== UPPDATERING ==============
+
+    def run_once(self):
+        """Kör ett varv. Returnerar statistik för varvet (None om en annan worker har låset)."""
+        # Låset förnyas varje varv och släpps om ägaren inte hörts av på två intervall
+        if not self._leases.acquire_lease('price_refresher', self.interval * 2, self.owner):
+            with self._lock:
+                self._stats['skipped_runs'] += 1
+            return None
+
+        started = time.monotonic()
+        run = {'terms': 0, 'online_results': 0, 'products_created': 0, 'products_updated': 0, 'prices_written': 0}
+
+        with self.app.app_context():
+            terms = self.collect_terms()
+            batch = []
+            for query, postal_code, limit in terms:
+                if self._stop.is_set():
+                    break
+                run['terms'] += 1
+                products = self.scraper.refresh_search(query, limit=limit, postal_code=postal_code)
+                if products:
+                    run['online_results'] += 1
+                    batch.extend(products)
+                if len(batch) >= self.batch_size:
+                    self._accumulate(run, self._persist(batch))
+                    batch = []
+            if batch:
+                self._accumulate(run, self._persist(batch))
+
+        if run['prices_written']:
+            for cache in self.invalidates:
+                cache.clear()
+
+        with self._lock:
+            self._stats['runs'] += 1
+            for key, value in run.items():
+                self._stats[key] += value
+            self._stats['last_run_at'] = datetime.utcnow().isoformat()
+            self._stats['last_run_seconds'] = round(time.monotonic() - started, 3)
+        return run
+
+    @staticmethod
+    def _accumulate(run, counts):
+        for key, value in counts.items():
+            run[key] += value
+
+    def _persist(self, products):
+        """
+        Upserta Product/Price för en batch onlineprodukter i en transaktion
+
+        Produkter matchas på matspar_url och annars på naturlig nyckel (namn, varumärke,
+        vikt), t.ex. rader från genererade listor som sparats utan URL. Nya produkter skapas
+        med upsert_products. En ändrad vikt skrivs bara om den nya nyckeln är ledig.
+        """
+        by_url = {}
+        for product in products:
+            if product.get('url') and product.get('prices'):
+                by_url[product['url']] = product
+        if not by_url:
+            return {}
+
+        counts = {'products_created': 0, 'products_updated': 0, 'prices_written': 0}
+        now = datetime.utcnow()
+        try:
+            existing = {
+                p.matspar_url: p
+                for p in Product.query.filter(Product.matspar_url.in_(list(by_url))).all()
+            }
+            unmatched = {
+                product_natural_key(data.get('name'), data.get('brand'), data.get('weight')): url
+                for url, data in by_url.items() if url not in existing
+            }
+            if unmatched:
+                for product in Product.query.filter(Product.natural_key.in_(list(unmatched))).all():
+                    url = unmatched[product.natural_key]
+                    existing[url] = product
+                    product.matspar_url = product.matspar_url or url
+
+            # Nycklar som en ändrad vikt skulle ge - upptagna nycklar lämnas orörda
+            rekeyed = {}
+            for url, product in existing.items():
+                weight = by_url[url].get('weight')
+                if weight and weight != product.weight:
+                    rekeyed[url] = product_natural_key(product.name, product.brand, weight)
+            taken = set()
+            if rekeyed:
+                taken = {
+                    key for (key,) in
+                    db.session.query(Product.natural_key).filter(Product.natural_key.in_(set(rekeyed.values())))
+                }
+
+            prices = {}
+            if existing:
+                product_ids = [p.id for p in existing.values()]
+                prices = {
+                    (price.product_id, price.store): price
+                    for price in Price.query.filter(Price.product_id.in_(product_ids)).all()
+                }
+
+            created = []
+            for url, data in by_url.items():
+                product = existing.get(url)
+                if product is None:
+                    created.append(data)
+                    continue
+                if url in rekeyed and rekeyed[url] not in taken:
+                    product.weight = data['weight']
+                    taken.add(rekeyed[url])
+                product.image_url = data.get('image') or product.image_url
+                counts['products_updated'] += 1
+                for store, amount in data['prices'].items():
+                    price = prices.get((product.id, store))
+                    if price is None:
+                        price = prices[(product.id, store)] = Price(product_id=product.id, store=store, price=amount)
+                        db.session.add(price)
+                    price.price = amount
+                    price.updated_at = now
+                    counts['prices_written'] += 1
+
+            if created:
+                # Priserna skrivs av upsert_products (även om en samtidig generering hann före)
+                upsert_products(created)
+                counts['products_created'] += len(created)
+                counts['prices_written'] += sum(len(data['prices']) for data in created)
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Prisuppdatering misslyckades: {e}")
+            with self._lock:
+                self._stats['last_error'] = str(e)
+            return {}
+        return counts
+
+    # ============== SCHEMALÄGGNING ==============
+
+    def start(self):
+        """Starta uppdateringen i en bakgrundstråd"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='price-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self, startup_delay=STARTUP_DELAY):
+        """Kör ett varv var interval:e sekund tills stop() anropas"""
+        delay = startup_delay
+        while not self._stop.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Prisuppdatering misslyckades: {e}")
+                with self._lock:
+                    self._stats['last_error'] = str(e)
+            delay = self.interval
+
+    def stats(self):
+        with self._lock:
+            return {
+                'interval_seconds': self.interval,
+                'max_age_seconds': self.max_age,
+                'running': bool(self._thread and self._thread.is_alive()),
+                **self._stats
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Uppdatera priser från matspar.se i bakgrunden')
+    parser.add_argument('--once', action='store_true', help='Kör ett varv och avsluta')
+    parser.add_argument('--interval', type=int, default=None, help='Sekunder mellan varven')
+    args = parser.parse_args(argv)
+
+    # Den här processen är uppdateraren - appen ska inte starta en egen tråd
+    os.environ['MATSPAR_PRICE_REFRESHER'] = 'off'
+    from app import app, scraper, generation_cache
+
+    refresher = PriceRefresher(app, scraper, interval=args.interval, invalidates=[generation_cache])
+    if args.once:
+        print(refresher.run_once())
+        return 0
+
+    print(f"Prisuppdaterare startad (var {refresher.interval}:e sekund)")
+    try:
+        refresher.run_forever(startup_delay=0)
+    except KeyboardInterrupt:
+        refresher.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,222 @@
+"""
+Sökindex för produktkatalogen
+Byggs en gång i minnet och ger rankade, feltoleranta träffar utan att loopa över hela katalogen.
+
+INDEXET INNEHÅLLER:
+- Kategorinycklar: 'kyckling', 'bröd' ... (exakt och delvis matchning, som tidigare)
+- Ord (tokens): ord i produktnamn, märke och kategori
+- Trigram: tre-teckensbitar av diakritik-vikta ord, så att stavningsvarianter hittas
+  ("kycklingfile" ≈ "kycklingfilé", "gronsaker" ≈ "grönsaker")
+
+RANKNING (i nivåordning, bästa först):
+  0. Exakt kategorinyckel
+  1. Kategorinyckel som delsträng av söktermen eller tvärtom
+  2. Exakt ordträff i namn/märke
+  3. Trigram-likhet över tröskelvärdet
+Inom nivå 0-1 behålls katalogordningen, inom nivå 2-3 sorteras efter likhet.
+
+Indexet tar emot godtyckliga (kategori, produkt)-rader och fungerar likadant för
+dagens ~100 basvaror som för 100 000+ rader inlästa från databasen. Trigram-nivån
+använder prefixfiltrering: bara dokument som innehåller något av söktermens mest
+sällsynta trigram kan nå tröskeln, så vanliga trigram behöver aldrig gås igenom.
+"""
+
+import heapq
+import math
+import unicodedata
+from collections import Counter
+
+# Minsta andel av söktermens trigram som måste finnas i produkten
+TRIGRAM_THRESHOLD = 0.7
+
+
+def fold(text):
+    """Gemener och utan diakritiska tecken: 'Kycklingfilé' -> 'kycklingfile', 'grönsaker' -> 'gronsaker'"""
+    decomposed = unicodedata.normalize('NFKD', str(text or '').lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    """Dela upp i ord (bokstäver och siffror), diakritik-vikta"""
+    folded = fold(text)
+    cleaned = ''.join(ch if ch.isalnum() else ' ' for ch in folded)
+    return cleaned.split()
+
+
+def trigrams(token):
+    """Trigram för ett ord, med utfyllnad så att korta ord och ordgränser räknas"""
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def inner_trigrams(text):
+    """Trigram utan utfyllnad - används för delsträngssökning bland kategorinycklar"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductIndex:
+    """Inverterat index (kategorier, ord, trigram) över produktrader"""
+
+    def __init__(self):
+        self.entries = []            # doc_id -> (kategori, produkt)
+        self._category_docs = {}     # vikt kategorinyckel -> [doc_id] (katalogordning)
+        self._category_order = {}    # kategorinyckel -> ordningsnummer
+        self._category_grams = {}    # trigram -> {kategorinyckel}
+        self._token_docs = {}        # ord -> {doc_id}
+        self._trigram_docs = {}      # trigram -> {doc_id}
+        self._doc_trigram_counts = []
+
+    @classmethod
+    def from_categories(cls, products_by_category):
+        """Bygg index från en dict {kategori: [produkt, ...]} (t.ex. FALLBACK_PRODUCTS)"""
+        index = cls()
+        for category, products in products_by_category.items():
+            for product in products:
+                index.add(category, product)
+        return index
+
+    def add(self, category, product):
+        """Lägg till en produktrad och returnera dess doc_id"""
+        doc_id = len(self.entries)
+        self.entries.append((category, product))
+
+        category_key = ' '.join(tokenize(category))
+        if category_key not in self._category_docs:
+            self._category_docs[category_key] = []
+            self._category_order[category_key] = len(self._category_order)
+            for gram in inner_trigrams(category_key):
+                self._category_grams.setdefault(gram, set()).add(category_key)
+        self._category_docs[category_key].append(doc_id)
+
+        tokens = set(tokenize(product.get('name', '')))
+        tokens.update(tokenize(product.get('brand', '')))
+        tokens.update(tokenize(category))
+        for token in tokens:
+            self._token_docs.setdefault(token, set()).add(doc_id)
+
+        doc_trigrams = set()
+        for token in tokens:
+            doc_trigrams |= trigrams(token)
+        for gram in doc_trigrams:
+            self._trigram_docs.setdefault(gram, set()).add(doc_id)
+        self._doc_trigram_counts.append(len(doc_trigrams))
+        return doc_id
+
+    def extend(self, rows):
+        """Lägg till många (kategori, produkt)-rader, t.ex. från databasen"""
+        for category, product in rows:
+            self.add(category, product)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query, limit=20):
+        """
+        Rankad sökning
+
+        Returns:
+            Lista med (kategori, produkt), bästa träff först
+        """
+        folded_query = ' '.join(tokenize(query))
+        if not folded_query or limit <= 0:
+            return []
+
+        ranked = []
+        seen = set()
+
+        def take(doc_ids):
+            for doc_id in doc_ids:
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    ranked.append(doc_id)
+                    if len(ranked) >= limit:
+                        return True
+            return False
+
+        # Nivå 0: exakt kategori
+        if take(self._category_docs.get(folded_query, ())):
+            return self._materialize(ranked)
+
+        # Nivå 1: kategorinyckel som delsträng (samma regel som den gamla linjära sökningen)
+        for key in self._related_category_keys(folded_query):
+            if take(self._category_docs[key]):
+                return self._materialize(ranked)
+
+        # Nivå 2: exakta ordträffar, flest träffade ord först
+        query_tokens = folded_query.split()
+        token_hits = Counter()
+        for token in query_tokens:
+            token_hits.update(self._token_docs.get(token, ()))
+        for doc_id in seen:
+            token_hits.pop(doc_id, None)
+        if token_hits:
+            ordered = heapq.nsmallest(limit - len(ranked), token_hits, key=lambda d: (-token_hits[d], d))
+            if take(ordered):
+                return self._materialize(ranked)
+
+        # Nivå 3: trigram-likhet
+        take(self._trigram_matches(query_tokens, seen, limit - len(ranked)))
+        return self._materialize(ranked)
+
+    def _related_category_keys(self, folded_query):
+        """Kategorinycklar där söktermen är en delsträng av nyckeln eller tvärtom, i katalogordning"""
+        related = set()
+
+        # Nycklar som är delsträngar av söktermen: slå upp alla delsträngar direkt
+        length = len(folded_query)
+        for start in range(length):
+            for end in range(start + 1, length + 1):
+                candidate = folded_query[start:end]
+                if candidate != folded_query and candidate in self._category_docs:
+                    related.add(candidate)
+
+        # Nycklar som innehåller söktermen: kandidater via trigram, sedan verifiering
+        grams = inner_trigrams(folded_query)
+        if grams:
+            candidates = None
+            for gram in grams:
+                keys = self._category_grams.get(gram, set())
+                candidates = set(keys) if candidates is None else candidates & keys
+                if not candidates:
+                    break
+        else:
+            candidates = self._category_docs.keys()
+        for key in candidates or ():
+            if key != folded_query and folded_query in key:
+                related.add(key)
+
+        return sorted(related, key=self._category_order.__getitem__)
+
+    def _trigram_matches(self, query_tokens, seen, limit):
+        """Dokument vars trigram täcker minst TRIGRAM_THRESHOLD av söktermens, bästa först"""
+        query_trigrams = set()
+        for token in query_tokens:
+            query_trigrams |= trigrams(token)
+        total = len(query_trigrams)
+        if not total:
+            return []
+
+        # Prefixfiltrering: ett dokument som når tröskeln måste innehålla minst ett av
+        # de (total - needed + 1) mest sällsynta trigrammen
+        needed = math.ceil(TRIGRAM_THRESHOLD * total)
+        postings = sorted(
+            (self._trigram_docs.get(gram, set()) for gram in query_trigrams), key=len
+        )
+        candidates = set()
+        for posting in postings[:total - needed + 1]:
+            candidates |= posting
+        candidates -= seen
+
+        # Räkna delade trigram med mängdsnitt (körs i C) i stället för en loop per dokument
+        shared = Counter()
+        for posting in postings:
+            shared.update(candidates & posting if len(posting) > len(candidates) else posting & candidates)
+
+        matches = [doc_id for doc_id, count in shared.items() if count >= needed]
+        return heapq.nsmallest(
+            limit, matches,
+            key=lambda d: (-shared[d], -2 * shared[d] / (total + self._doc_trigram_counts[d]), d)
+        )
+
+    def _materialize(self, doc_ids):
+        return [self.entries[doc_id] for doc_id in doc_ids]
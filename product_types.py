@@ -0,0 +1,107 @@
+"""
+Produkttyper för Matplanerare
+Klassificerar en produkt (protein_source, dairy, bread, carbs, vegetables, fruit, other)
+utifrån namn, kategori och näringsvärden - används för striktare matchning av ersättningar.
+
+SNABBARE KLASSIFICERING:
+- Alla nyckelordslistor är kompilerade till ETT reguljärt uttryck som körs en gång per namn.
+  Varje grupp är en lookahead från strängens början, så uttrycket talar om vilka grupper
+  som förekommer någonstans i namnet (samma som `kw in name` för varje nyckelord).
+- Prioritetsordningen tillämpas sedan på träffarna i Python, i samma ordning som tidigare.
+- Katalogprodukter klassificeras en gång när katalogen byggs (ProductCatalog.product_type),
+  så på request-vägen är klassificeringen ett uppslag.
+"""
+
+import re
+
+# Proteinkällor (kött, fisk, fågel, vegetariskt protein) - har högst prioritet
+PROTEIN_KEYWORDS = [
+    'kyckling', 'kycklingfilé', 'kycklingfärs', 'köttfärs', 'nötfärs', 'fläskfärs',
+    'lax', 'laxfilé', 'torsk', 'torskfilé', 'fisk', 'fiskfilé',
+    'tofu', 'quorn', 'sojafärs', 'bönor', 'kikärtor',
+    'linser', 'räkor', 'fläsk', 'fläskfilé', 'bacon', 'korv', 'skinka', 'biff'
+]
+DAIRY_KEYWORDS = ['mjölk', 'yoghurt', 'grädde', 'smör', 'kvarg', 'crème', 'gräddfil', 'filmjölk', 'ost ']
+BREAD_KEYWORDS = ['bröd', 'limpa', 'fralla', 'knäckebröd', 'rostbröd', 'toast']
+CARB_KEYWORDS = ['pasta', 'ris', 'potatis', 'havregryn', 'müsli', 'couscous', 'bulgur', 'nudlar']
+VEGETABLE_KEYWORDS = [
+    'tomat', 'gurka', 'morot', 'sallad', 'broccoli', 'paprika', 'lök', 'spenat', 'zucchini', 'vitkål', 'blomkål'
+]
+FRUIT_KEYWORDS = ['äpple', 'banan', 'apelsin', 'päron', 'druvor', 'bär', 'citron', 'lime']
+
+PROTEIN_CATEGORIES = {'kött', 'fågel', 'kyckling', 'fisk', 'lax', 'vegetariskt', 'protein', 'köttfärs', 'vego'}
+DAIRY_CATEGORIES = {'mejeri', 'ost'}
+CARB_CATEGORIES = {'spannmål', 'pasta', 'ris'}
+VEGETABLE_CATEGORIES = {'grönsaker', 'gronsaker'}
+
+# STRIKT MATCHNING: produkttyp -> typer som får ersätta den (saknas typen = inget typfilter)
+SUBSTITUTE_TYPES = {
+    'protein_source': ('protein_source',),  # Endast andra proteinkällor
+    'carbs': ('carbs',),                    # Endast andra kolhydratkällor
+    'dairy': ('dairy', 'other'),            # Mejeri ELLER växtbaserade alternativ
+    'bread': ('bread',),                    # Bröd ska BARA ersättas med annat bröd
+    'vegetables': ('vegetables',),
+    'fruit': ('fruit',),
+}
+
+
+def _any_of(keywords):
+    return '|'.join(re.escape(kw) for kw in keywords)
+
+
+def _group(name, pattern):
+    # Valfri lookahead från början av namnet: gruppen sätts om mönstret finns någonstans
+    return f'(?:(?=(?P<{name}>{pattern})))?'
+
+
+NAME_MATCHER = re.compile(''.join([
+    _group('protein', f'.*?(?:{_any_of(PROTEIN_KEYWORDS)})'),
+    _group('egg', '.*?ägg'),
+    _group('sandwich', '.*?smörgås'),
+    _group('dairy', f'.*?(?:{_any_of(DAIRY_KEYWORDS)})'),
+    # Ost: namnet börjar eller slutar med "ost", eller innehåller " ost"
+    _group('cheese', r'ost|.*?ost\Z|.*? ost'),
+    _group('bread', f'.*?(?:{_any_of(BREAD_KEYWORDS)})'),
+    _group('carbs', f'.*?(?:{_any_of(CARB_KEYWORDS)})'),
+    _group('vegetables', f'.*?(?:{_any_of(VEGETABLE_KEYWORDS)})'),
+    _group('fruit', f'.*?(?:{_any_of(FRUIT_KEYWORDS)})'),
+]), re.DOTALL)
+
+
+def classify_product(product):
+    """
+    Bestäm produkttyp baserat på namn och kategori för striktare matchning
+    """
+    name = (product.get('name', '') or '').lower()
+    category = (product.get('category', '') or '').lower()
+    nutrition = product.get('nutrition') or {}
+    found = NAME_MATCHER.match(name)
+
+    # Proteinkällor FÖRST - har prioritet för att undvika fel klassificering
+    if found['protein'] or category in PROTEIN_CATEGORIES:
+        return 'protein_source'
+
+    # Ägg separat (eftersom ägg-kategorin är speciell)
+    if (found['egg'] and not found['sandwich']) or category == 'ägg':
+        return 'protein_source'
+
+    # Mejeriprodukter (efter protein för att inte klassificera kycklingfilé som mejeri)
+    if found['dairy'] or found['cheese'] or category in DAIRY_CATEGORIES:
+        return 'dairy'
+
+    # Hög proteinprofil (>15g/100g) utan kol/fiber = troligen proteinkälla
+    protein = nutrition.get('protein', 0) or 0
+    carbs = nutrition.get('carbs', 0) or 0
+    if protein > 15 and carbs < 10:
+        return 'protein_source'
+
+    if found['bread'] or category == 'bröd':
+        return 'bread'
+    if found['carbs'] or category in CARB_CATEGORIES:
+        return 'carbs'
+    if found['vegetables'] or category in VEGETABLE_CATEGORIES:
+        return 'vegetables'
+    if found['fruit'] or category == 'frukt':
+        return 'fruit'
+
+    return 'other'
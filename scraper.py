@@ -20,12 +20,29 @@ ALLERGEN-TAGGAR:
 SENAST UPPDATERAD: Februari 2026
 """
 
+import os
 import requests
-from bs4 import BeautifulSoup
 import json
-import time
 import re
-from urllib.parse import quote
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote, urlparse
+
+import numpy as np
+
+from allergens import allergy_mask, unknown_allergies
+from cache import SharedCache, make_key, normalize_query
+from catalog import ProductCatalog, ProductFeatures
+from matspar_parser import parse_product_card, parse_results_page
+from http_client import (
+    DEFAULT_HTTP_MODE, AdaptiveTimeout, CircuitBreaker, FixtureStore, HostRateLimiter, SessionPool, mount_rate_limiter,
+    server_elapsed
+)
+from pack_solver import PackSolver
+from product_index import ProductIndex
+from product_types import SUBSTITUTE_TYPES, classify_product
+from substitution_graph import SubstitutionGraph, product_fingerprint
 
 class MatsparScraper:
     # Behålls för eventuell framtida användning (ej i aktiv användning)
@@ -236,26 +253,102 @@ class MatsparScraper:
         ],
     }
     
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
+    # Hur länge sökresultat cachas (sekunder). Lokala fallback-resultat cachas kortare
+    # så att matspar.se prövas igen snart om sajten var nere.
+    SEARCH_CACHE_TTL = 6 * 3600
+    SUBSTITUTION_CACHE_TTL = 24 * 3600
+    SUBSTITUTION_CACHE_SIZE = int(os.environ.get('MATSPAR_SUBSTITUTION_CACHE_SIZE', 20000))
+    LOCAL_RESULT_CACHE_TTL = 15 * 60
+    
+    # Samtidighet för search_many: trådar totalt och max samtidiga anrop per värd
+    MAX_SEARCH_WORKERS = 8
+    MAX_REQUESTS_PER_HOST = 4
+    
+    def __init__(self, search_cache=None, rate_limiter=None, online_search=None, http_mode=None, fixtures=None,
+                 substitution_cache=None):
+        # Hastighetsbegränsning per värd - gäller bara när ett anrop faktiskt skickas
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        
+        # Inspelning/uppspelning av svar från matspar.se (MATSPAR_HTTP_MODE, se http_client)
+        self.http_mode = http_mode or DEFAULT_HTTP_MODE
+        self.fixtures = fixtures or (FixtureStore() if self.http_mode != 'passthrough' else None)
+        
+        # En keep-alive-session per postnummer (LRU) - postnumret är en parameter per anrop
+        self.sessions = SessionPool(self._new_session)
+        
+        # Circuit breaker och adaptiva timeouts för onlinesökningen
+        self.breaker = CircuitBreaker()
+        self.timeouts = AdaptiveTimeout()
+        
+        # Om sökningar på request-vägen får gå mot matspar.se. Stängs av när prisuppdateraren
+        # (price_refresher.py) körs - då läser request-vägen bara cache och lokal data.
+        if online_search is None:
+            online_search = os.environ.get('MATSPAR_ONLINE_SEARCH', '1').lower() not in ('0', 'false', 'off')
+        self.online_search = online_search
+        
+        # Standardpostnummer för anrop utan eget postnummer (se set_postal_code)
+        self.postal_code = None
+        
+        # Trådpool för parallella sökningar och en semafor per värd (se search_many)
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_SEARCH_WORKERS, thread_name_prefix='matspar-search')
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+        
+        # Produktkatalogen (stabila ID:n, skrivskyddade produkter) och sökindex över den - byggs en gång
+        self.catalog = ProductCatalog(self.FALLBACK_PRODUCTS, self.PRODUCT_IMAGES)
+        self.product_index = ProductIndex.from_categories(
+            {category: self.catalog.by_category(category) for category in self.catalog.categories()}
+        )
+        
+        # Förberäknade alternativ per katalogprodukt (se substitution_graph) - byggs i bakgrunden
+        self.substitutions = SubstitutionGraph(self)
+        self.substitutions.start()
+        
+        # Delad sökcache (SQLite) - gemensam för alla gunicorn-workers
+        self.search_cache = search_cache or SharedCache(
+            'search', max_entries=5000, ttl=self.SEARCH_CACHE_TTL, stale_ttl=7 * 24 * 3600
+        )
+        
+        # Delad cache för ersättningar (find_alternatives/find_combined_alternatives) - se _substitution_key
+        self.substitution_cache = substitution_cache or SharedCache(
+            'substitutions', max_entries=self.SUBSTITUTION_CACHE_SIZE, ttl=self.SUBSTITUTION_CACHE_TTL, stale_ttl=0
+        )
+    
+    def _new_session(self, postal_code=None):
+        """Skapa en keep-alive-session, med zipcode-cookie om postnummer anges"""
+        session = requests.Session()
+        session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Accept-Language': 'sv-SE,sv;q=0.9,en;q=0.8',
         })
-        
-        # Postnummer för platsbaserade priser
-        self.postal_code = None
+        mount_rate_limiter(session, self.rate_limiter, self.http_mode, self.fixtures)
+        if postal_code:
+            # Matspar.se använder postnummer för att visa vilka butiker som finns nära
+            session.cookies.set('zipcode', str(postal_code), domain='matspar.se')
+        return session
+    
+    @property
+    def session(self):
+        """Sessionen för standardpostnumret (bakåtkompatibelt - använd sessions.get(postnummer))"""
+        return self.sessions.get(self.postal_code)
+    
+    @staticmethod
+    def _normalize_postal_code(postal_code):
+        """'123 45' -> '12345'; ogiltiga postnummer blir None"""
+        postal_code = str(postal_code or '').replace(' ', '')
+        return postal_code if len(postal_code) == 5 else None
     
     def set_postal_code(self, postal_code):
         """
-        Ställ in postnummer för att få lokala priser.
-        Matspar.se använder postnummer för att visa vilka butiker som finns nära.
+        Ställ in standardpostnummer för anrop som inte anger något eget.
+        
+        Behålls för bakåtkompatibilitet - skicka hellre postal_code per anrop
+        (search_products(..., postal_code=...)), så delas inget tillstånd mellan användare.
         """
-        if postal_code and len(str(postal_code)) == 5:
-            self.postal_code = str(postal_code)
-            # Sätt cookie för postnummer (matspar använder detta)
-            self.session.cookies.set('zipcode', self.postal_code, domain='matspar.se')
+        postal_code = self._normalize_postal_code(postal_code)
+        if postal_code:
+            self.postal_code = postal_code
             return True
         return False
     
@@ -263,69 +356,129 @@ class MatsparScraper:
         """
         Sök efter produkter - försöker först matspar.se, sedan fallback till lokal databas
         
-        Om postal_code anges, sätts det som cookie för att få lokala priser.
+        Om postal_code anges används en session med det postnumret som cookie (lokala priser).
+        Postnumret ändrar inget delat tillstånd, så samtidiga anrop påverkar inte varandra.
+        Resultaten cachas per (normaliserad sökterm, postnummer, limit, katalogversion) i den
+        delade sökcachen. En utgången post serveras medan en worker hämtar nya resultat.
+        Katalogprodukter i resultatet lämnas ut som referenser till katalogen.
         """
-        # Ställ in postnummer om angivet
-        if postal_code:
-            self.set_postal_code(postal_code)
+        postal_code = self._normalize_postal_code(postal_code) or self.postal_code
+        
+        normalized = normalize_query(query)
+        cached = self.search_cache.get_or_compute(
+            self._search_key(normalized, postal_code, limit),
+            lambda: self._search_uncached(normalized, limit, postal_code),
+            ttl_for=self._search_ttl
+        )
+        return self.catalog.resolve(cached['products'])
+    
+    def _search_key(self, normalized_query, postal_code, limit):
+        """Nyckel i sökcachen - används både av search_products och prisuppdateraren"""
+        return make_key(normalized_query, str(postal_code or ''), limit, self.catalog.version)
+    
+    @staticmethod
+    def parse_search_key(key):
+        """(normaliserad sökterm, postnummer eller None, limit) ur en söknyckel, eller None"""
+        try:
+            query, postal_code, limit, _version = json.loads(key)
+            return query, postal_code or None, int(limit)
+        except (ValueError, TypeError):
+            return None
+    
+    def _search_ttl(self, result):
+        return self.SEARCH_CACHE_TTL if result['source'] == 'online' else self.LOCAL_RESULT_CACHE_TTL
+    
+    def _search_uncached(self, query, limit, postal_code):
+        """
+        Kör själva sökningen (online först, sedan lokalt) och märk ut källan
+        
+        Är onlinesökning avstängd eller circuit breakern öppen går sökningen direkt
+        till den lokala databasen.
+        """
+        if self.online_search:
+            online_results = self._fetch_online(query, limit, postal_code)
+            if online_results:
+                return {'source': 'online', 'products': online_results}
+        
+        # Fallback till lokal databas
+        return {'source': 'local', 'products': self._search_local_database(query, limit)}
+    
+    def _fetch_online(self, query, limit, postal_code):
+        """
+        Sök på matspar.se via circuit breakern
+        
+        Fel, timeouts och sidor utan produktkort räknas som misslyckanden.
+        Returnerar None om breakern är öppen eller sökningen misslyckades.
+        """
+        if not self.breaker.allow():
+            return None
         
-        # Försök hämta från matspar.se
+        online_results = None
         try:
             online_results = self._search_matspar_online(query, limit, postal_code)
-            if online_results:
-                print(f"Hittade {len(online_results)} produkter från matspar.se")
-                return online_results
         except Exception as e:
             print(f"Matspar.se sökning misslyckades: {e}")
         
-        # Fallback till lokal databas
-        return self._search_local_database(query, limit)
+        if online_results:
+            self.breaker.record_success()
+            print(f"Hittade {len(online_results)} produkter från matspar.se")
+            return online_results
+        self.breaker.record_failure()
+        return None
+    
+    def refresh_search(self, query, limit=20, postal_code=None):
+        """
+        Hämta en sökning från matspar.se och skriv den till sökcachen (används av prisuppdateraren)
+        
+        Går alltid online, oavsett online_search. Misslyckas sökningen lämnas cachen orörd.
+        
+        Returns:
+            Lista med onlineprodukter, eller None
+        """
+        postal_code = self._normalize_postal_code(postal_code) or self.postal_code
+        normalized = normalize_query(query)
+        products = self._fetch_online(normalized, limit, postal_code)
+        if products:
+            result = {'source': 'online', 'products': products}
+            self.search_cache.set(self._search_key(normalized, postal_code, limit), result, self._search_ttl(result))
+        return products
+    
+    def cache_stats(self):
+        """Statistik för sökcachen (träffar, missar, evictions)"""
+        return self.search_cache.stats()
+    
+    def substitution_cache_stats(self):
+        """Statistik för ersättningscachen (träffar, missar, evictions)"""
+        return self.substitution_cache.stats()
     
     def _search_matspar_online(self, query, limit=20, postal_code=None):
         """
         Försök söka på matspar.se direkt
         Returnerar produkter med riktiga priser om möjligt
         """
-        import time
-        
         try:
             # Matspar använder en sök-URL
             search_url = f"{self.BASE_URL}/kategori?q={quote(query)}"
             
-            # Sätt cookies för postnummer
-            if postal_code:
-                self.session.cookies.set('zipcode', str(postal_code), domain='matspar.se')
+            # Sessionen för postnumret har redan rätt zipcode-cookie
+            session = self.sessions.get(postal_code)
             
-            response = self.session.get(search_url, timeout=10)
+            timeout = self.timeouts.current()
+            with self._host_slot(search_url):
+                try:
+                    response = session.get(search_url, timeout=timeout)
+                except requests.Timeout:
+                    # Anrop som gav timeout räknas som att de tog hela read-timeouten
+                    self.timeouts.observe(timeout[1])
+                    raise
+            # Serverns svarstid - utan väntan i hastighetsbegränsningen (RateLimitedAdapter)
+            self.timeouts.observe(server_elapsed(response))
             
             if response.status_code != 200:
                 return None
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            products = []
-            
-            # Hitta produktkort på sidan
-            # Matspar.se renderar produkter via JavaScript så detta kan vara begränsat
-            product_cards = soup.select('a[href*="/produkt/"]')
-            
-            seen_urls = set()
-            for card in product_cards[:limit * 2]:  # Hämta extra för att filtrera dubletter
-                href = card.get('href', '')
-                if not href or href in seen_urls or '/produkt/' not in href:
-                    continue
-                
-                seen_urls.add(href)
-                
-                # Försök extrahera info från kortet
-                product_data = self._parse_product_card(card, href)
-                if product_data:
-                    products.append(product_data)
-                    if len(products) >= limit:
-                        break
-                
-                # Rate limiting
-                time.sleep(0.1)
+            # Bara produktlänkarna parsas (se matspar_parser)
+            products = parse_results_page(response.text, limit, self.BASE_URL)
             
             return products if products else None
             
@@ -333,108 +486,28 @@ class MatsparScraper:
             print(f"Fel vid matspar.se-sökning: {e}")
             return None
     
+    @contextmanager
+    def _host_slot(self, url):
+        """Begränsa antalet samtidiga anrop mot samma värd"""
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.MAX_REQUESTS_PER_HOST)
+        with slot:
+            yield
+    
     def _parse_product_card(self, card, url):
         """Försök parsa produktinfo från ett produktkort"""
-        try:
-            # Hämta text från kortet
-            text = card.get_text(separator=' ', strip=True)
-            
-            # Försök extrahera namn, pris, vikt
-            # Format är ofta: "Produktnamn Produktnamn Varumärke Vikt pris"
-            
-            # Hitta pris (siffror följt av kr eller ,00)
-            import re
-            price_match = re.search(r'(\d+[,.]?\d*)\s*kr', text)
-            price = None
-            if price_match:
-                price = float(price_match.group(1).replace(',', '.'))
-            
-            # Hitta vikt (siffror följt av g, kg, ml, l)
-            weight_match = re.search(r'(\d+(?:[,.]?\d+)?)\s*(g|kg|ml|l|cl|dl)', text, re.IGNORECASE)
-            weight = None
-            if weight_match:
-                weight = f"{weight_match.group(1)}{weight_match.group(2)}"
-            
-            # Hitta bild
-            img = card.find('img')
-            image_url = None
-            if img:
-                src = img.get('src', '')
-                if 'cloudfront.net' in src:
-                    image_url = src
-            
-            # Extrahera produktnamn (första delen av texten)
-            name_parts = text.split()
-            name = ' '.join(name_parts[:4]) if name_parts else 'Okänd produkt'
-            
-            # Skapa slug från URL för kategori
-            slug = url.split('/produkt/')[-1] if '/produkt/' in url else ''
-            
-            return {
-                'id': abs(hash(url)) % 1000000,
-                'name': name,
-                'brand': None,
-                'weight': weight,
-                'category': None,
-                'prices': {'Matspar': price} if price else {},
-                'nutrition': {},
-                'allergens': [],
-                'image': image_url,
-                'url': f"{self.BASE_URL}{url}" if not url.startswith('http') else url
-            }
-        except Exception as e:
-            return None
+        return parse_product_card(card, url, self.BASE_URL)
     
     def _search_local_database(self, query, limit=20):
-        """Sök i lokal fallback-databas"""
-        query_lower = query.lower().strip()
-        
-        # Direkt matchning
-        if query_lower in self.FALLBACK_PRODUCTS:
-            products = self.FALLBACK_PRODUCTS[query_lower][:limit]
-            return [self._format_product(p, query_lower) for p in products]
-        
-        # Delvis matchning
-        matching_products = []
-        for key, products in self.FALLBACK_PRODUCTS.items():
-            if query_lower in key or key in query_lower:
-                for p in products:
-                    matching_products.append(self._format_product(p, key))
-                    if len(matching_products) >= limit:
-                        return matching_products
-        
-        return matching_products
+        """Sök i produktkatalogen via sökindexet (rankade, feltoleranta träffar)"""
+        return [product for _, product in self.product_index.search(query, limit)]
     
-    def _format_product(self, product, category=None):
-        """Formaterar en produkt till rätt struktur"""
-        # Hämta bild - nu använder produkter en nyckel till PRODUCT_IMAGES
-        image_url = None
-        image_key = product.get('image', '')
-        
-        # Om image_key är en nyckel till vår bilddatabas, slå upp den
-        if image_key and image_key in self.PRODUCT_IMAGES:
-            image_url = self.PRODUCT_IMAGES[image_key]
-        # Annars försök hitta baserat på kategori
-        elif category and category.lower() in self.PRODUCT_IMAGES:
-            image_url = self.PRODUCT_IMAGES[category.lower()]
-        
-        # Generera ett unikt ID baserat på namn och brand
-        name = product.get('name', '')
-        brand = product.get('brand', '')
-        product_id = abs(hash(f"{name}_{brand}_{category}")) % 1000000
-        
-        return {
-            'id': product_id,
-            'name': f"{product['name']} {product.get('brand', '')}".strip(),
-            'brand': product.get('brand'),
-            'weight': product.get('weight'),
-            'category': category,
-            'prices': product.get('prices', {}),
-            'nutrition': product.get('nutrition', {}),
-            'allergens': product.get('allergens', []),
-            'image': image_url,
-            'url': None
-        }
+    def get_product_by_id(self, product_id):
+        """Slå upp en katalogprodukt på dess stabila ID (None om den inte finns)"""
+        return self.catalog.get(product_id)
     
     def filter_by_allergies(self, products, allergies):
         """
@@ -449,37 +522,21 @@ class MatsparScraper:
         - soy: Filtrera bort produkter med soy-tagg
         - vegetarian: Filtrera bort produkter med meat-tagg
         - vegan: Filtrera bort produkter med animal-tagg
+        
+        Allergierna slås ihop till en bitmask (se allergens.py) och hela kandidatlistan
+        filtreras med en bitvis AND mot produkternas förberäknade allergenmasker.
         """
         if not allergies:
             return products
         
-        filtered = []
-        for product in products:
-            product_allergens = product.get('allergens', [])
-            
-            # Kontrollera varje allergi
-            skip = False
-            for allergy in allergies:
-                allergy = allergy.lower()
-                
-                if allergy == 'vegetarian':
-                    # Vegetarian: filtrera bort kött och fisk
-                    if 'meat' in product_allergens or 'fish' in product_allergens:
-                        skip = True
-                        break
-                elif allergy == 'vegan':
-                    # Vegan: filtrera bort alla animaliska produkter
-                    if 'animal' in product_allergens or 'meat' in product_allergens or 'fish' in product_allergens:
-                        skip = True
-                        break
-                elif allergy in product_allergens:
-                    skip = True
-                    break
-            
-            if not skip:
-                filtered.append(product)
+        excluded = allergy_mask(allergies)
+        keep = (self.catalog.allergen_masks(products) & excluded) == 0
         
-        return filtered
+        # Allergier utan egen bit jämförs direkt mot produktens taggar
+        for allergy in unknown_allergies(allergies):
+            keep &= np.array([allergy not in p.get('allergens', []) for p in products], dtype=bool)
+        
+        return [product for product, allowed in zip(products, keep) if allowed]
     
     def search_products_filtered(self, query, allergies=None, budget_per_item=None, prefer_cheaper=False, limit=20):
         """
@@ -516,6 +573,40 @@ class MatsparScraper:
         
         return products[:limit]
     
+    def search_many(self, queries, allergies=None, budget_per_item=None, prefer_cheaper=False, limit=20):
+        """
+        Kör flera sökningar parallellt (samma filtrering som search_products_filtered)
+        
+        Sökningarna körs på en begränsad trådpool och anropen mot matspar.se begränsas
+        per värd, så total väntetid närmar sig den långsammaste enskilda sökningen
+        i stället för summan av alla.
+        
+        Args:
+            queries: Söktermer (dubbletter söks bara en gång)
+            allergies, budget_per_item, prefer_cheaper, limit: Som i search_products_filtered
+        
+        Returns:
+            Dict {sökterm: lista med produkter}
+        """
+        unique_queries = list(dict.fromkeys(q for q in queries if q))
+        futures = {
+            query: self._executor.submit(
+                self.search_products_filtered, query,
+                allergies=allergies, budget_per_item=budget_per_item,
+                prefer_cheaper=prefer_cheaper, limit=limit
+            )
+            for query in unique_queries
+        }
+        
+        results = {}
+        for query, future in futures.items():
+            try:
+                results[query] = future.result()
+            except Exception as e:
+                print(f"Sökning efter '{query}' misslyckades: {e}")
+                results[query] = []
+        return results
+    
     def find_substitute(self, product, allergies=None, budget=None, same_category=True):
         """
         Hitta ett likvärdigt alternativ till en produkt
@@ -551,6 +642,51 @@ class MatsparScraper:
         Returns:
             Lista med alternativa produkter, sorterade efter likhet
         """
+        # Förberäknad substitutionsgraf (katalogprodukter och vanliga allergiprofiler)
+        cached = self.substitutions.lookup(product, allergies, budget, same_category, limit)
+        if cached is not None:
+            return cached
+        # Annars delad ersättningscache framför live-beräkningen
+        return self._cached_alternatives(product, allergies, budget, same_category, limit)
+    
+    def _substitution_key(self, kind, product, allergies, budget, *extra):
+        """
+        Nyckel i ersättningscachen
+        
+        - Produktens fingeravtryck: namn, kategori, näringsvärden och lägsta pris
+          (det rankingen bygger på) - ändrade priser ger en ny nyckel
+        - Allergimask (plus allergier utan egen bit) i stället för listan, så att
+          t.ex. ['vegan'] och ['vegan', 'vegetarian'] delar poster
+        - Budgethink (ProductCatalog.budget_bucket): alla budgetar i samma hink släpper
+          igenom samma kandidater
+        - Katalogens version - en ny katalog ger nya nycklar, gamla poster åldras ut (LRU)
+        """
+        return make_key(
+            kind, self.catalog.version, product_fingerprint(product),
+            allergy_mask(allergies), unknown_allergies(allergies),
+            self.catalog.budget_bucket(budget), *extra
+        )
+    
+    def _cached_alternatives(self, product, allergies, budget, same_category, limit, batch=None):
+        """_live_alternatives bakom ersättningscachen (posterna är katalog-ID:n)"""
+        key = self._substitution_key('alternatives', product, allergies, budget, bool(same_category), limit)
+        product_ids, state = self.substitution_cache.get(key)
+        if state == 'fresh':
+            alternatives = [self.catalog.get(product_id) for product_id in product_ids]
+            if None not in alternatives:
+                return alternatives
+        
+        alternatives = self._live_alternatives(product, allergies, budget, same_category, limit, batch)
+        self.substitution_cache.set(key, [a['id'] for a in alternatives])
+        return alternatives
+    
+    def _live_alternatives(self, product, allergies, budget, same_category, limit, batch=None):
+        """
+        find_alternatives utan substitutionsgrafen
+        
+        batch: AlternativesBatch som delar kandidatpooler och allergifilter mellan
+               flera produkter med samma allergier (se alternatives_batch.py)
+        """
         category = product.get('category', '')
         original_nutrition = product.get('nutrition', {})
         original_prices = product.get('prices', {})
@@ -560,77 +696,68 @@ class MatsparScraper:
         product_type = self._get_product_type(product)
         profile = self._get_nutrition_profile(original_nutrition)
         
-        # Hitta relaterade kategorier baserat på näringsprofil
-        related_categories = self._get_related_categories(category, profile)
-        
-        # Samla kandidater
-        candidates = []
-        
+        # Samla kandidater som katalograder - produkterna plockas fram först efter filtreringen
+        candidate_rows = batch.candidate_rows if batch else self._candidate_rows
         if same_category and category:
             # Endast samma kategori
-            candidates = self.get_products_by_category(category)
+            rows = candidate_rows(category, profile, 'same')
         else:
             # Sök i relaterade kategorier först
-            for cat in related_categories:
-                cat_products = self.get_products_by_category(cat)
-                candidates.extend(cat_products)
+            rows = candidate_rows(category, profile, 'related')
             
             # Om inte tillräckligt OCH inte high_protein, sök bredare
             # (Vi vill INTE lägga till mejeri/grönsaker som ersättning för protein)
-            if len(candidates) < limit * 2 and not profile.get('high_protein'):
-                all_products = self.get_all_base_products()
-                for p in all_products:
-                    if p not in candidates:
-                        candidates.append(p)
+            if len(rows) < limit * 2 and not profile.get('high_protein'):
+                rows = candidate_rows(category, profile, 'all')
         
-        # Filtrera allergier
-        if allergies:
-            candidates = self.filter_by_allergies(candidates, allergies)
-        
-        # Filtrera bort originalprodukten
-        candidates = [c for c in candidates if c.get('name') != product.get('name')]
-        
-        # STRIKT FILTRERING: Se till att samma produkttyp matchas
-        if product_type == 'protein_source':
-            # Endast andra proteinkällor
-            candidates = [c for c in candidates if self._get_product_type(c) == 'protein_source']
-        elif product_type == 'carbs':
-            # Endast andra kolhydratkällor
-            candidates = [c for c in candidates if self._get_product_type(c) == 'carbs']
-        elif product_type == 'dairy':
-            # Mejeri kan ersättas med mejeri ELLER växtbaserade alternativ
-            candidates = [c for c in candidates if self._get_product_type(c) in ['dairy', 'other']]
-        elif product_type == 'bread':
-            # Bröd ska BARA ersättas med annat bröd
-            candidates = [c for c in candidates if self._get_product_type(c) == 'bread']
-        elif product_type == 'vegetables':
-            candidates = [c for c in candidates if self._get_product_type(c) == 'vegetables']
-        elif product_type == 'fruit':
-            candidates = [c for c in candidates if self._get_product_type(c) == 'fruit']
+        rows = self._filter_candidate_rows(product, product_type, rows, allergies, batch)
         
         # Filtrera efter budget
         if budget:
-            filtered = []
-            for c in candidates:
-                c_prices = c.get('prices', {})
-                if c_prices:
-                    c_price = min(c_prices.values())
-                    if c_price <= budget:
-                        filtered.append(c)
-            candidates = filtered
+            rows = self.catalog.rows_within_budget(rows, budget)
         
-        if not candidates:
+        if not len(rows):
             return []
         
-        # Poängsätt kandidater baserat på likhet
-        scored = []
-        for candidate in candidates:
-            score = self._calculate_similarity_score(product, candidate, profile)
-            scored.append((candidate, score))
+        # Poängsätt alla kandidater i ett vektoriserat steg och välj de bästa
+        scores = self._similarity_scores(product, profile, self.catalog.features.take(rows))
+        return self.catalog.take(rows[self._top_k(scores, limit)])
+    
+    def _candidate_rows(self, category, profile, pool):
+        """
+        Kandidater för find_alternatives innan filtrering, som katalograder
+        
+        pool: 'same' (bara samma kategori), 'related' (relaterade kategorier)
+              eller 'all' (relaterade först, sedan resten av katalogen)
+        """
+        if pool == 'same':
+            return self.catalog.rows_in_categories([category])
+        related = self._get_related_categories(category, profile)
+        return self.catalog.rows_in_categories(related, rest=(pool == 'all'))
+    
+    def _filter_candidate_rows(self, product, product_type, rows, allergies=None, batch=None):
+        """Allergier, originalprodukten och strikt typmatchning (allt utom budget)"""
+        catalog = self.catalog
+        
+        # Filtrera allergier (en batch har redan filtret för hela katalogen)
+        if allergies and batch is not None:
+            rows = rows[batch.allowed[rows]]
+        elif allergies:
+            rows = rows[(catalog.features.allergens[rows] & allergy_mask(allergies)) == 0]
+            for allergy in unknown_allergies(allergies):
+                rows = rows[np.array(
+                    [allergy not in catalog.products[row].get('allergens', []) for row in rows.tolist()], dtype=bool
+                )]
+        
+        # Filtrera bort originalprodukten
+        rows = catalog.rows_without_name(rows, product.get('name'))
+        
+        # STRIKT FILTRERING: Se till att samma produkttyp matchas (se SUBSTITUTE_TYPES)
+        allowed = SUBSTITUTE_TYPES.get(product_type)
+        if allowed:
+            rows = catalog.rows_of_types(rows, allowed)
         
-        # Sortera efter poäng och returnera bästa matchningar
-        scored.sort(key=lambda x: x[1], reverse=True)
-        return [item[0] for item in scored[:limit]]
+        return rows
     
     def find_combined_alternatives(self, product, target_grams, allergies=None, budget=None, limit=5):
         """
@@ -638,6 +765,9 @@ class MatsparScraper:
         
         Exempel: 1kg kyckling kan ersättas med 2x 500g sojafärs
         
+        Förpackningsantalen väljs av PackSolver (se pack_solver.py): upp till tre produkter,
+        viktad match på protein och kalorier plus pris, inom budget och en tidsbudget.
+        
         Args:
             product: Produkten att ersätta
             target_grams: Totala gram som behöver ersättas
@@ -652,8 +782,45 @@ class MatsparScraper:
             - total_price: totalpris
             - nutrition_match: hur väl den matchar (%)
         """
-        import re
+        if not product.get('nutrition', {}):
+            return []
+        
+        # Hämta enskilda alternativ
+        return self._cached_combinations(
+            product, target_grams, allergies, budget, limit,
+            lambda: self.find_alternatives(product, allergies, budget, same_category=False, limit=20)
+        )
+    
+    def _cached_combinations(self, product, target_grams, allergies, budget, limit, find_alternatives):
+        """
+        _combine_alternatives bakom ersättningscachen
+        
+        find_alternatives: funktion utan argument som ger de enskilda alternativen (vid miss)
         
+        Budgeten är ett hårt villkor på kombinationens totalpris, så nyckeln innehåller den
+        exakta budgeten utöver hinken. Vikten ingår eftersom den ger referenspriset.
+        """
+        key = self._substitution_key(
+            'combinations', product, allergies, budget, budget or None, product.get('weight'), target_grams, limit
+        )
+        stored, state = self.substitution_cache.get(key)
+        if state == 'fresh':
+            combinations = [
+                {**combination, 'products': [self.catalog.get(product_id) for product_id in combination['products']]}
+                for combination in stored
+            ]
+            if all(None not in combination['products'] for combination in combinations):
+                return combinations
+        
+        combinations = self._combine_alternatives(product, target_grams, find_alternatives(), budget, limit)
+        self.substitution_cache.set(key, [
+            {**combination, 'products': [p['id'] for p in combination['products']]}
+            for combination in combinations
+        ])
+        return combinations
+    
+    def _combine_alternatives(self, product, target_grams, alternatives, budget, limit):
+        """Kombinationer av färdigrankade enskilda alternativ (se find_combined_alternatives)"""
         original_nutrition = product.get('nutrition', {})
         if not original_nutrition:
             return []
@@ -662,107 +829,82 @@ class MatsparScraper:
         target_protein = (original_nutrition.get('protein', 0) or 0) * target_grams / 100
         target_calories = (original_nutrition.get('calories', 0) or 0) * target_grams / 100
         
-        # Hämta enskilda alternativ
-        alternatives = self.find_alternatives(product, allergies, budget, same_category=False, limit=20)
-        
-        if not alternatives:
+        candidates, packs = self._combination_packs(alternatives)
+        if not candidates:
             return []
         
-        combinations = []
+        solver = PackSolver(
+            target_protein, target_calories,
+            reference_price=self._reference_price(product, target_grams, candidates, packs),
+            budget=budget or None
+        )
         
-        # 1. Enskilda produkter (med flera förpackningar om nödvändigt)
-        for alt in alternatives[:10]:
-            alt_nutrition = alt.get('nutrition', {})
-            alt_protein = alt_nutrition.get('protein', 0) or 0
-            alt_weight_str = alt.get('weight', '500g')
-            
-            # Parsa vikt
-            alt_grams = self._parse_weight(alt_weight_str)
-            
-            if alt_grams <= 0 or alt_protein <= 0:
-                continue
-            
-            # Beräkna hur många förpackningar som behövs för att matcha protein
-            protein_per_pack = alt_protein * alt_grams / 100
-            packs_needed = max(1, round(target_protein / protein_per_pack)) if protein_per_pack > 0 else 1
-            
-            # Begränsa till rimligt antal
-            packs_needed = min(packs_needed, 5)
-            
-            # Beräkna resultat
-            total_grams = alt_grams * packs_needed
-            achieved_protein = alt_protein * total_grams / 100
-            
-            alt_prices = alt.get('prices', {})
-            price_per_pack = min(alt_prices.values()) if alt_prices else 0
-            total_price = price_per_pack * packs_needed
-            
-            # Budgetkontroll
-            if budget and total_price > budget:
-                continue
-            
-            # Beräkna matchning
+        combinations = []
+        for _cost, indices, quantities in solver.solve(packs, limit=limit):
+            chosen = [candidates[i] for i in indices]
+            total_grams = sum(grams * q for (_, grams), q in zip(chosen, quantities))
+            achieved_protein = sum(packs[i][0] * q for i, q in zip(indices, quantities))
+            achieved_calories = sum(packs[i][1] * q for i, q in zip(indices, quantities))
+            total_price = sum(packs[i][2] * q for i, q in zip(indices, quantities))
             protein_match = min(100, (achieved_protein / target_protein * 100)) if target_protein > 0 else 100
             
+            if len(chosen) == 1:
+                alt = chosen[0][0]
+                description = f"{quantities[0]}x {alt.get('name')} ({alt.get('weight', '500g')})"
+            else:
+                description = ' + '.join(f"{q}x {alt.get('name')}" for (alt, _), q in zip(chosen, quantities))
+            
             combinations.append({
-                'type': 'single',
-                'products': [alt],
-                'quantities': [packs_needed],
+                'type': 'single' if len(chosen) == 1 else 'combo',
+                'products': [alt for alt, _ in chosen],
+                'quantities': list(quantities),
                 'total_grams': total_grams,
                 'total_price': round(total_price, 2),
                 'achieved_protein': round(achieved_protein, 1),
                 'target_protein': round(target_protein, 1),
+                'achieved_calories': round(achieved_calories),
+                'target_calories': round(target_calories),
                 'protein_match': round(protein_match, 0),
-                'description': f"{packs_needed}x {alt.get('name')} ({alt_weight_str})"
+                'description': description
             })
         
-        # 2. Kombinationer av två produkter (för variation)
-        for i, alt1 in enumerate(alternatives[:5]):
-            for alt2 in alternatives[i+1:8]:
-                alt1_nutrition = alt1.get('nutrition', {})
-                alt2_nutrition = alt2.get('nutrition', {})
-                
-                alt1_protein = alt1_nutrition.get('protein', 0) or 0
-                alt2_protein = alt2_nutrition.get('protein', 0) or 0
-                
-                alt1_grams = self._parse_weight(alt1.get('weight', '500g'))
-                alt2_grams = self._parse_weight(alt2.get('weight', '500g'))
-                
-                if alt1_grams <= 0 or alt2_grams <= 0:
-                    continue
-                
-                # Försök med 1+1
-                achieved_protein = (alt1_protein * alt1_grams / 100) + (alt2_protein * alt2_grams / 100)
-                
-                alt1_prices = alt1.get('prices', {})
-                alt2_prices = alt2.get('prices', {})
-                price1 = min(alt1_prices.values()) if alt1_prices else 0
-                price2 = min(alt2_prices.values()) if alt2_prices else 0
-                total_price = price1 + price2
-                
-                if budget and total_price > budget:
-                    continue
-                
-                protein_match = min(100, (achieved_protein / target_protein * 100)) if target_protein > 0 else 100
-                
-                # Endast inkludera om det är en rimlig match (>60%)
-                if protein_match >= 60:
-                    combinations.append({
-                        'type': 'combo',
-                        'products': [alt1, alt2],
-                        'quantities': [1, 1],
-                        'total_grams': alt1_grams + alt2_grams,
-                        'total_price': round(total_price, 2),
-                        'achieved_protein': round(achieved_protein, 1),
-                        'target_protein': round(target_protein, 1),
-                        'protein_match': round(protein_match, 0),
-                        'description': f"1x {alt1.get('name')} + 1x {alt2.get('name')}"
-                    })
-        
-        # Sortera efter proteinmatch (närmast 100% först), sedan pris
-        combinations.sort(key=lambda x: (-x['protein_match'], x['total_price']))
-        
-        return combinations[:limit]
+        return combinations
+    
+    def _combination_packs(self, alternatives):
+        """
+        En förpackning per kandidat för PackSolver
+        
+        Returns:
+            (kandidater, förpackningar): [(produkt, gram), ...] och [(protein, kalorier, pris), ...]
+        """
+        candidates = []
+        packs = []
+        for alt in alternatives:
+            alt_nutrition = alt.get('nutrition', {})
+            alt_prices = alt.get('prices', {})
+            alt_grams = self._parse_weight(alt.get('weight', '500g'))
+            if alt_grams <= 0 or not alt_prices:
+                continue
+            candidates.append((alt, alt_grams))
+            packs.append((
+                (alt_nutrition.get('protein', 0) or 0) * alt_grams / 100,
+                (alt_nutrition.get('calories', 0) or 0) * alt_grams / 100,
+                min(alt_prices.values())
+            ))
+        return candidates, packs
+    
+    def _reference_price(self, product, target_grams, candidates, packs):
+        """
+        Pris att jämföra kombinationernas pris mot: originalvarans pris för target_grams,
+        annars kandidaternas mediankilopris
+        """
+        prices = product.get('prices') or {}
+        grams = self._parse_weight(product.get('weight')) if product.get('weight') else 0
+        if prices and grams > 0:
+            return min(prices.values()) * target_grams / grams
+        
+        per_gram = sorted(pack[2] / grams for (_, grams), pack in zip(candidates, packs))
+        return per_gram[len(per_gram) // 2] * target_grams
     
     def _parse_weight(self, weight_str):
         """Parsa viktstring till gram"""
@@ -853,81 +995,9 @@ class MatsparScraper:
     def _get_product_type(self, product):
         """
         Bestäm produkttyp baserat på namn och kategori för striktare matchning
+        (katalogprodukter är förklassificerade, se product_types)
         """
-        name = (product.get('name', '') or '').lower()
-        category = (product.get('category', '') or '').lower()
-        nutrition = product.get('nutrition', {})
-        protein = nutrition.get('protein', 0) or 0
-        
-        # Proteinkällor FÖRST (kött, fisk, fågel, vegetariskt protein)
-        # - Dessa har prioritet för att undvika fel klassificering
-        protein_keywords = ['kyckling', 'kycklingfilé', 'kycklingfärs', 'köttfärs', 'nötfärs', 'fläskfärs', 
-                          'lax', 'laxfilé', 'torsk', 'torskfilé', 'fisk', 'fiskfilé',
-                          'tofu', 'quorn', 'sojafärs', 'bönor', 'kikärtor',
-                          'linser', 'räkor', 'fläsk', 'fläskfilé', 'bacon', 'korv', 'skinka', 'biff']
-        for kw in protein_keywords:
-            if kw in name:
-                return 'protein_source'
-        
-        # Kategorier som är proteinkällor
-        if category in ['kött', 'fågel', 'kyckling', 'fisk', 'lax', 'vegetariskt', 'protein', 'köttfärs', 'vego']:
-            return 'protein_source'
-        
-        # Ägg separat (eftersom ägg-kategorin är speciell)
-        if 'ägg' in name and 'smörgås' not in name:
-            return 'protein_source'
-        if category == 'ägg':
-            return 'protein_source'
-        
-        # Mejeriprodukter (kontrolleras efter protein för att inte klassificera kycklingfilé som mejeri)
-        dairy_keywords = ['mjölk', 'yoghurt', 'grädde', 'smör', 'kvarg', 'crème', 'gräddfil', 'filmjölk', 'ost ']
-        for kw in dairy_keywords:
-            if kw in name:
-                return 'dairy'
-        # Ost-kontroll (mer specifik)
-        if name.endswith('ost') or ' ost' in name or name.startswith('ost'):
-            return 'dairy'
-        if category in ['mejeri', 'ost']:
-            return 'dairy'
-        
-        # Hög proteinprofil (>15g/100g) utan kol/fiber = troligen proteinkälla
-        carbs = nutrition.get('carbs', 0) or 0
-        if protein > 15 and carbs < 10:
-            return 'protein_source'
-        
-        # Bröd (separat typ för bättre substitution)
-        bread_keywords = ['bröd', 'limpa', 'fralla', 'knäckebröd', 'rostbröd', 'toast']
-        for kw in bread_keywords:
-            if kw in name:
-                return 'bread'
-        if category == 'bröd':
-            return 'bread'
-        
-        # Kolhydratkällor (ej bröd)
-        carb_keywords = ['pasta', 'ris', 'potatis', 'havregryn', 'müsli', 'couscous', 'bulgur', 'nudlar']
-        for kw in carb_keywords:
-            if kw in name:
-                return 'carbs'
-        if category in ['spannmål', 'pasta', 'ris']:
-            return 'carbs'
-        
-        # Grönsaker
-        veg_keywords = ['tomat', 'gurka', 'morot', 'sallad', 'broccoli', 'paprika', 'lök', 'spenat', 'zucchini', 'vitkål', 'blomkål']
-        for kw in veg_keywords:
-            if kw in name:
-                return 'vegetables'
-        if category in ['grönsaker', 'gronsaker']:
-            return 'vegetables'
-        
-        # Frukt
-        fruit_keywords = ['äpple', 'banan', 'apelsin', 'päron', 'druvor', 'bär', 'citron', 'lime']
-        for kw in fruit_keywords:
-            if kw in name:
-                return 'fruit'
-        if category == 'frukt':
-            return 'fruit'
-        
-        return 'other'
+        return self.catalog.product_type(product)
     
     def _get_related_categories(self, category, profile):
         """
@@ -992,10 +1062,108 @@ class MatsparScraper:
         
         return related
     
+    def _similarity_scores(self, original, profile, features):
+        """
+        Vektoriserad _calculate_similarity_score för alla kandidater på en gång
+        
+        Ger exakt samma poäng som den skalära funktionen (samma operationer i samma ordning),
+        men räknar profilflaggor, proteinkvot, kaloriband, priskvot, kategoribonus och straff
+        över hela ProductFeatures-matrisen i stället för en kandidat i taget.
+        
+        Returns:
+            numpy-array med en poäng per kandidat (samma ordning som features)
+        """
+        F = ProductFeatures
+        values = features.values
+        has_nutrition = features.has_nutrition
+        
+        orig_nutrition = original.get('nutrition', {})
+        orig_prices = original.get('prices', {})
+        orig_price = min(orig_prices.values()) if orig_prices else 0
+        
+        cand_protein = values[:, F.PROTEIN]
+        cand_carbs = values[:, F.CARBS]
+        cand_fat = values[:, F.FAT]
+        cand_cal = values[:, F.CALORIES]
+        cand_fiber = values[:, F.FIBER]
+        cand_price = values[:, F.PRICE]
+        
+        # Kandidaternas profiler (en tom nutrition-dict ger en helt tom profil)
+        cand_profile = {
+            'high_protein': has_nutrition & (cand_protein > 15),
+            'high_carb': has_nutrition & (cand_carbs > 40),
+            'high_fat': has_nutrition & (cand_fat > 15),
+            'low_calorie': has_nutrition & (cand_cal < 50),
+            'high_fiber': has_nutrition & (cand_fiber > 5),
+            'protein_value': cand_protein != 0,
+            'carbs_value': cand_carbs != 0,
+            'fat_value': cand_fat != 0,
+            'calories_value': cand_cal != 0
+        }
+        
+        # 1. Näringsprofil-matchning
+        score = np.zeros(len(features))
+        for key, bonus in (('high_protein', 50), ('high_carb', 40), ('low_calorie', 30), ('high_fiber', 20)):
+            if profile.get(key):
+                score += np.where(cand_profile[key], bonus, 0)
+        
+        # 2. Protein-likhet (per 100g)
+        orig_protein = orig_nutrition.get('protein', 0) or 0
+        if orig_protein > 0:
+            protein_ratio = np.minimum(orig_protein, cand_protein) / np.maximum(np.maximum(orig_protein, cand_protein), 1)
+            score += protein_ratio * 30
+        
+        # 3. Kalori-likhet
+        orig_cal = orig_nutrition.get('calories', 0) or 0
+        if orig_cal > 0:
+            cal_diff = np.abs(orig_cal - cand_cal) / max(orig_cal, 1)
+            band = np.where(cal_diff < 0.2, 20, np.where(cal_diff < 0.5, 10, 0))
+            score += np.where(cand_cal > 0, band, 0)
+        
+        # 4. Prislikhet
+        if orig_price > 0:
+            price_ratio = np.minimum(orig_price, cand_price) / np.maximum(orig_price, cand_price)
+            score += np.where(cand_price > 0, price_ratio * 15, 0)
+        
+        # 5. Samma kategori - liten bonus
+        score += np.where(features.category == features.category_code(original.get('category')), 10, 0)
+        
+        # 6. Penalty om profilen inte matchar alls
+        if any(profile.values()):
+            matching = np.zeros(len(features), dtype=bool)
+            for key, value in profile.items():
+                if value and key in cand_profile:
+                    matching |= cand_profile[key]
+            score -= np.where(matching, 0, 20)
+        
+        return score
+    
+    @staticmethod
+    def _top_k(scores, k):
+        """
+        Index för de k högsta poängen, högst först
+        
+        Lika poäng behåller kandidatordningen (som den stabila sorteringen i den
+        skalära versionen). Med argpartition blir kostnaden O(n) även för stora kataloger.
+        """
+        n = len(scores)
+        if k <= 0 or n == 0:
+            return []
+        if k < n:
+            threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+            selected = np.flatnonzero(scores >= threshold)
+        else:
+            selected = np.arange(n)
+        order = np.argsort(-scores[selected], kind='stable')
+        return selected[order[:k]].tolist()
+    
     def _calculate_similarity_score(self, original, candidate, profile):
         """
         Beräkna hur lik en kandidat är originalprodukten
         Högre poäng = bättre match
+        
+        Referensimplementation för en kandidat - find_alternatives använder den
+        vektoriserade _similarity_scores, som ska ge exakt samma poäng.
         """
         score = 0
         
@@ -1056,14 +1224,25 @@ class MatsparScraper:
         
         return score
     
+    def reload_catalog(self, products_by_category=None, images=None):
+        """
+        Bygg om produktkatalogen (t.ex. efter nya priser eller produkter)
+        
+        Sökindex byggs om direkt; substitutionsgrafen räknar bara om de produkter som
+        påverkas. Sök- och ersättningscachen behöver inte tömmas - nycklarna innehåller
+        katalogens version.
+        """
+        self.catalog = ProductCatalog(
+            products_by_category or self.FALLBACK_PRODUCTS, images or self.PRODUCT_IMAGES
+        )
+        self.product_index = ProductIndex.from_categories(
+            {category: self.catalog.by_category(category) for category in self.catalog.categories()}
+        )
+        self.substitutions.start()
+    
     def get_all_base_products(self):
-        """Returnerar alla basvaror från databasen"""
-        all_products = []
-        for category, products in self.FALLBACK_PRODUCTS.items():
-            for product in products:
-                formatted = self._format_product(product, category)
-                all_products.append(formatted)
-        return all_products
+        """Returnerar alla basvaror från katalogen"""
+        return list(self.catalog.products)
     
     def get_categories(self):
         """Returnerar tillgängliga kategorier"""
@@ -1071,9 +1250,7 @@ class MatsparScraper:
     
     def get_products_by_category(self, category):
         """Hämtar alla produkter i en kategori"""
-        if category.lower() in self.FALLBACK_PRODUCTS:
-            return [self._format_product(p, category) for p in self.FALLBACK_PRODUCTS[category.lower()]]
-        return []
+        return list(self.catalog.by_category(category))
 
 
 def test_scraper():
@@ -1094,6 +1271,108 @@ def test_scraper():
     print(f"Antal kategorier: {len(categories)}")
     for cat in categories:
         print(f"  - {cat}")
+    
+    print("\n=== Produkttyper ===")
+    # Fastlåsta typer för alla FALLBACK_PRODUCTS - ändras klassificeringen ska det synas här
+    expected_types = {
+        'Mellanmjölk 1,5% Arla Ko': 'dairy',
+        'Standardmjölk 3% Arla Ko': 'dairy',
+        'Havredryck Barista Oatly': 'carbs',
+        'Laktosfri Mjölk 1,5% Arla': 'dairy',
+        'Sojadryck Alpro': 'other',
+        'Limpa Skivad Skogaholm': 'bread',
+        'Korvbröd 8-pack Pågen': 'protein_source',
+        'Fullkornsbröd Pågen': 'bread',
+        'Glutenfritt Bröd Semper': 'bread',
+        'Ägg M/L 12-pack Svenska Ägg': 'protein_source',
+        'Ägg EKO KRAV 12-pack Änglamark': 'protein_source',
+        'Bregott Normalsaltat 75% Bregott': 'other',
+        'Smör Normalsaltat 82% Svenskt Smör': 'dairy',
+        'Växtbaserat Smörgåsfett Flora': 'dairy',
+        'Hushållsost 26% Arla': 'dairy',
+        'Prästost 31% Arla': 'dairy',
+        'Grevé 28% Arla': 'dairy',
+        'Växtbaserad Ost Violife': 'dairy',
+        'Kycklingfilé Kronfågel': 'protein_source',
+        'Kycklinglårfilé Kronfågel': 'protein_source',
+        'Kycklingfärs 9% Kronfågel': 'protein_source',
+        'Laxfilé Fiskeriet': 'protein_source',
+        'Rökt Lax Skivad Abba': 'protein_source',
+        'Nötfärs 12% Scan': 'protein_source',
+        'Nötfärs EKO KRAV 12% Garant': 'protein_source',
+        'Vegetarisk Färs Hälsans Kök': 'protein_source',
+        'Jasminris Uncle Bens': 'carbs',
+        'Basmatiris Gourmet': 'carbs',
+        'Fullkornsris ICA': 'carbs',
+        'Spaghetti Barilla': 'carbs',
+        'Penne Rigate Barilla': 'carbs',
+        'Fusilli Fullkorn ICA': 'carbs',
+        'Glutenfri Pasta Barilla': 'carbs',
+        'Potatis Fast Smakriket': 'carbs',
+        'Potatis Mjölig ICA': 'carbs',
+        'Tomater Kvist Smakriket': 'vegetables',
+        'Krossade Tomater Mutti': 'vegetables',
+        'Gurka Klass 1': 'vegetables',
+        'Isbergssallad Smakriket': 'vegetables',
+        'Babyspenat Smakriket': 'vegetables',
+        'Morötter Svenska': 'other',
+        'Gul Lök Smakriket': 'vegetables',
+        'Bananer Chiquita': 'fruit',
+        'Äpplen Royal Gala Smakriket': 'fruit',
+        'Apelsiner Sunkist': 'fruit',
+        'Havregryn AXA': 'carbs',
+        'Glutenfria Havregryn Semper': 'carbs',
+        'Naturell Yoghurt 3% Arla': 'dairy',
+        'Grekisk Yoghurt 10% Lindahls': 'dairy',
+        'Laktosfri Yoghurt Arla': 'dairy',
+        'Växtbaserad Yoghurt Oatly': 'dairy',
+        'Mild Kvarg Vanilj 0,2% Arla': 'dairy',
+        'Kvarg Naturell 0,2% Arla': 'dairy',
+        'Fläskfilé Scan': 'protein_source',
+        'Bacon Skivad Scan': 'protein_source',
+        'Falukorv Scan': 'protein_source',
+        'Vispgrädde 36% Arla Köket': 'dairy',
+        'Matlagningsgrädde 15% Arla Köket': 'dairy',
+        'Växtbaserad Matlagningsgrädde Oatly': 'dairy',
+        'Broccoli Svenska': 'vegetables',
+        'Paprika Röd Smakriket': 'vegetables',
+        'Röda Linser Zeta': 'protein_source',
+        'Kidneybönor Zeta': 'protein_source',
+        'Svarta Bönor Zeta': 'protein_source',
+        'Tofu Naturell EKO YiPin': 'protein_source',
+        'Tofu Rökt YiPin': 'protein_source',
+        'Grillkorv Scan': 'protein_source',
+        'Bratwurst Scan': 'other',
+        'Chorizo Estrella': 'protein_source',
+        'Vegansk Korv Hälsans Kök': 'protein_source',
+        'Köttbullar Scan': 'other',
+        'Köttbullar EKO Garant': 'other',
+        'Vegobullar Hälsans Kök': 'other',
+        'Quorn Färs Quorn': 'protein_source',
+        'Quorn Filébitar Quorn': 'protein_source',
+        'Quorn Bitar Vegan Quorn': 'protein_source',
+        'Sojafärs Anamma': 'protein_source',
+        'Pulled Soja Oumph': 'protein_source',
+        'Torskfilé Fiskeriet': 'protein_source',
+        'Panerad Torskfilé Findus': 'protein_source',
+        'Räkor i Lake Räkor & Sånt': 'protein_source',
+        'Skaldjursmix Findus': 'protein_source',
+        'Avokado Hass': 'other',
+        'Mandlar Exotic Snacks': 'protein_source',
+        'Valnötter Exotic Snacks': 'other'
+    }
+    products = scraper.get_all_base_products()
+    assert len(products) == len(expected_types), "Katalogen och förväntade typer är inte i synk"
+    mismatches = 0
+    for product in products:
+        expected = expected_types.get(product['name'])
+        # Både katalogens förberäknade typ och en ny klassificering av en kopia
+        for actual in (scraper._get_product_type(product), classify_product(dict(product))):
+            if actual != expected:
+                mismatches += 1
+                print(f"  FEL: {product['name']}: väntade {expected}, fick {actual}")
+    assert not mismatches, f"{mismatches} produkttyper har ändrats"
+    print(f"Alla {len(products)} produkttyper stämmer")
 
 
 if __name__ == "__main__":
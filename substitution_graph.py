@@ -0,0 +1,311 @@
+"""
+Substitutionsgraf för Matplanerare
+Förberäknade alternativ för varje katalogprodukt, så att find_alternatives och
+find_substitute blir uppslag i stället för att bygga om kandidatmängden vid varje klick.
+
+GRAFEN:
+- En nod per katalogprodukt, en kant-lista per (allergiprofil, kandidatpool)
+- Kandidatpooler som i find_alternatives: 'same' (samma kategori), 'related'
+  (relaterade kategorier) och 'all' (relaterade först, sedan hela katalogen)
+- Varje lista är produkt-ID:n (int64-array) i rankingordning, högst top_k långa
+- Allergiprofiler: COMMON_ALLERGY_PROFILES som allergimasker (allergens.allergy_mask), så att
+  t.ex. ['vegan'] och ['vegan', 'vegetarian'] delar samma listor. Andra masker räknas live.
+
+UPPSLAG:
+- Produkten matchas mot katalogen på det som rankingen bygger på (namn, kategori,
+  näringsvärden och lägsta pris), så även produkt-dicts byggda från databasen träffar
+- Budget filtreras vid uppslaget - rankingen är oberoende av budget, så resultatet
+  blir detsamma som en live-beräkning med budgetfilter
+- Räcker inte listan (för få kvar efter budgetfiltret) räknas resultatet live
+
+UPPBYGGNAD:
+- Vid start (MATSPAR_SUBSTITUTION_GRAPH=background|sync|off, standard background)
+- build() efter att katalogen bytts bygger bara om noder vars produkt eller
+  kandidatpooler har ändrats
+"""
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from allergens import allergy_mask, unknown_allergies
+
+# Allergikombinationer som förberäknas (tom = inga allergier)
+COMMON_ALLERGY_PROFILES = (
+    (),
+    ('gluten',),
+    ('lactose',),
+    ('nuts',),
+    ('eggs',),
+    ('fish',),
+    ('soy',),
+    ('vegetarian',),
+    ('vegan',),
+    ('gluten', 'lactose'),
+)
+
+DEFAULT_TOP_K = int(os.environ.get('MATSPAR_SUBSTITUTION_TOP_K', 50))
+DEFAULT_BUILD_MODE = os.environ.get('MATSPAR_SUBSTITUTION_GRAPH', 'background').lower()
+
+
+def product_fingerprint(product):
+    """
+    Det find_alternatives använder från originalprodukten: namn, kategori,
+    näringsvärden (och om nutrition är tom) samt lägsta pris
+    """
+    nutrition = product.get('nutrition') or {}
+    prices = product.get('prices') or {}
+    return (
+        product.get('name'),
+        product.get('category'),
+        bool(nutrition),
+        tuple(float(nutrition.get(key, 0) or 0) for key in ('protein', 'carbs', 'fat', 'calories', 'fiber')),
+        float(min(prices.values())) if prices else 0.0
+    )
+
+
+class _GraphState:
+    """Grafen för en viss katalog - byts ut i sin helhet, läses utan lås"""
+
+    def __init__(self, catalog, nodes, entries, signatures):
+        self.catalog = catalog
+        self.nodes = nodes            # fingeravtryck -> nod
+        self.entries = entries        # (produkt-ID, allergimask, pool) -> (ID-array, komplett)
+        self.signatures = signatures  # produkt-ID -> innehåll (för inkrementell uppbyggnad)
+
+
+class SubstitutionGraph:
+    """Top-k-alternativ per katalogprodukt och allergiprofil"""
+
+    def __init__(self, scraper, profiles=COMMON_ALLERGY_PROFILES, top_k=DEFAULT_TOP_K):
+        """
+        Args:
+            scraper: MatsparScraper vars katalog och rankingfunktioner används
+            profiles: Allergiprofiler att förberäkna
+            top_k: Max antal alternativ som sparas per nod och profil
+        """
+        self.scraper = scraper
+        self.masks = tuple(dict.fromkeys(allergy_mask(p) for p in profiles))
+        self.top_k = top_k
+        self._state = None
+        self._build_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': {'not_ready': 0, 'profile': 0, 'product': 0, 'budget': 0},
+            'builds': 0,
+            'rebuilt_products': 0,
+            'last_build_seconds': None
+        }
+
+    def start(self, mode=None):
+        """Bygg grafen enligt MATSPAR_SUBSTITUTION_GRAPH (background, sync eller off)"""
+        mode = mode or DEFAULT_BUILD_MODE
+        if mode == 'off':
+            return
+        if mode == 'sync':
+            self.build()
+            return
+        threading.Thread(target=self._build_safely, name='substitution-graph', daemon=True).start()
+
+    def _build_safely(self):
+        try:
+            self.build()
+        except Exception as e:
+            print(f"Substitutionsgrafen kunde inte byggas: {e}")
+
+    # ============== UPPBYGGNAD ==============
+
+    def build(self):
+        """
+        Bygg (om) grafen för scraperns aktuella katalog
+
+        Finns en graf för en tidigare katalog byggs bara noder om vars produkt har ändrats
+        eller vars kandidatpooler innehåller en ändrad kategori.
+
+        Returns:
+            Antal produkter vars alternativ räknades om
+        """
+        with self._build_lock:
+            started = time.monotonic()
+            catalog = self.scraper.catalog
+            previous = self._state
+
+            signatures = {p['id']: json.dumps(p, ensure_ascii=False, sort_keys=True) for p in catalog}
+            changed_categories = None  # None = bygg allt
+            if previous is not None:
+                changed_ids = {
+                    product_id for product_id in set(signatures) | set(previous.signatures)
+                    if signatures.get(product_id) != previous.signatures.get(product_id)
+                }
+                changed_categories = {
+                    product['category']
+                    for source in (previous.catalog, catalog)
+                    for product in map(source.get, changed_ids) if product is not None
+                }
+                # Ändrad ordning inom en kategori påverkar hur lika poäng sorteras
+                for category in set(previous.catalog.categories()) | set(catalog.categories()):
+                    old_order = [p['id'] for p in previous.catalog.by_category(category)]
+                    if old_order != [p['id'] for p in catalog.by_category(category)]:
+                        changed_categories.add(category)
+
+            ids = np.array([p['id'] for p in catalog], dtype=np.int64)
+            allowed = {mask: (catalog.features.allergens & mask) == 0 for mask in self.masks}
+
+            nodes = {}
+            entries = {}
+            rebuilt = 0
+            for product in catalog:
+                node = self._node(product)
+                nodes.setdefault(product_fingerprint(product), node)
+                if changed_categories is not None and not self._affected(node, changed_categories):
+                    for key in self._keys(node):
+                        entries[key] = previous.entries[key]
+                    continue
+                entries.update(self._edges(catalog, product, node, ids, allowed))
+                rebuilt += 1
+
+            # Kandidatraderna kommer från scraperns katalog - byttes den under uppbyggnaden
+            # är raderna blandade, och bygget som reload_catalog startade tar över
+            if self.scraper.catalog is not catalog:
+                return rebuilt
+            self._state = _GraphState(catalog, nodes, entries, signatures)
+
+        with self._stats_lock:
+            self._stats['builds'] += 1
+            self._stats['rebuilt_products'] = rebuilt
+            self._stats['last_build_seconds'] = round(time.monotonic() - started, 3)
+        return rebuilt
+
+    def _node(self, product):
+        """Nodinformation: vilka pooler find_alternatives kan välja för produkten"""
+        category = product.get('category', '')
+        profile = self.scraper._get_nutrition_profile(product.get('nutrition', {}))
+        related = self.scraper._get_related_categories(category, profile)
+        related_count = len(self.scraper._candidate_rows(category, profile, 'related'))
+        pools = ['related']
+        if category:
+            pools.append('same')
+        if not profile.get('high_protein'):
+            pools.append('all')
+        return {
+            'id': product['id'],
+            'category': category,
+            'related': related,
+            'related_count': related_count,
+            'high_protein': bool(profile.get('high_protein')),
+            'pools': pools
+        }
+
+    def _keys(self, node):
+        return [(node['id'], mask, pool) for pool in node['pools'] for mask in self.masks]
+
+    @staticmethod
+    def _affected(node, changed_categories):
+        """Påverkas nodens pooler av ändringar i de här kategorierna?"""
+        if not changed_categories:
+            return False
+        if 'all' in node['pools']:
+            return True
+        categories = {(category or '').lower() for category in node['related'] + [node['category']]}
+        return bool(categories & {(category or '').lower() for category in changed_categories})
+
+    def _edges(self, catalog, product, node, ids, allowed):
+        """Rankade alternativ för en produkt i alla pooler och allergiprofiler"""
+        scraper = self.scraper
+        profile = scraper._get_nutrition_profile(product.get('nutrition', {}))
+        product_type = scraper._get_product_type(product)
+
+        edges = {}
+        for pool in node['pools']:
+            candidate_rows = scraper._candidate_rows(product.get('category', ''), profile, pool)
+            candidate_rows = scraper._filter_candidate_rows(product, product_type, candidate_rows)
+            if len(candidate_rows):
+                # Hela rankingen - stabil sortering ger samma ordning som _top_k för varje k
+                scores = scraper._similarity_scores(product, profile, catalog.features.take(candidate_rows))
+                candidate_rows = candidate_rows[np.argsort(-scores, kind='stable')]
+            for mask in self.masks:
+                ranked = candidate_rows[allowed[mask][candidate_rows]]
+                edges[(node['id'], mask, pool)] = (
+                    ids[ranked[:self.top_k]].copy(),
+                    len(ranked) <= self.top_k
+                )
+        return edges
+
+    # ============== UPPSLAG ==============
+
+    def lookup(self, product, allergies, budget, same_category, limit):
+        """
+        Alternativ ur grafen, med samma resultat som find_alternatives
+
+        Returns:
+            Lista med katalogprodukter, eller None om svaret måste räknas live
+        """
+        state = self._state
+        if state is None or state.catalog is not self.scraper.catalog:
+            return self._miss('not_ready')
+
+        if unknown_allergies(allergies):
+            return self._miss('profile')
+        mask = allergy_mask(allergies)
+        if mask not in self.masks:
+            return self._miss('profile')
+
+        node = state.nodes.get(product_fingerprint(product))
+        if node is None:
+            return self._miss('product')
+
+        # Samma poolval som find_alternatives
+        if same_category and product.get('category'):
+            pool = 'same'
+        elif node['related_count'] < limit * 2 and not node['high_protein']:
+            pool = 'all'
+        else:
+            pool = 'related'
+
+        ranked, complete = state.entries[(node['id'], mask, pool)]
+        alternatives = []
+        for product_id in ranked.tolist():
+            if len(alternatives) >= limit:
+                break
+            candidate = state.catalog.get(product_id)
+            if budget:
+                prices = candidate.get('prices', {})
+                if not prices or min(prices.values()) > budget:
+                    continue
+            alternatives.append(candidate)
+
+        # Sparade top_k räckte inte efter budgetfiltret - resten av rankingen finns inte i grafen
+        if len(alternatives) < limit and not complete:
+            return self._miss('budget')
+
+        with self._stats_lock:
+            self._stats['lookups'] += 1
+            self._stats['hits'] += 1
+        return alternatives
+
+    def _miss(self, reason):
+        with self._stats_lock:
+            self._stats['lookups'] += 1
+            self._stats['misses'][reason] += 1
+        return None
+
+    def stats(self):
+        state = self._state
+        with self._stats_lock:
+            lookups = self._stats['lookups']
+            return {
+                'ready': state is not None,
+                'products': len(state.signatures) if state else 0,
+                'entries': len(state.entries) if state else 0,
+                'stored_ids': sum(len(ranked) for ranked, _ in state.entries.values()) if state else 0,
+                'profiles': len(self.masks),
+                'top_k': self.top_k,
+                'hit_rate': round(self._stats['hits'] / lookups, 3) if lookups else None,
+                **self._stats,
+                'misses': dict(self._stats['misses'])
+            }